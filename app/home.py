@@ -1,17 +1,27 @@
 import streamlit as st
 import os
 import sys
+import time
 
 # Add src directory to path
 sys.path.append(os.path.join(os.path.dirname(__file__), 'src'))
 
-from src.embeddings import get_embeddings
-from src.vector_store import load_vector_store
-from src.utils import load_environment
-from langchain_openai import ChatOpenAI
-from langchain.chains import create_retrieval_chain
-from langchain.chains.combine_documents import create_stuff_documents_chain
-from langchain_core.prompts import ChatPromptTemplate
+from src import startup
+
+# Only light modules are imported here; torch, LangChain and Pinecone load
+# in the background preload below or on first use
+with startup.timed("imports"):
+    from src import telemetry
+    from src.cache import AnswerCache, SemanticCache, TTLCache
+    from src.history import ChatHistory, prune_sessions
+    from src.rewrite import QueryRewriter, get_rewrite_mode
+    from src.chain import (
+        INDEX_NAME, build_context_compressor, build_llm, build_llm_router, build_rag_chain,
+        build_retriever, load_lexical_index, load_reranker, prompt_version
+    )
+    from src.filters import filter_key
+    from src.manifest import list_courses, load_index_version, load_manifest
+    from src.utils import load_environment, get_cache_path
 import warnings
 
 warnings.filterwarnings("ignore")
@@ -68,62 +78,90 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
+def load_components():
+    """Load the embedding model, vector store and LLM, timing each step"""
+    from src.embeddings import get_embeddings
+    from src.vector_store import load_vector_store
+    
+    # Load environment variables
+    load_environment()
+    
+    # Initialize embeddings
+    with startup.timed("embeddings"):
+        embeddings = get_embeddings()
+    
+    # Load vector store
+    with startup.timed("vector_store"):
+        vector_store = load_vector_store(INDEX_NAME, embeddings)
+    
+    # Initialize LLM, routed across LLM_MODELS with hedging and fallback
+    with startup.timed("llm"):
+        llm = build_llm_router(streaming=True)
+    
+    return embeddings, vector_store, llm
+
 @st.cache_resource
+def start_preload():
+    """Start loading models in background threads once per process, while the page renders"""
+    return {
+        "components": startup.Preloader("components", load_components),
+        "lexical_index": startup.Preloader("lexical_index", load_lexical_index),
+        "reranker": startup.Preloader("reranker", load_reranker),
+    }
+
 def initialize_components():
-    """Initialize all components with error handling"""
+    """Initialize all components with error handling, waiting for the preload if needed"""
     try:
-        # Load environment variables
-        load_environment()
-        
-        # Initialize embeddings
-        embeddings = get_embeddings()
-        
-        # Load vector store
-        vector_store = load_vector_store("fintutor", embeddings)
-        
-        # Initialize LLM - SIMPLIFIED to prevent repetition
-        llm = ChatOpenAI(
-            openai_api_key=os.getenv("OPEN_ROUTER_API_KEY"),
-            openai_api_base="https://openrouter.ai/api/v1",
-            model="mistralai/mistral-7b-instruct:free",
-            temperature=0.3,
-            max_tokens=300,
-            streaming=False,
-        )
-        
-        return embeddings, vector_store, llm
+        return start_preload()["components"].result()
         
     except Exception as e:
         st.error(f"Failed to initialize components: {str(e)}")
         return None, None, None
 
-def create_rag_chain(vector_store, llm):
-    """Create RAG chain for question answering"""
+@st.cache_resource
+def get_caches():
+    """Answer and retrieval caches shared across all sessions"""
+    answer_cache = AnswerCache(
+        get_cache_path("answers.sqlite"),
+        ttl=int(os.getenv("ANSWER_CACHE_TTL", str(7 * 24 * 3600))),
+        max_entries=int(os.getenv("ANSWER_CACHE_SIZE", "10000"))
+    )
+    retrieval_cache = TTLCache(
+        max_entries=int(os.getenv("RETRIEVAL_CACHE_SIZE", "4096")),
+        ttl=int(os.getenv("RETRIEVAL_CACHE_TTL", "3600"))
+    )
+    return answer_cache, retrieval_cache
+
+@st.cache_resource
+def get_semantic_cache():
+    """Near-duplicate question cache shared across all sessions"""
+    return SemanticCache(
+        max_entries=int(os.getenv("SEMANTIC_CACHE_SIZE", "2048")),
+        threshold=float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.92")),
+        ttl=int(os.getenv("ANSWER_CACHE_TTL", str(7 * 24 * 3600)))
+    )
+
+def get_lexical_index():
+    """BM25 index for hybrid retrieval, or None when it is not built or disabled"""
+    return start_preload()["lexical_index"].result()
+
+def get_reranker():
+    """Cross-encoder re-ranker, loaded once per process"""
+    return start_preload()["reranker"].result()
+
+def create_rag_chain(vector_store, llm, scope=None):
+    """Create RAG chain for question answering, searching only the chunks in `scope`"""
     try:
-        # Create retriever
-        retriever = vector_store.as_retriever(
-            search_type="similarity",
-            search_kwargs={"k": 3}
+        # Create retriever; results are cached by query embedding
+        _, retrieval_cache = get_caches()
+        retriever = build_retriever(
+            vector_store, retrieval_cache, k=3, lexical_index=get_lexical_index(), reranker=get_reranker(),
+            filter=scope
         )
         
-        # Simple prompt to prevent repetition
-        system_prompt = (
-            "You are a helpful finance tutor. "
-            "Answer the question based on the context provided. "
-            "Give a clear, concise answer in 2-3 sentences maximum. "
-            "Stop after giving one complete answer."
-            "\n\n"
-            "Context: {context}"
-        )
-        
-        prompt = ChatPromptTemplate.from_messages([
-            ("system", system_prompt),
-            ("human", "{input}"),
-        ])
-        
-        # Create chains
-        question_answer_chain = create_stuff_documents_chain(llm, prompt)
-        rag_chain = create_retrieval_chain(retriever, question_answer_chain)
+        # Create chains; retrieved chunks are compressed to the token budget
+        compressor = build_context_compressor(vector_store.embeddings)
+        rag_chain = build_rag_chain(retriever, llm, compressor)
         
         return rag_chain
         
@@ -131,45 +169,258 @@ def create_rag_chain(vector_store, llm):
         st.error(f"Failed to create RAG chain: {str(e)}")
         return None
 
-def process_user_question(question, rag_chain):
-    """Process a single user question and return response"""
+@st.cache_resource
+def get_rewrite_llm():
+    """Small non-streaming LLM client for QUERY_REWRITE=llm, bounded by REWRITE_TIMEOUT_MS"""
+    if get_rewrite_mode() != "llm":
+        return None
+    timeout = int(os.getenv("REWRITE_TIMEOUT_MS", "1500")) / 1000
+    return build_llm(streaming=False, timeout=timeout, max_retries=0, max_tokens=64)
+
+def get_rewriter():
+    """The session's follow-up question rewriter, memoizing rewrites for this conversation"""
+    if "rewriter" not in st.session_state:
+        st.session_state.rewriter = QueryRewriter(get_rewrite_llm())
+    return st.session_state.rewriter
+
+@st.cache_data(ttl=60)
+def get_courses():
+    """Ingested courses and their modules, from the ingestion manifest"""
+    manifest = load_manifest(get_cache_path(f"{INDEX_NAME}_manifest.json"), INDEX_NAME)
+    return list_courses(manifest)
+
+def select_scope():
+    """Sidebar course and module pickers, returning the session's retrieval filter"""
+    courses = get_courses()
+    if not courses:
+        return {}
+    
+    course = st.selectbox("Course", ["All courses"] + list(courses))
+    if course == "All courses":
+        return {}
+    module = st.selectbox("Module", ["All modules"] + courses[course])
+    return {"course": course} if module == "All modules" else {"course": course, "module": module}
+
+def render_message(role, content):
+    """Return the chat bubble HTML for one message"""
+    # No indentation, so that bubbles joined into one markdown block are not read as code
+    if role == "user":
+        css_class, icon, name = "user-message", "🧑‍💼", "You"
+    else:
+        css_class, icon, name = "bot-message", "🤖", "FinTutor"
+    return (
+        f'<div class="chat-message {css_class}">'
+        f'<div style="font-size: 1.5rem;">{icon}</div>'
+        f'<div class="message-content"><strong>{name}:</strong><br>\n{content}</div>'
+        f'</div>\n\n'
+    )
+
+@st.cache_resource
+def get_sessions_folder():
+    """Folder for spilled chat histories, pruned of abandoned sessions once per process"""
+    folder = get_cache_path("sessions")
+    prune_sessions(folder)
+    return folder
+
+def get_history():
+    """The session's chat history (HISTORY_WINDOW messages in memory, older ones on disk)"""
+    if "history" not in st.session_state:
+        st.session_state.history = ChatHistory(
+            get_sessions_folder(),
+            window=int(os.getenv("HISTORY_WINDOW", "50")),
+            render=render_message
+        )
+    return st.session_state.history
+
+def record_first_token(started):
+    """Track time-to-first-token for the current session"""
+    ttft = time.perf_counter() - started
+    history = st.session_state.setdefault("ttft_history", [])
+    history.append(ttft)
+    del history[:-50]
+    return ttft
+
+def stream_answer(question, rag_chain, placeholder):
+    """Stream the answer token by token into a chat bubble, returning (answer, context).
+    
+    The partial answer is kept in session state so that pressing Stop, which
+    interrupts this script run, can still keep what was generated so far.
+    """
+    started = time.perf_counter()
+    answer = ""
+    context = []
+    placeholder.markdown(render_message("assistant", "🤔 Thinking..."), unsafe_allow_html=True)
+    
+    for chunk in rag_chain.stream({"input": question}, config={"callbacks": telemetry.callbacks()}):
+        if "context" in chunk:
+            context = chunk["context"]
+        if "context_report" in chunk:
+            st.session_state.last_context_report = chunk["context_report"]
+        token = chunk.get("answer")
+        if not token:
+            continue
+        if not answer:
+            record_first_token(started)
+        answer += token
+        st.session_state.partial_answer = answer
+        placeholder.markdown(render_message("assistant", answer + "▌"), unsafe_allow_html=True)
+    
+    return answer, context
+
+def process_user_question(question, rag_chain, placeholder, turns=()):
+    """Process a single user question and return response, streaming it into placeholder.
+    
+    Follow-ups are first rewritten into a standalone query using the earlier
+    `turns`; retrieval, the answer and the caches all use that query.
+    """
+    with telemetry.trace("chat_query"):
+        with telemetry.span("rewrite"):
+            query = get_rewriter().rewrite(question, turns)
+        st.session_state.last_query = query
+        return answer_question(query, rag_chain, placeholder, st.session_state.get("scope"))
+
+def answer_question(question, rag_chain, placeholder, scope=None):
+    """Answer from the exact or semantic cache, else stream a new answer from the chain.
+    
+    Answers found within a course or module `scope` are cached under that
+    scope only, and bypass the semantic cache, which is shared by all scopes.
+    """
+    answer_cache, _ = get_caches()
+    semantic_cache = get_semantic_cache()
+    index_version = load_index_version(INDEX_NAME)
+    version = prompt_version()
+    namespace = f"{version}:{index_version}"
+    scope_key = filter_key(scope)
+    cache_key = AnswerCache.make_key(
+        question, version, f"{index_version}:{scope_key}" if scope_key else index_version
+    )
+    
+    started = time.perf_counter()
+    cached = answer_cache.get(cache_key)
+    if cached is not None:
+        telemetry.incr("fintutor_cache_hits_total", cache="answer")
+        record_first_token(started)
+        return cached["answer"]
+    telemetry.incr("fintutor_cache_misses_total", cache="answer")
+    
     try:
-        with st.spinner("🤔 Thinking..."):
-            response = rag_chain.invoke({"input": question})
-            return response.get("answer", "I'm sorry, I couldn't generate a response.")
+        # Paraphrases of an answered question skip retrieval and the LLM entirely
+        question_vector = None
+        if not scope_key:
+            embeddings, _, _ = initialize_components()
+            with telemetry.span("semantic_cache"):
+                question_vector = embeddings.embed_query(question)
+                match = semantic_cache.lookup(question_vector, namespace)
+            if match is not None:
+                telemetry.incr("fintutor_cache_hits_total", cache="semantic")
+                record_first_token(started)
+                return match[0]["answer"]
+            telemetry.incr("fintutor_cache_misses_total", cache="semantic")
+        
+        answer, context = stream_answer(question, rag_chain, placeholder)
+        if not answer:
+            return "I'm sorry, I couldn't generate a response."
+        
+        value = {
+            "answer": answer,
+            "sources": [doc.metadata for doc in context]
+        }
+        answer_cache.set(cache_key, value)
+        if question_vector is not None:
+            semantic_cache.add(question_vector, value, namespace)
+        return answer
     except Exception as e:
         return f"Sorry, I encountered an error: {str(e)}"
 
+def render_developer_panel():
+    """Optional sidebar panel with per-stage timings of recent queries"""
+    enabled = st.checkbox("🛠️ Developer panel", value=telemetry.ENABLED,
+                          help="Trace each query's stages (slightly slower while on)")
+    if enabled != telemetry.ENABLED:
+        telemetry.enable(enabled)
+    if not enabled:
+        return
+    
+    traces = [trace for trace in telemetry.recent_traces if trace["name"] == "chat_query"]
+    if not traces:
+        st.caption("No traced queries yet")
+    for trace in reversed(traces[-5:]):
+        with st.expander(f"{trace['ms']:.0f} ms · {time.strftime('%H:%M:%S', time.localtime(trace['timestamp']))}"):
+            st.dataframe(
+                [{"stage": span["name"], "start (ms)": round(span["offset_ms"]), "ms": round(span["ms"], 1)}
+                 for span in sorted(trace["spans"], key=lambda span: span["offset_ms"])],
+                hide_index=True
+            )
+    st.download_button("Download metrics (Prometheus)", telemetry.registry.render_prometheus(),
+                       file_name="fintutor_metrics.txt")
+
+def initialize_rag_chain():
+    """Build the session's RAG chain, waiting for the background preload to finish"""
+    with st.spinner("🔄 Initializing FinTutor... Please wait."):
+        embeddings, vector_store, llm = initialize_components()
+        
+        if embeddings and vector_store and llm:
+            rag_chain = create_rag_chain(vector_store, llm, st.session_state.get("scope"))
+            if rag_chain:
+                st.session_state.rag_chain = rag_chain
+                st.session_state.components_initialized = True
+            else:
+                st.error("❌ Failed to create RAG chain")
+                st.stop()
+        else:
+            st.error("❌ Failed to initialize components")
+            st.stop()
+
+def answer_in_run(question, history, placeholder):
+    """Answer a question within the current script run, streaming into the placeholder.
+    
+    If the run is interrupted (Stop, or another question), `processing` stays
+    set and the next run keeps the partial answer.
+    """
+    if "components_initialized" not in st.session_state:
+        initialize_rag_chain()
+    
+    st.session_state.processing = True
+    st.session_state.partial_answer = ""
+    turns = list(history)[:-1]  # the question itself is already appended
+    response = process_user_question(question, st.session_state.rag_chain, placeholder, turns)
+    placeholder.markdown(render_message("assistant", response), unsafe_allow_html=True)
+    
+    history.append("assistant", response)
+    st.session_state.pop("partial_answer", None)
+    st.session_state.processing = False
+
 def main():
+    run_started = time.perf_counter()
+    
     # Header
     st.markdown('<h1 class="main-header">💰 FinTutor Chatbot</h1>', unsafe_allow_html=True)
     st.markdown("### Your Personal Finance Learning Assistant")
     
     # Initialize session state
-    if "messages" not in st.session_state:
-        st.session_state.messages = []
+    history = get_history()
     if "processing" not in st.session_state:
         st.session_state.processing = False
-    if "stop_processing" not in st.session_state:
-        st.session_state.stop_processing = False
     
-    # Initialize components
-    if "components_initialized" not in st.session_state:
-        with st.spinner("🔄 Initializing FinTutor... Please wait."):
-            embeddings, vector_store, llm = initialize_components()
-            
-            if embeddings and vector_store and llm:
-                rag_chain = create_rag_chain(vector_store, llm)
-                if rag_chain:
-                    st.session_state.rag_chain = rag_chain
-                    st.session_state.components_initialized = True
-                    st.success("✅ FinTutor initialized successfully!")
-                else:
-                    st.error("❌ Failed to create RAG chain")
-                    st.stop()
-            else:
-                st.error("❌ Failed to initialize components")
-                st.stop()
+    # A run still marked as processing was interrupted by Stop or a new
+    # question; keep what was generated so far
+    if st.session_state.processing:
+        partial = st.session_state.pop("partial_answer", "")
+        st.session_state.processing = False
+        history.append(
+            "assistant",
+            f"{partial}<br><br>❌ Response generation stopped by user." if partial
+            else "❌ Response generation stopped by user."
+        )
+    
+    # Models load in the background while the page renders; the chain is
+    # only built once they are ready
+    preload = start_preload()
+    if "components_initialized" not in st.session_state and all(p.done() for p in preload.values()):
+        initialize_rag_chain()
+    
+    # A question is answered in the same script run that submits it
+    question = None
     
     # Sidebar
     with st.sidebar:
@@ -189,6 +440,12 @@ def main():
         """)
         st.markdown('</div>', unsafe_allow_html=True)
         
+        # Search scope; a new scope rebuilds the session's chain with its filter
+        scope = select_scope()
+        if scope != st.session_state.get("scope", {}):
+            st.session_state.scope = scope
+            st.session_state.pop("components_initialized", None)
+        
         # Sample questions
         st.markdown("### Try These Questions:")
         sample_questions = [
@@ -199,127 +456,108 @@ def main():
             "What is financial risk?"
         ]
         
-        for i, question in enumerate(sample_questions):
-            if st.button(question, key=f"sample_{i}", disabled=st.session_state.processing):
-                st.session_state.pending_question = question
-                st.rerun()
+        for i, sample in enumerate(sample_questions):
+            if st.button(sample, key=f"sample_{i}"):
+                question = sample
+        
+        # Cache effectiveness across all sessions
+        answer_cache, _ = get_caches()
+        st.caption(
+            f"Answer cache hit rate: {answer_cache.hit_rate():.0%} exact, "
+            f"{get_semantic_cache().hit_rate():.0%} semantic"
+        )
+        if st.session_state.get("ttft_history"):
+            st.caption(f"Last time to first token: {st.session_state.ttft_history[-1]:.2f}s")
+        report = st.session_state.get("last_context_report")
+        if report:
+            st.caption(f"Context: {report['tokens_after']} tokens ({report['tokens_saved']} saved)")
+        reranker = get_reranker() if start_preload()["reranker"].done() else None
+        if reranker is not None and reranker.reranked + reranker.fallbacks:
+            st.caption(f"Re-rank: {reranker.last_seconds * 1000:.0f} ms, {reranker.stats()['fallback_rate']:.0%} over budget")
+        llm = initialize_components()[2] if start_preload()["components"].done() else None
+        if llm is not None and len(llm.routes) > 1:
+            routes = [
+                f"{name} ({stats['latency_ms']:.0f} ms, {stats['breaker']})" if stats["latency_ms"] is not None
+                else f"{name} ({stats['breaker']})"
+                for name, stats in llm.stats().items()
+            ]
+            st.caption(f"LLM routing: {', '.join(routes)}")
+        
+        if startup.timings:
+            st.caption(f"Startup: {startup.report()}")
+        rewriter = get_rewriter()
+        if st.session_state.get("last_query") and rewriter.last and st.session_state.last_query != rewriter.last[0]:
+            st.caption(f"Searched for: {st.session_state.last_query} ({rewriter.last_ms:.1f} ms)")
+        if "last_run_ms" in st.session_state:
+            st.caption(f"Last page run: {st.session_state.last_run_ms:.0f} ms")
+        
+        render_developer_panel()
         
         # Clear chat button
-        if st.button("🗑️ Clear Chat History", disabled=st.session_state.processing):
-            st.session_state.messages = []
-            st.rerun()
-
-    # Display chat messages
+        if st.button("🗑️ Clear Chat History"):
+            history.clear()
+            get_rewriter().clear()
+            st.session_state.pop("older_shown", None)
+    
+    # Chat messages are filled in below, once the input has been read
     chat_container = st.container()
+    indicator = st.empty()
     
-    with chat_container:
-        if not st.session_state.messages:
-            st.info("👋 Welcome to FinTutor! Ask me anything about finance, investments, bonds, or market analysis.")
-        
-        for message in st.session_state.messages:
-            if message["role"] == "user":
-                st.markdown(f'''
-                <div class="chat-message user-message">
-                    <div style="font-size: 1.5rem;">🧑‍💼</div>
-                    <div class="message-content">
-                        <strong>You:</strong><br>
-                        {message["content"]}
-                    </div>
-                </div>
-                ''', unsafe_allow_html=True)
-            else:
-                st.markdown(f'''
-                <div class="chat-message bot-message">
-                    <div style="font-size: 1.5rem;">🤖</div>
-                    <div class="message-content">
-                        <strong>FinTutor:</strong><br>
-                        {message["content"]}
-                    </div>
-                </div>
-                ''', unsafe_allow_html=True)
-
-    # Processing indicator
-    if st.session_state.processing:
-        st.markdown('''
-        <div class="processing-indicator">
-            <strong>🤔 Processing your question...</strong><br>
-            Please wait while I generate a response.
-        </div>
-        ''', unsafe_allow_html=True)
-
     # Chat input section
     st.markdown("---")
     
-    # Input and buttons
-    col1, col2, col3 = st.columns([6, 1, 1])
+    # Input and buttons; the form clears its input on submit without a rerun
+    col1, col2 = st.columns([7, 1], vertical_alignment="bottom")
     
     with col1:
-        # Use a dynamic key to allow input clearing
-        input_key = f"user_input_{len(st.session_state.messages)}"
-        user_input = st.text_input(
-            "Ask your finance question:",
-            placeholder="e.g., What is the difference between stocks and bonds?",
-            disabled=st.session_state.processing,
-            key=input_key
-        )
+        with st.form("ask_form", clear_on_submit=True, border=False):
+            input_col, ask_col = st.columns([6, 1], vertical_alignment="bottom")
+            with input_col:
+                user_input = st.text_input(
+                    "Ask your finance question:",
+                    placeholder="e.g., What is the difference between stocks and bonds?"
+                )
+            with ask_col:
+                submitted = st.form_submit_button("Ask 💬", type="primary")
+    if submitted and user_input.strip():
+        question = user_input.strip()
     
     with col2:
-        ask_button = st.button(
-            "Ask 💬", 
-            type="primary",
-            disabled=st.session_state.processing or not user_input.strip()
-        )
-    
-    with col3:
-        stop_button = st.button(
+        # Clicking Stop interrupts the answering run; the next run keeps the partial answer
+        st.button(
             "🛑 Stop",
-            disabled=not st.session_state.processing,
+            disabled=question is None,
             help="Stop current response generation"
         )
-
-    # Handle stop button
-    if stop_button:
-        st.session_state.stop_processing = True
-        st.session_state.processing = False
-        st.session_state.messages.append({
-            "role": "assistant", 
-            "content": "❌ Response generation stopped by user."
-        })
-        st.rerun()
-
-    # Handle pending question from sidebar
-    if hasattr(st.session_state, 'pending_question') and not st.session_state.processing:
-        question = st.session_state.pending_question
-        delattr(st.session_state, 'pending_question')
+    
+    with chat_container:
+        if not len(history) and question is None:
+            st.info("👋 Welcome to FinTutor! Ask me anything about finance, investments, bonds, or market analysis.")
         
-        # Add user message and start processing
-        st.session_state.messages.append({"role": "user", "content": question})
-        st.session_state.processing = True
-        st.session_state.stop_processing = False
-        st.rerun()
-
-    # Handle ask button
-    if ask_button and user_input.strip() and not st.session_state.processing:
-        # Add user message and start processing
-        st.session_state.messages.append({"role": "user", "content": user_input})
-        st.session_state.processing = True
-        st.session_state.stop_processing = False
-        # Note: Input will clear automatically on rerun due to disabled state
-        st.rerun()
-
-    # Process question if needed
-    if st.session_state.processing and not st.session_state.stop_processing:
-        # Get the last user message
-        last_message = st.session_state.messages[-1]
-        if last_message["role"] == "user":
-            # Generate response
-            response = process_user_question(last_message["content"], st.session_state.rag_chain)
-            
-            # Add response and stop processing
-            st.session_state.messages.append({"role": "assistant", "content": response})
-            st.session_state.processing = False
-            st.rerun()
-
+        # Spilled messages are only read back from disk on request
+        if history.spilled:
+            shown = st.session_state.get("older_shown", 0)
+            if shown < history.spilled and st.button(f"⬆️ Show earlier messages ({history.spilled - shown} more)"):
+                shown = st.session_state.older_shown = min(history.spilled, shown + history.window)
+            if shown:
+                st.markdown(history.older(shown), unsafe_allow_html=True)
+        
+        # The rendered window is emitted as one element rather than one per message
+        if len(history.messages):
+            st.markdown(history.html(), unsafe_allow_html=True)
+        
+        if question is not None:
+            history.append("user", question)
+            st.markdown(render_message("user", question), unsafe_allow_html=True)
+            indicator.markdown('''
+            <div class="processing-indicator">
+                <strong>🤔 Processing your question...</strong><br>
+                Please wait while I generate a response.
+            </div>
+            ''', unsafe_allow_html=True)
+            answer_in_run(question, history, st.empty())
+            indicator.empty()
+    
     # Footer
     st.markdown("---")
     st.markdown(
@@ -329,6 +567,10 @@ def main():
         "</div>",
         unsafe_allow_html=True
     )
+    
+    elapsed = time.perf_counter() - run_started
+    st.session_state.last_run_ms = elapsed * 1000
+    telemetry.observe("fintutor_ui_run_seconds", elapsed, kind="question" if question else "render")
 
 if __name__ == "__main__":
     main()
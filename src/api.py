@@ -0,0 +1,280 @@
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from aiohttp import web
+
+# Add src directory to path
+sys.path.append(os.path.join(os.path.dirname(__file__), 'src'))
+
+from src import startup, telemetry
+from src.cache import AnswerCache, TTLCache
+from src.chain import (
+    INDEX_NAME, build_context_compressor, build_llm_router, build_rag_chain, build_retriever,
+    load_lexical_index, load_reranker, prompt_version
+)
+from src.embeddings import get_embeddings
+from src.manifest import load_index_version
+from src.utils import load_environment, get_cache_path
+from src.vector_store import load_vector_store
+
+class RAGService:
+    """Headless asyncio service answering questions with the FinTutor RAG chain.
+    
+    One pooled HTTP client is shared by every LLM call, and a semaphore caps
+    how many chain invocations reach the LLM at once. Requests beyond that
+    wait in a bounded queue; once `max_queue` are waiting, new requests are
+    rejected with 503 so clients back off instead of piling up. Every request
+    is bounded by `request_timeout` seconds.
+    """
+    
+    def __init__(self, max_concurrent=32, max_queue=256, request_timeout=60.0,
+                 max_connections=100, search_threads=32):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.request_timeout = request_timeout
+        self.max_connections = max_connections
+        self.search_threads = search_threads
+        self.semaphore = asyncio.Semaphore(max_concurrent)
+        self.queued = 0
+        self.in_flight = 0
+        self.rag_chain = None
+        self.answer_cache = None
+        self.http_client = None
+        self.reranker = None
+        self.llm = None
+    
+    async def startup(self, app):
+        import httpx
+        
+        load_environment()
+        loop = asyncio.get_running_loop()
+        
+        # Synchronous vector searches run here when the chain is awaited
+        loop.set_default_executor(ThreadPoolExecutor(max_workers=self.search_threads))
+        
+        def load_store():
+            with startup.timed("embeddings"):
+                embeddings = get_embeddings()
+            with startup.timed("vector_store"):
+                return embeddings, load_vector_store(INDEX_NAME, embeddings)
+        
+        def timed_load(name, func):
+            with startup.timed(name):
+                return func()
+        
+        # The models and indexes load concurrently
+        (embeddings, vector_store), lexical_index, self.reranker = await asyncio.gather(
+            loop.run_in_executor(None, load_store),
+            loop.run_in_executor(None, timed_load, "lexical_index", load_lexical_index),
+            loop.run_in_executor(None, timed_load, "reranker", load_reranker),
+        )
+        
+        self.http_client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=self.max_connections,
+                max_keepalive_connections=self.max_connections
+            ),
+            timeout=self.request_timeout
+        )
+        self.llm = build_llm_router(
+            streaming=True, http_async_client=self.http_client, timeout=self.request_timeout
+        )
+        retriever = build_retriever(
+            vector_store, TTLCache(max_entries=4096, ttl=3600), k=3, lexical_index=lexical_index,
+            reranker=self.reranker
+        )
+        self.rag_chain = build_rag_chain(retriever, self.llm, build_context_compressor(embeddings))
+        self.answer_cache = AnswerCache(get_cache_path("answers.sqlite"))
+        print(f"Startup: {startup.report()}")
+    
+    async def cleanup(self, app):
+        if self.http_client is not None:
+            await self.http_client.aclose()
+        if self.reranker is not None:
+            self.reranker.close()
+    
+    async def acquire(self):
+        """Wait for an LLM slot, rejecting the request if the queue is full"""
+        if self.semaphore.locked() and self.queued >= self.max_queue:
+            raise web.HTTPServiceUnavailable(
+                text=json.dumps({"error": "server busy, retry later"}),
+                content_type="application/json",
+                headers={"Retry-After": "1"}
+            )
+        self.queued += 1
+        try:
+            await self.semaphore.acquire()
+        finally:
+            self.queued -= 1
+        self.in_flight += 1
+    
+    def release(self):
+        self.in_flight -= 1
+        self.semaphore.release()
+    
+    async def read_question(self, request):
+        try:
+            data = await request.json()
+        except ValueError:
+            raise web.HTTPBadRequest(text=json.dumps({"error": "invalid JSON"}), content_type="application/json")
+        question = str(data.get("question", "")).strip()
+        if not question:
+            raise web.HTTPBadRequest(text=json.dumps({"error": "missing question"}), content_type="application/json")
+        return question
+    
+    def cache_key(self, question):
+        return AnswerCache.make_key(question, prompt_version(), load_index_version(INDEX_NAME))
+    
+    def _lookup(self, question):
+        cache_key = self.cache_key(question)
+        return cache_key, self.answer_cache.get(cache_key)
+    
+    async def lookup(self, question):
+        """The answer-cache key and cached answer, read on the executor since SQLite blocks"""
+        return await asyncio.get_running_loop().run_in_executor(None, self._lookup, question)
+    
+    async def store(self, cache_key, value):
+        await asyncio.get_running_loop().run_in_executor(None, self.answer_cache.set, cache_key, value)
+    
+    async def handle_ask(self, request):
+        started = time.perf_counter()
+        question = await self.read_question(request)
+        
+        cache_key, cached = await self.lookup(question)
+        telemetry.incr("fintutor_cache_hits_total" if cached else "fintutor_cache_misses_total", cache="answer")
+        if cached is not None:
+            return web.json_response({**cached, "cached": True, "seconds": time.perf_counter() - started})
+        
+        await self.acquire()
+        try:
+            response = await asyncio.wait_for(
+                self.rag_chain.ainvoke({"input": question}, config={"callbacks": telemetry.callbacks()}),
+                timeout=self.request_timeout
+            )
+        except asyncio.TimeoutError:
+            raise web.HTTPGatewayTimeout(text=json.dumps({"error": "timed out"}), content_type="application/json")
+        finally:
+            self.release()
+        
+        value = {
+            "answer": response.get("answer", ""),
+            "sources": [doc.metadata for doc in response.get("context", [])]
+        }
+        if value["answer"]:
+            await self.store(cache_key, value)
+        return web.json_response({**value, "cached": False, "context_report": response.get("context_report"),
+                                  "seconds": time.perf_counter() - started})
+    
+    async def handle_stream(self, request):
+        """Stream answer tokens as server-sent events, ending with a `done` or `error` event"""
+        started = time.perf_counter()
+        question = await self.read_question(request)
+        
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream", "Cache-Control": "no-cache"})
+        
+        async def send(event, payload):
+            await response.write(f"event: {event}\ndata: {json.dumps(payload)}\n\n".encode("utf-8"))
+        
+        cache_key, cached = await self.lookup(question)
+        telemetry.incr("fintutor_cache_hits_total" if cached else "fintutor_cache_misses_total", cache="answer")
+        if cached is not None:
+            await response.prepare(request)
+            await send("token", {"token": cached["answer"]})
+            await send("done", {"sources": cached["sources"], "cached": True,
+                                "seconds": time.perf_counter() - started})
+            return response
+        
+        await self.acquire()
+        try:
+            await response.prepare(request)
+            answer, sources, first_token, context_report = "", [], None, None
+            async with asyncio.timeout(self.request_timeout):
+                async for chunk in self.rag_chain.astream({"input": question},
+                                                          config={"callbacks": telemetry.callbacks()}):
+                    if "context" in chunk:
+                        sources = [doc.metadata for doc in chunk["context"]]
+                    if "context_report" in chunk:
+                        context_report = chunk["context_report"]
+                    token = chunk.get("answer")
+                    if token:
+                        if first_token is None:
+                            first_token = time.perf_counter() - started
+                        answer += token
+                        await send("token", {"token": token})
+            
+            if answer:
+                await self.store(cache_key, {"answer": answer, "sources": sources})
+            await send("done", {"sources": sources, "cached": False, "first_token_seconds": first_token,
+                                "context_report": context_report, "seconds": time.perf_counter() - started})
+        except TimeoutError:
+            await send("error", {"error": "timed out"})
+        except ConnectionResetError:
+            # The client went away; abandoning the stream cancels the LLM request
+            pass
+        except Exception as e:
+            # Without an explicit event the client would take the closed stream for a complete answer
+            print(f"Streaming answer failed: {e}")
+            try:
+                await send("error", {"error": "failed to answer"})
+            except ConnectionResetError:
+                pass
+        finally:
+            self.release()
+        return response
+    
+    async def handle_health(self, request):
+        return web.json_response({
+            "status": "ok" if self.rag_chain is not None else "starting",
+            "in_flight": self.in_flight,
+            "queued": self.queued,
+            "max_concurrent": self.max_concurrent,
+            "rerank": self.reranker.stats() if self.reranker is not None else None,
+            "llm": self.llm.stats() if self.llm is not None else None,
+            "startup_seconds": startup.timings,
+        })
+    
+    async def handle_metrics(self, request):
+        """Prometheus metrics (empty unless TELEMETRY=1)"""
+        return web.Response(text=telemetry.registry.render_prometheus(), content_type="text/plain")
+    
+    @web.middleware
+    async def trace_requests(self, request, handler):
+        """Trace each question so its stage spans are grouped together"""
+        if not request.path.startswith("/ask"):
+            return await handler(request)
+        with telemetry.trace(request.path):
+            return await handler(request)
+    
+    def create_app(self):
+        app = web.Application(middlewares=[self.trace_requests])
+        app.on_startup.append(self.startup)
+        app.on_cleanup.append(self.cleanup)
+        app.router.add_post("/ask", self.handle_ask)
+        app.router.add_post("/ask/stream", self.handle_stream)
+        app.router.add_get("/health", self.handle_health)
+        app.router.add_get("/metrics", self.handle_metrics)
+        return app
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve the FinTutor RAG chain over HTTP")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--max-concurrent", type=int, default=int(os.getenv("API_MAX_CONCURRENT", "32")),
+                        help="concurrent chain invocations (LLM calls)")
+    parser.add_argument("--max-queue", type=int, default=int(os.getenv("API_MAX_QUEUE", "256")),
+                        help="requests allowed to wait for a slot before 503s")
+    parser.add_argument("--timeout", type=float, default=float(os.getenv("API_REQUEST_TIMEOUT", "60")),
+                        help="per-request timeout in seconds")
+    args = parser.parse_args()
+    
+    service = RAGService(
+        max_concurrent=args.max_concurrent,
+        max_queue=args.max_queue,
+        request_timeout=args.timeout
+    )
+    web.run_app(service.create_app(), host=args.host, port=args.port)
@@ -0,0 +1,256 @@
+import argparse
+import asyncio
+import csv
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+# Add src directory to path
+sys.path.append(os.path.join(os.path.dirname(__file__), 'src'))
+
+from src.cache import AnswerCache
+from src.chain import (
+    INDEX_NAME, build_answer_chain, build_context_compressor, build_llm_router, build_retriever,
+    load_lexical_index, load_reranker, prompt_version
+)
+from src.embeddings import get_embeddings
+from src.filters import filter_key
+from src.manifest import load_index_version
+from src.utils import get_cache_path, load_environment
+from src.vector_store import load_vector_store
+
+def read_questions(path):
+    """Read questions from .txt (one per line), .csv (a "question" column) or .jsonl.
+    
+    JSONL rows are {"question": ..., "relevant": [...]}, where the optional
+    relevance labels are chunk IDs or {"source": ..., "page": ...} dicts
+    used to score retrieval recall.
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        if path.endswith(".jsonl"):
+            rows = [json.loads(line) for line in f if line.strip()]
+        elif path.endswith(".csv"):
+            rows = [{"question": row["question"]} for row in csv.DictReader(f)]
+        else:
+            rows = [{"question": line.strip()} for line in f if line.strip() and not line.startswith("#")]
+    return [row for row in rows if row.get("question", "").strip()]
+
+def _encode(embeddings, texts):
+    if hasattr(embeddings, "encode"):
+        return np.asarray(embeddings.encode(texts), dtype=np.float32)
+    return np.asarray(embeddings.embed_documents(texts), dtype=np.float32)
+
+class QueryVectors(Embeddings):
+    """Serves query vectors embedded up front in one batch, so retrieval never re-embeds a question"""
+    
+    def __init__(self, embeddings, questions):
+        self.embeddings = embeddings
+        self.dimension = getattr(embeddings, "dimension", None)
+        started = time.perf_counter()
+        self.vectors = dict(zip(questions, _encode(embeddings, questions)))
+        self.seconds = time.perf_counter() - started
+    
+    def encode(self, texts):
+        texts = list(texts)
+        missing = [text for text in texts if text not in self.vectors]
+        if missing:
+            self.vectors.update(zip(missing, _encode(self.embeddings, missing)))
+        return np.stack([self.vectors[text] for text in texts])
+    
+    def embed_documents(self, texts):
+        return self.encode(texts).tolist()
+    
+    def embed_query(self, text):
+        return self.encode([text])[0].tolist()
+
+class RateLimiter:
+    """Spaces the start of calls at least 1 / `rate` seconds apart"""
+    
+    def __init__(self, rate):
+        self.interval = 1 / rate if rate > 0 else 0.0
+        self.next_start = 0.0
+        self.lock = asyncio.Lock()
+    
+    async def wait(self):
+        async with self.lock:
+            now = time.monotonic()
+            delay = self.next_start - now
+            self.next_start = max(now, self.next_start) + self.interval
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+def is_relevant(doc, label):
+    """Whether a retrieved document matches a chunk ID or a {"source", "page"} label"""
+    if isinstance(label, str):
+        return doc.id == label
+    source = label.get("source")
+    if source and os.path.basename(doc.metadata.get("source", "")) != os.path.basename(source):
+        return False
+    return "page" not in label or doc.metadata.get("page") == label["page"]
+
+def score_retrieval(docs, labels):
+    """Recall of the labels in the retrieved documents, and the reciprocal rank of the first hit"""
+    hits = [any(is_relevant(doc, label) for label in labels) for doc in docs]
+    found = sum(any(is_relevant(doc, label) for doc in docs) for label in labels)
+    first = hits.index(True) + 1 if any(hits) else None
+    return found / len(labels), 1 / first if first else 0.0
+
+def retrieve_all(retriever, records, workers=16):
+    """Run every question's retrieval concurrently, recording its latency"""
+    def retrieve(record):
+        started = time.perf_counter()
+        try:
+            return retriever.invoke(record["question"])
+        except Exception as e:
+            record["error"] = f"retrieval failed: {e}"
+            return []
+        finally:
+            record["timings"]["retrieve_ms"] = (time.perf_counter() - started) * 1000
+    
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(retrieve, records))
+
+async def answer_all(answer_chain, compressor, records, contexts, max_concurrent=4, rate=1.0):
+    """Generate answers from retrieved contexts, `max_concurrent` at a time and at most `rate` calls/s"""
+    semaphore = asyncio.Semaphore(max_concurrent)
+    limiter = RateLimiter(rate)
+    
+    async def answer(record, docs):
+        async with semaphore:
+            await limiter.wait()
+            started = time.perf_counter()
+            try:
+                if compressor is not None:
+                    docs, record["context_report"] = await asyncio.to_thread(
+                        compressor.compress, record["question"], docs
+                    )
+                record["answer"] = await answer_chain.ainvoke({"input": record["question"], "context": docs})
+                record["sources"] = [{**doc.metadata, "id": doc.id} for doc in docs]
+            except Exception as e:
+                record["error"] = f"generation failed: {e}"
+            finally:
+                record["timings"]["llm_ms"] = (time.perf_counter() - started) * 1000
+    
+    await asyncio.gather(*(
+        answer(record, docs)
+        for record, docs in zip(records, contexts)
+        if "answer" not in record and "error" not in record
+    ))
+
+def summarize(records, embed_seconds, k):
+    """Aggregate latencies, errors and retrieval quality over a batch"""
+    summary = {
+        "questions": len(records),
+        "errors": sum("error" in record for record in records),
+        "cached": sum(record.get("cached", False) for record in records),
+        "embed_ms_total": embed_seconds * 1000,
+    }
+    for stage in ("retrieve_ms", "llm_ms"):
+        values = [record["timings"][stage] for record in records if stage in record["timings"]]
+        if values:
+            summary[f"{stage[:-3]}_p50_ms"] = float(np.percentile(values, 50))
+            summary[f"{stage[:-3]}_p95_ms"] = float(np.percentile(values, 95))
+    labelled = [record for record in records if f"recall@{k}" in record]
+    if labelled:
+        summary[f"recall@{k}"] = float(np.mean([record[f"recall@{k}"] for record in labelled]))
+        summary["mrr"] = float(np.mean([record["mrr"] for record in labelled]))
+    return summary
+
+def run_batch(rows, output_path, k=3, retrieval_only=False, max_concurrent=4, rate=1.0, search_workers=16,
+              warm_cache=False, filter=None):
+    """Answer a batch of questions and write one JSON line per question.
+    
+    Questions are embedded in one batched call, searched concurrently, and
+    answered under a concurrency cap and rate limit. With `warm_cache`,
+    answers already in the answer cache are reused and new ones are stored,
+    so the app serves them without calling the LLM. With `retrieval_only`
+    the LLM is never called and no network access is needed against the
+    local index. A metadata `filter` ({"course": ..., "module": ...})
+    restricts retrieval, and cached answers are keyed by it as in the app.
+    """
+    started = time.perf_counter()
+    records = [{"question": row["question"].strip(), "timings": {}} for row in rows]
+    
+    print(f"🔤 Embedding {len(records)} questions...")
+    embeddings = get_embeddings()
+    query_vectors = QueryVectors(embeddings, [record["question"] for record in records])
+    vector_store = load_vector_store(INDEX_NAME, query_vectors)
+    reranker = load_reranker()
+    retriever = build_retriever(
+        vector_store, k=k, lexical_index=load_lexical_index(), reranker=reranker, filter=filter
+    )
+    
+    answer_cache = None
+    if warm_cache and not retrieval_only:
+        answer_cache = AnswerCache(
+            get_cache_path("answers.sqlite"),
+            ttl=int(os.getenv("ANSWER_CACHE_TTL", str(7 * 24 * 3600))),
+            max_entries=int(os.getenv("ANSWER_CACHE_SIZE", "10000"))
+        )
+        index_version = load_index_version(INDEX_NAME)
+        if filter_key(filter):
+            index_version = f"{index_version}:{filter_key(filter)}"
+        version = prompt_version()
+        for record in records:
+            record["cache_key"] = AnswerCache.make_key(record["question"], version, index_version)
+            cached = answer_cache.get(record["cache_key"])
+            if cached is not None:
+                record.update(cached, cached=True)
+    
+    print("🔍 Retrieving context...")
+    contexts = retrieve_all(retriever, records, workers=search_workers)
+    for row, record, docs in zip(rows, records, contexts):
+        record["retrieved"] = [{**doc.metadata, "id": doc.id} for doc in docs]
+        if row.get("relevant"):
+            record[f"recall@{k}"], record["mrr"] = score_retrieval(docs, row["relevant"])
+    
+    if not retrieval_only:
+        print("💬 Generating answers...")
+        llm = build_llm_router(streaming=False)
+        asyncio.run(answer_all(
+            build_answer_chain(llm), build_context_compressor(embeddings), records, contexts,
+            max_concurrent=max_concurrent, rate=rate
+        ))
+    
+    with open(output_path, "w", encoding="utf-8") as f:
+        for record in records:
+            cache_key = record.pop("cache_key", None)
+            if answer_cache is not None and record.get("answer") and not record.get("cached"):
+                answer_cache.set(cache_key, {"answer": record["answer"], "sources": record["sources"]})
+            record["timings"]["total_ms"] = sum(record["timings"].values())
+            f.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+    
+    if reranker is not None:
+        reranker.close()
+    summary = summarize(records, query_vectors.seconds, k)
+    summary["seconds"] = time.perf_counter() - started
+    return summary
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Answer a file of questions with the FinTutor RAG chain")
+    parser.add_argument("questions", help="questions file (.txt, .csv or .jsonl with relevance labels)")
+    parser.add_argument("--output", default="batch_answers.jsonl", help="JSONL file of answers and timings")
+    parser.add_argument("--k", type=int, default=3, help="chunks retrieved per question")
+    parser.add_argument("--retrieval-only", action="store_true",
+                        help="skip the LLM, e.g. for an offline recall@k benchmark against the local index")
+    parser.add_argument("--max-concurrent", type=int, default=4, help="LLM calls in flight at once")
+    parser.add_argument("--rate", type=float, default=1.0, help="LLM calls started per second (0 for no limit)")
+    parser.add_argument("--search-workers", type=int, default=16, help="concurrent vector searches")
+    parser.add_argument("--warm-cache", action="store_true", help="store new answers in the answer cache")
+    parser.add_argument("--course", help="only retrieve from this course")
+    parser.add_argument("--module", help="only retrieve from this module")
+    args = parser.parse_args()
+    
+    load_environment(require_llm=not args.retrieval_only)
+    summary = run_batch(
+        read_questions(args.questions), args.output, k=args.k, retrieval_only=args.retrieval_only,
+        max_concurrent=args.max_concurrent, rate=args.rate, search_workers=args.search_workers,
+        warm_cache=args.warm_cache, filter={"course": args.course, "module": args.module}
+    )
+    print(json.dumps(summary, indent=2))
+    print(f"✅ Wrote {summary['questions']} answers to {args.output}")
@@ -0,0 +1,313 @@
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+SAMPLE_PDF = os.path.join("Data", "Binomial Trees-ii.pdf")
+
+# Metrics where a lower value is better; everything else is a throughput
+LOWER_IS_BETTER = ("_ms", "_seconds")
+
+FINANCE_SENTENCES = [
+    "A bond is a debt security that pays periodic coupons and returns the principal at maturity.",
+    "The yield to maturity is the discount rate that equates the bond price with its cash flows.",
+    "Duration measures the sensitivity of a bond price to changes in interest rates.",
+    "A call option gives the holder the right, but not the obligation, to buy the underlying asset.",
+    "In a binomial tree the stock price moves up by a factor u or down by a factor d each step.",
+    "The risk-neutral probability is p = (e^(r dt) - d) / (u - d).",
+    "Delta hedging offsets the option position with a position in the underlying stock.",
+    "Diversification reduces unsystematic risk but cannot remove market risk.",
+    "The capital asset pricing model relates expected return to beta and the market risk premium.",
+    "Net present value discounts future cash flows at the opportunity cost of capital.",
+    "A forward contract obliges both parties to trade the asset at a fixed price on a future date.",
+    "Volatility is the annualized standard deviation of log returns.",
+    "Put-call parity links the prices of European calls and puts with the same strike and maturity.",
+    "Working capital is current assets minus current liabilities.",
+    "The price-to-earnings ratio compares a share price with earnings per share.",
+]
+
+QUERIES = [
+    "What is a bond?",
+    "How is the risk-neutral probability computed in a binomial tree?",
+    "What does duration measure?",
+    "Explain delta hedging",
+    "What is put-call parity?",
+    "How does diversification reduce risk?",
+    "What is net present value?",
+    "Define volatility",
+]
+
+def _pdf_escape(text):
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+def write_pdf(path, pages, font_size=10, line_height=13, width=90):
+    """Write a minimal text-only PDF with one list of paragraphs per page"""
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>", None,
+               b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>"]
+    page_ids = []
+    for paragraphs in pages:
+        lines = []
+        for paragraph in paragraphs:
+            words, line = paragraph.split(), ""
+            for word in words:
+                if len(line) + len(word) + 1 > width:
+                    lines.append(line)
+                    line = word
+                else:
+                    line = f"{line} {word}" if line else word
+            lines.extend([line, ""])
+        text = "\n".join(f"({_pdf_escape(line)}) Tj T*" for line in lines[:56])
+        stream = f"BT /F1 {font_size} Tf {line_height} TL 50 760 Td\n{text}\nET".encode("latin-1", "replace")
+        objects.append(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+        objects.append(None)
+        page_ids.append(len(objects))
+        objects[-1] = (f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+                       f"/Resources << /Font << /F1 3 0 R >> >> /Contents {len(objects) - 1} 0 R >>").encode()
+    kids = " ".join(f"{i} 0 R" for i in page_ids)
+    objects[1] = f"<< /Type /Pages /Kids [{kids}] /Count {len(page_ids)} >>".encode()
+    
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    out += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    with open(path, "wb") as f:
+        f.write(out)
+
+def generate_corpus(folder, files=10, pages_per_file=20, seed=0, include_sample=True):
+    """Write synthetic finance PDFs (plus the real sample PDF) into a folder"""
+    rng = random.Random(seed)
+    os.makedirs(folder, exist_ok=True)
+    for number in range(files):
+        pages = [
+            [" ".join(rng.choice(FINANCE_SENTENCES) for _ in range(rng.randint(3, 6))) for _ in range(5)]
+            for _ in range(pages_per_file)
+        ]
+        write_pdf(os.path.join(folder, f"synthetic_{number:03d}.pdf"), pages)
+    if include_sample and os.path.exists(SAMPLE_PDF):
+        shutil.copy(SAMPLE_PDF, folder)
+    return folder
+
+def timed(func, *args, **kwargs):
+    started = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - started
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def serve_in_thread(app):
+    """Run an aiohttp app on a background thread, returning (base_url, stop)"""
+    from aiohttp import web
+    
+    port = free_port()
+    loop = asyncio.new_event_loop()
+    runner = web.AppRunner(app)
+    ready = threading.Event()
+    
+    def run():
+        asyncio.set_event_loop(loop)
+        loop.run_until_complete(runner.setup())
+        loop.run_until_complete(web.TCPSite(runner, "127.0.0.1", port).start())
+        ready.set()
+        loop.run_forever()
+    
+    def stop():
+        asyncio.run_coroutine_threadsafe(runner.cleanup(), loop).result(timeout=10)
+        loop.call_soon_threadsafe(loop.stop)
+    
+    threading.Thread(target=run, daemon=True).start()
+    ready.wait(timeout=10)
+    return f"http://127.0.0.1:{port}", stop
+
+def percentiles(latencies):
+    values = np.asarray(latencies) * 1000
+    return {f"p{p}_ms": float(np.percentile(values, p)) for p in (50, 95, 99)}
+
+def bench_load(folder, results):
+    from src.loaders import load_pdf_file
+    
+    for mode, parallel in (("serial", False), ("parallel", True)):
+        docs, seconds = timed(load_pdf_file, folder, parallel=parallel)
+        results[f"load.{mode}.pages_per_sec"] = len(docs) / seconds
+    
+    if os.path.exists(SAMPLE_PDF):
+        from src.loaders import load_pdf
+        pages, seconds = timed(load_pdf, SAMPLE_PDF)
+        results["load.sample.pages_per_sec"] = len(pages) / seconds
+    return docs
+
+def bench_split(docs, results):
+    from src.splitters import split_documents
+    
+    chunks, seconds = timed(split_documents, docs)
+    results["split.chunks_per_sec"] = len(chunks) / seconds
+    
+    structured, seconds = timed(split_documents, docs, mode="structured")
+    results["split.structured.chunks_per_sec"] = len(structured) / seconds
+    return chunks
+
+def bench_embed(embeddings, chunks, results, limit=2000):
+    texts = [chunk.page_content for chunk in chunks[:limit]]
+    embeddings.encode(texts[:16])  # warm up
+    vectors, seconds = timed(embeddings.encode, texts)
+    results["embed.texts_per_sec"] = len(texts) / seconds
+    return vectors
+
+def bench_upsert(vectors, chunks, results, target="local"):
+    from src.local_index import LocalIndex
+    from src.vector_writer import VectorWriter
+    
+    ids = [f"bench-{i}" for i in range(len(vectors))]
+    docs = chunks[:len(vectors)]
+    stop = None
+    if target == "stub":
+        from pinecone import Pinecone
+        from src.stubs import create_index_stub
+        url, stop = serve_in_thread(create_index_stub(dimension=vectors.shape[1]))
+        index = Pinecone(api_key="benchmark").Index(host=url)
+    else:
+        index = LocalIndex(path=None, dimension=vectors.shape[1])
+    
+    try:
+        writer = VectorWriter(index)
+        _, seconds = timed(writer.write, ids, vectors, docs)
+        writer.close()
+        results[f"upsert.{target}.vectors_per_sec"] = len(ids) / seconds
+    finally:
+        if stop is not None:
+            stop()
+
+def bench_queries(chunks, embeddings, results, concurrency=(1, 4, 16), queries_per_level=64, token_delay=0.0):
+    from src.chain import build_context_compressor, build_llm, build_rag_chain, build_retriever
+    from src.bm25 import BM25Index
+    from src.local_index import LocalIndex, LocalVectorStore
+    from src.stubs import create_llm_stub
+    
+    index = LocalIndex(path=None, dimension=embeddings.dimension)
+    vector_store = LocalVectorStore(index, embeddings)
+    vector_store.add_documents(chunks, ids=[f"bench-{i}" for i in range(len(chunks))])
+    lexical_index = BM25Index(None)
+    lexical_index.add_documents([f"bench-{i}" for i in range(len(chunks))], chunks)
+    
+    url, stop = serve_in_thread(create_llm_stub(token_delay=token_delay))
+    os.environ["OPENROUTER_BASE_URL"] = f"{url}/v1"
+    os.environ.setdefault("OPEN_ROUTER_API_KEY", "benchmark")
+    try:
+        retriever = build_retriever(vector_store, k=3, lexical_index=lexical_index)
+        chain = build_rag_chain(retriever, build_llm(streaming=False), build_context_compressor(embeddings))
+        chain.invoke({"input": QUERIES[0]})  # warm up
+        
+        def ask(question):
+            _, seconds = timed(chain.invoke, {"input": question})
+            return seconds
+        
+        for level in concurrency:
+            questions = [QUERIES[i % len(QUERIES)] for i in range(queries_per_level)]
+            with ThreadPoolExecutor(max_workers=level) as pool:
+                latencies, seconds = timed(lambda: list(pool.map(ask, questions)))
+            for name, value in percentiles(latencies).items():
+                results[f"query.c{level}.{name}"] = value
+            results[f"query.c{level}.queries_per_sec"] = len(questions) / seconds
+    finally:
+        stop()
+
+def run(files=10, pages_per_file=20, concurrency=(1, 4, 16), queries_per_level=64, upsert_target="local",
+        seed=0):
+    """Run every benchmark on a freshly generated corpus and return the metrics"""
+    from src.embeddings import get_embeddings
+    
+    results = {}
+    folder = tempfile.mkdtemp(prefix="fintutor_bench_")
+    try:
+        generate_corpus(folder, files=files, pages_per_file=pages_per_file, seed=seed)
+        docs = bench_load(folder, results)
+        chunks = bench_split(docs, results)
+        embeddings = get_embeddings(cache=False)
+        vectors = bench_embed(embeddings, chunks, results)
+        bench_upsert(vectors, chunks, results, target=upsert_target)
+        bench_queries(chunks, embeddings, results, concurrency, queries_per_level)
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+    
+    return {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "files": files,
+            "pages_per_file": pages_per_file,
+            "queries_per_level": queries_per_level,
+            "upsert_target": upsert_target,
+        },
+        "metrics": results,
+    }
+
+def compare(results, baseline, tolerance=0.10):
+    """Return (metric, baseline, current, change, regressed) rows against a baseline run"""
+    rows = []
+    for name, current in results["metrics"].items():
+        previous = baseline["metrics"].get(name)
+        if not previous:
+            continue
+        change = (current - previous) / previous
+        lower_is_better = name.endswith(LOWER_IS_BETTER)
+        regressed = change > tolerance if lower_is_better else change < -tolerance
+        rows.append((name, previous, current, change, regressed))
+    return rows
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark ingestion and query hot paths offline")
+    parser.add_argument("--files", type=int, default=10, help="synthetic PDFs to generate")
+    parser.add_argument("--pages", type=int, default=20, help="pages per synthetic PDF")
+    parser.add_argument("--concurrency", default="1,4,16", help="comma-separated query concurrency levels")
+    parser.add_argument("--queries", type=int, default=64, help="queries per concurrency level")
+    parser.add_argument("--upsert-target", choices=["local", "stub"], default="local",
+                        help="upsert into a LocalIndex or the fake Pinecone server")
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--baseline", help="compare against a previous results file")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="allowed relative slowdown")
+    args = parser.parse_args()
+    
+    results = run(
+        files=args.files,
+        pages_per_file=args.pages,
+        concurrency=[int(level) for level in args.concurrency.split(",")],
+        queries_per_level=args.queries,
+        upsert_target=args.upsert_target
+    )
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    
+    for name, value in results["metrics"].items():
+        print(f"{name:40s} {value:12.2f}")
+    print(f"Results written to {args.output}")
+    
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        rows = compare(results, baseline, args.tolerance)
+        print(f"\n{'metric':40s} {'baseline':>12s} {'current':>12s} {'change':>8s}")
+        for name, previous, current, change, regressed in rows:
+            flag = "  REGRESSION" if regressed else ""
+            print(f"{name:40s} {previous:12.2f} {current:12.2f} {change:+8.1%}{flag}")
+        if any(row[4] for row in rows):
+            sys.exit(1)
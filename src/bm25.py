@@ -0,0 +1,302 @@
+import contextvars
+import gzip
+import json
+import math
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Optional
+
+import numpy as np
+from langchain_core.retrievers import BaseRetriever
+
+from src import telemetry
+from src.filters import filter_key
+from src.local_index import FilterIndex
+
+# Words (any script, so σ and Δt survive) or single non-space symbols such as ^ √ = %
+_TOKEN_RE = re.compile(r"\w+|[^\w\s]")
+_IGNORED = set(",.;:!?\"'()[]{}")
+
+def tokenize(text):
+    """Lowercased word and symbol tokens plus adjacent-word bigrams for phrase matches"""
+    tokens = []
+    for token in _TOKEN_RE.findall(text.lower()):
+        if token in _IGNORED:
+            continue
+        # Minimal plural folding so "trees" matches "tree"
+        if len(token) > 3 and token.endswith("s") and not token.endswith("ss"):
+            token = token[:-1]
+        tokens.append(token)
+    
+    words = [token for token in tokens if token[0].isalnum()]
+    return tokens + [f"{a}_{b}" for a, b in zip(words, words[1:])]
+
+class BM25Index:
+    """Okapi BM25 inverted index stored as compact CSR arrays.
+    
+    Postings for term `t` are rows[offsets[t]:offsets[t + 1]] with term
+    frequencies in the matching slice of `tfs`. Added and deleted documents
+    are applied by rebuilding the arrays lazily before the next search or
+    save. Only chunk IDs, token statistics and the course/module/source
+    posting lists are kept; the text of a hit is fetched from the vector
+    store by ID (see HybridRetriever).
+    """
+    
+    def __init__(self, path, k1=1.5, b=0.75):
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        self.vocab = {}
+        self.ids = []
+        self.filters = FilterIndex()
+        self.rows = {}
+        self.doc_lengths = np.empty(0, dtype=np.float32)
+        self.offsets = np.zeros(1, dtype=np.int64)
+        self.posting_rows = np.empty(0, dtype=np.int32)
+        self.posting_tfs = np.empty(0, dtype=np.float32)
+        self._pending = []
+        self._deleted = []
+        self._dirty = False
+        self._filter_masks = {}
+        self._lock = threading.RLock()
+    
+    @classmethod
+    def exists(cls, path):
+        return os.path.exists(os.path.join(path, "bm25.json"))
+    
+    @classmethod
+    def load(cls, path, **kwargs):
+        index = cls(path, **kwargs)
+        with open(os.path.join(path, "bm25.json"), "r", encoding="utf-8") as f:
+            header = json.load(f)
+        index.vocab = header["vocab"]
+        if "ids" in header:
+            index.ids = header["ids"]
+            index.filters = FilterIndex.load(path)
+        else:
+            # Indexes saved before texts were dropped keep IDs and metadata with the texts
+            with gzip.open(os.path.join(path, "docs.json.gz"), "rt", encoding="utf-8") as f:
+                docs = json.load(f)
+            index.ids = docs["ids"]
+            index.filters.add(0, docs["metadata"])
+        index.rows = {chunk_id: row for row, chunk_id in enumerate(index.ids)}
+        
+        arrays = np.load(os.path.join(path, "postings.npz"))
+        index.doc_lengths = arrays["doc_lengths"]
+        index.offsets = arrays["offsets"]
+        index.posting_rows = arrays["rows"]
+        index.posting_tfs = arrays["tfs"]
+        return index
+    
+    def __len__(self):
+        return len(self.rows)
+    
+    def add(self, ids, texts, metadata):
+        """Add or replace documents by ID; of repeated IDs in one call, the last wins"""
+        ids, texts, metadata = list(ids), list(texts), list(metadata)
+        latest = {chunk_id: i for i, chunk_id in enumerate(ids)}
+        if len(latest) < len(ids):
+            keep = sorted(latest.values())
+            ids, texts, metadata = [ids[i] for i in keep], [texts[i] for i in keep], [metadata[i] for i in keep]
+        
+        with self._lock:
+            self.delete(ids)
+            self.filters.add(len(self.ids), metadata)
+            for chunk_id, text in zip(ids, texts):
+                row = len(self.ids)
+                self.ids.append(chunk_id)
+                self.rows[chunk_id] = row
+                self._pending.append((row, tokenize(text)))
+            self._dirty = True
+    
+    def add_documents(self, ids, docs):
+        self.add(ids, [doc.page_content for doc in docs], [doc.metadata for doc in docs])
+    
+    def delete(self, ids):
+        with self._lock:
+            for chunk_id in ids:
+                row = self.rows.pop(chunk_id, None)
+                if row is not None:
+                    self._deleted.append(row)
+                    self._dirty = True
+    
+    def _rebuild(self):
+        """Merge pending documents, drop deleted ones and rebuild the CSR arrays"""
+        if not self._dirty:
+            return
+        
+        # Existing postings as (term, row, tf) triples
+        counts = np.diff(self.offsets)
+        terms = [np.repeat(np.arange(len(counts), dtype=np.int64), counts)]
+        rows = [self.posting_rows.astype(np.int64)]
+        tfs = [self.posting_tfs]
+        lengths = np.zeros(len(self.ids), dtype=np.float32)
+        lengths[:len(self.doc_lengths)] = self.doc_lengths
+        
+        for row, tokens in self._pending:
+            lengths[row] = len(tokens)
+            term_counts = {}
+            for token in tokens:
+                term_id = self.vocab.setdefault(token, len(self.vocab))
+                term_counts[term_id] = term_counts.get(term_id, 0) + 1
+            terms.append(np.fromiter(term_counts.keys(), dtype=np.int64, count=len(term_counts)))
+            rows.append(np.full(len(term_counts), row, dtype=np.int64))
+            tfs.append(np.fromiter(term_counts.values(), dtype=np.float32, count=len(term_counts)))
+        
+        terms, rows, tfs = np.concatenate(terms), np.concatenate(rows), np.concatenate(tfs)
+        
+        # Compact away deleted rows
+        alive = np.ones(len(self.ids), dtype=bool)
+        alive[self._deleted] = False
+        keep_rows = np.flatnonzero(alive)
+        remap = np.full(len(self.ids), -1, dtype=np.int64)
+        remap[keep_rows] = np.arange(len(keep_rows))
+        live = remap[rows] >= 0
+        terms, rows, tfs = terms[live], remap[rows[live]], tfs[live]
+        
+        order = np.lexsort((rows, terms))
+        self.posting_rows = rows[order].astype(np.int32)
+        self.posting_tfs = tfs[order]
+        self.offsets = np.searchsorted(terms[order], np.arange(len(self.vocab) + 1)).astype(np.int64)
+        self.doc_lengths = lengths[keep_rows]
+        
+        self.ids = [self.ids[row] for row in keep_rows]
+        self.filters.compact(keep_rows)
+        self.rows = {chunk_id: row for row, chunk_id in enumerate(self.ids)}
+        self._pending = []
+        self._deleted = []
+        self._dirty = False
+        self._filter_masks = {}
+    
+    def filter_mask(self, filter):
+        """Boolean mask of rows matching a filter, computed once per filter between rebuilds"""
+        key = filter_key(filter)
+        if key not in self._filter_masks:
+            mask = np.zeros(len(self.ids), dtype=bool)
+            mask[self.filters.match(filter)] = True
+            self._filter_masks[key] = mask
+        return self._filter_masks[key]
+    
+    def search(self, query, k=10, filter=None):
+        """Return the top-k (row, score) pairs for a query, optionally filtered on metadata"""
+        with self._lock:
+            self._rebuild()
+            n = len(self.ids)
+            if n == 0:
+                return []
+            
+            average_length = float(self.doc_lengths.mean()) or 1.0
+            norm = self.k1 * (1 - self.b + self.b * self.doc_lengths / average_length)
+            scores = np.zeros(n, dtype=np.float32)
+            
+            for token in set(tokenize(query)):
+                term_id = self.vocab.get(token)
+                if term_id is None or term_id + 1 >= len(self.offsets):
+                    continue
+                start, stop = self.offsets[term_id], self.offsets[term_id + 1]
+                if start == stop:
+                    continue
+                rows = self.posting_rows[start:stop]
+                tfs = self.posting_tfs[start:stop]
+                idf = math.log(1 + (n - (stop - start) + 0.5) / ((stop - start) + 0.5))
+                scores[rows] += idf * tfs * (self.k1 + 1) / (tfs + norm[rows])
+            
+            if filter_key(filter):
+                scores[~self.filter_mask(filter)] = 0
+            hits = np.flatnonzero(scores)
+            if len(hits) == 0:
+                return []
+            top = hits[np.argsort(-scores[hits])[:k]]
+            return [(int(row), float(scores[row])) for row in top]
+    
+    def search_ids(self, query, k=10, filter=None):
+        """Like `search`, returning (chunk ID, score) pairs"""
+        with self._lock:
+            return [(self.ids[row], score) for row, score in self.search(query, k, filter=filter)]
+    
+    def save(self):
+        with self._lock:
+            self._rebuild()
+            os.makedirs(self.path, exist_ok=True)
+            
+            tmp_path = os.path.join(self.path, "postings.tmp.npz")
+            np.savez(
+                tmp_path,
+                doc_lengths=self.doc_lengths,
+                offsets=self.offsets,
+                rows=self.posting_rows,
+                tfs=self.posting_tfs
+            )
+            os.replace(tmp_path, os.path.join(self.path, "postings.npz"))
+            
+            self.filters.save(self.path)
+            
+            tmp_path = os.path.join(self.path, "bm25.json.tmp")
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"vocab": self.vocab, "ids": self.ids}, f)
+            os.replace(tmp_path, os.path.join(self.path, "bm25.json"))
+            
+            legacy_path = os.path.join(self.path, "docs.json.gz")
+            if os.path.exists(legacy_path):
+                os.remove(legacy_path)
+
+def lexical_index_path(index_name):
+    """Folder of the BM25 index stored next to an index's vectors"""
+    from src.utils import get_cache_path
+    return get_cache_path("indexes", index_name, "bm25")
+
+def open_lexical_index(index_name, create=True):
+    """Open the BM25 index for an index name, or None if it was never built and create is False"""
+    path = lexical_index_path(index_name)
+    if BM25Index.exists(path):
+        return BM25Index.load(path)
+    return BM25Index(path) if create else None
+
+def document_key(doc):
+    """Stable identity of a retrieved chunk, matching the IDs assigned at ingestion"""
+    if getattr(doc, "id", None):
+        return doc.id
+    from src.manifest import chunk_id
+    return chunk_id(doc.metadata.get("source", ""), doc.metadata.get("page", ""), doc.page_content)
+
+def reciprocal_rank_fusion(rankings, k=60):
+    """Fuse ranked Document lists, scoring each by the sum of 1 / (k + rank)"""
+    scores = {}
+    docs = {}
+    for ranking in rankings:
+        for rank, doc in enumerate(ranking):
+            key = document_key(doc)
+            docs.setdefault(key, doc)
+            scores[key] = scores.get(key, 0.0) + 1.0 / (k + rank + 1)
+    return [docs[key] for key in sorted(scores, key=scores.get, reverse=True)]
+
+class HybridRetriever(BaseRetriever):
+    """Run dense and BM25 retrieval concurrently and fuse them with reciprocal rank fusion.
+    
+    Lexical hits are turned into Documents by fetching them from
+    `vector_store` by ID, which holds the chunk texts.
+    """
+    
+    dense_retriever: Any
+    lexical_index: Any
+    vector_store: Any
+    k: int = 3
+    fetch_k: int = 10
+    rrf_k: int = 60
+    filter: Optional[dict] = None
+    
+    def lexical_search(self, query):
+        with telemetry.span("bm25_search", k=self.fetch_k):
+            ids = [chunk_id for chunk_id, _ in self.lexical_index.search_ids(query, self.fetch_k, filter=self.filter)]
+            docs = {doc.id: doc for doc in self.vector_store.get_by_ids(ids)} if ids else {}
+            return [docs[chunk_id] for chunk_id in ids if chunk_id in docs]
+    
+    def _get_relevant_documents(self, query, *, run_manager=None):
+        # Each search runs in a copy of the caller's context so its spans join the current trace
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            dense = pool.submit(contextvars.copy_context().run, self.dense_retriever.invoke, query)
+            lexical = pool.submit(contextvars.copy_context().run, self.lexical_search, query)
+            rankings = [dense.result(), lexical.result()]
+        return reciprocal_rank_fusion(rankings, k=self.rrf_k)[:self.k]
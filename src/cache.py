@@ -0,0 +1,185 @@
+import hashlib
+import json
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+def normalize_question(question):
+    """Normalize a question for exact-match caching (case, whitespace, trailing punctuation)"""
+    question = re.sub(r"\s+", " ", question.strip().lower())
+    return question.rstrip(" ?!.")
+
+class TTLCache:
+    """Thread-safe in-memory LRU cache whose entries expire after `ttl` seconds"""
+    
+    def __init__(self, max_entries=1024, ttl=3600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[0] < time.time():
+                if entry is not None:
+                    del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+    
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.time() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+    
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+    
+    def __len__(self):
+        return len(self._data)
+    
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+class AnswerCache:
+    """SQLite-backed answer cache shared by every session and process on a node.
+    
+    Keys combine the normalized question with the prompt and index versions,
+    so changing the prompt or re-ingesting the index never serves stale
+    answers. Entries expire after `ttl` seconds and the least recently used
+    ones are evicted beyond `max_entries`.
+    """
+    
+    def __init__(self, path, ttl=7 * 24 * 3600, max_entries=10_000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS answers ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires REAL NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS answers_last_used ON answers(last_used)")
+        self._conn.commit()
+    
+    @staticmethod
+    def make_key(question, prompt_version, index_version):
+        raw = f"{normalize_question(question)}\x00{prompt_version}\x00{index_version}"
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+    
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM answers WHERE key = ? AND expires > ?", (key, now)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE answers SET last_used = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self.hits += 1
+        return json.loads(row[0])
+    
+    def set(self, key, value):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO answers (key, value, expires, last_used) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value), now + self.ttl, now)
+            )
+            self._conn.execute("DELETE FROM answers WHERE expires <= ?", (now,))
+            self._conn.execute(
+                "DELETE FROM answers WHERE key IN (SELECT key FROM answers ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            )
+            self._conn.commit()
+    
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+class SemanticCache:
+    """Bounded answer cache matched by cosine similarity of question embeddings.
+    
+    Paraphrases such as "what's a bond" and "What is a bond?" embed close
+    together, so a lookup returns the stored answer of the most similar
+    earlier question when its similarity reaches `threshold`. Entries are
+    stored in a preallocated float32 matrix; expired or least recently used
+    slots are reused first. Changing the namespace (prompt or index version)
+    clears the cache.
+    """
+    
+    def __init__(self, dimension=384, max_entries=2048, threshold=0.92, ttl=7 * 24 * 3600):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.namespace = None
+        self._vectors = np.zeros((max_entries, dimension), dtype=np.float32)
+        self._expires = np.zeros(max_entries)
+        self._last_used = np.zeros(max_entries)
+        self._values = [None] * max_entries
+        self._lock = threading.Lock()
+    
+    def _check_namespace(self, namespace):
+        if namespace != self.namespace:
+            self.namespace = namespace
+            self._expires[:] = 0
+            self._values = [None] * len(self._values)
+    
+    @staticmethod
+    def _normalize(vector):
+        vector = np.asarray(vector, dtype=np.float32)
+        return vector / max(float(np.linalg.norm(vector)), 1e-12)
+    
+    def lookup(self, vector, namespace):
+        """Return (value, similarity) for the closest live entry above the threshold, else None"""
+        query = self._normalize(vector)
+        now = time.time()
+        with self._lock:
+            self._check_namespace(namespace)
+            scores = self._vectors @ query
+            scores[self._expires <= now] = -np.inf
+            best = int(np.argmax(scores))
+            if scores[best] < self.threshold:
+                self.misses += 1
+                return None
+            self._last_used[best] = now
+            self.hits += 1
+            return self._values[best], float(scores[best])
+    
+    def add(self, vector, value, namespace):
+        now = time.time()
+        with self._lock:
+            self._check_namespace(namespace)
+            # Prefer an expired slot, otherwise evict the least recently used one
+            expired = np.flatnonzero(self._expires <= now)
+            slot = int(expired[0]) if len(expired) else int(np.argmin(self._last_used))
+            self._vectors[slot] = self._normalize(vector)
+            self._expires[slot] = now + self.ttl
+            self._last_used[slot] = now
+            self._values[slot] = value
+    
+    def __len__(self):
+        return int((self._expires > time.time()).sum())
+    
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
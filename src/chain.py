@@ -0,0 +1,208 @@
+import hashlib
+import os
+
+from src.filters import filter_key
+
+INDEX_NAME = "fintutor"
+LLM_MODEL = "mistralai/mistral-7b-instruct:free"
+OPENROUTER_BASE_URL = "https://openrouter.ai/api/v1"
+
+# Simple prompt to prevent repetition
+SYSTEM_PROMPT = (
+    "You are a helpful finance tutor. "
+    "Answer the question based on the context provided. "
+    "Give a clear, concise answer in 2-3 sentences maximum. "
+    "Stop after giving one complete answer."
+    "\n\n"
+    "Context: {context}"
+)
+
+def build_llm(streaming=True, http_client=None, http_async_client=None, timeout=None, max_retries=2, max_tokens=300,
+              model=None, base_url=None):
+    """Create the OpenRouter chat model (OPENROUTER_BASE_URL overrides the endpoint)"""
+    from langchain_openai import ChatOpenAI
+    
+    return ChatOpenAI(
+        openai_api_key=os.getenv("OPEN_ROUTER_API_KEY"),
+        openai_api_base=base_url or os.getenv("OPENROUTER_BASE_URL", OPENROUTER_BASE_URL),
+        model=model or LLM_MODEL,
+        temperature=0.3,
+        max_tokens=max_tokens,
+        streaming=streaming,
+        timeout=timeout,
+        max_retries=max_retries,
+        http_client=http_client,
+        http_async_client=http_async_client,
+    )
+
+def parse_models(spec):
+    """Parse "model,model@base_url,..." into (model, base_url or None) pairs"""
+    models = []
+    for entry in spec.split(","):
+        model, _, base_url = entry.strip().partition("@")
+        if model:
+            models.append((model, base_url or None))
+    return models
+
+def llm_models():
+    """The (model, base_url) pairs configured by LLM_MODELS, defaulting to LLM_MODEL"""
+    return parse_models(os.getenv("LLM_MODELS", LLM_MODEL)) or [(LLM_MODEL, None)]
+
+def prompt_version():
+    """Hash of the prompt and the resolved models, so cached answers are only reused for both.
+    
+    Read when called rather than at import, since LLM_MODELS may come from
+    the .env file loaded afterwards.
+    """
+    models = ",".join(f"{model}@{base_url or ''}" for model, base_url in llm_models())
+    return hashlib.sha1(f"{LLM_MODEL}\x00{models}\x00{SYSTEM_PROMPT}".encode("utf-8")).hexdigest()[:12]
+
+def build_llm_router(streaming=True, http_async_client=None, timeout=None, max_tokens=300):
+    """Chat model dispatching across LLM_MODELS with hedging, fallback and circuit breakers.
+    
+    LLM_MODELS is an ordered, comma-separated list of models (default
+    LLM_MODEL); "model@base_url" sends a model to another OpenAI-compatible
+    endpoint. LLM_BUDGET_MS bounds the wait for the first token (default
+    15000), LLM_HEDGE_MS is how long the fastest model gets before the next
+    is also asked (default 2500, 0 disables hedging), LLM_TIMEOUT bounds
+    each call in seconds (default 60), and a model is skipped for
+    LLM_BREAKER_COOLDOWN seconds (default 30) after LLM_BREAKER_FAILURES
+    consecutive failures (default 3). See src/llm_router.py.
+    """
+    from src.llm_router import CircuitBreaker, LLMRouter, ModelRoute
+    
+    models = llm_models()
+    timeout = timeout or float(os.getenv("LLM_TIMEOUT", "60"))
+    hedge_ms = int(os.getenv("LLM_HEDGE_MS", "2500"))
+    routes = [
+        ModelRoute(
+            f"{model}@{base_url}" if base_url else model,
+            # The router falls back to the next model instead of retrying; a lone model keeps its retries
+            build_llm(streaming=streaming, http_async_client=http_async_client, timeout=timeout,
+                      max_retries=0 if len(models) > 1 else 2, max_tokens=max_tokens,
+                      model=model, base_url=base_url),
+            CircuitBreaker(
+                threshold=int(os.getenv("LLM_BREAKER_FAILURES", "3")),
+                cooldown=float(os.getenv("LLM_BREAKER_COOLDOWN", "30"))
+            )
+        )
+        for model, base_url in models
+    ]
+    return LLMRouter(
+        routes=routes,
+        budget=int(os.getenv("LLM_BUDGET_MS", "15000")) / 1000 or None,
+        hedge_delay=hedge_ms / 1000 if hedge_ms > 0 else None,
+        streaming=streaming
+    )
+
+def build_retriever(vector_store, retrieval_cache=None, k=3, lexical_index=None, fetch_k=10,
+                    reranker=None, rerank_candidates=None, filter=None):
+    """Similarity retriever, cached by query embedding when a cache is given.
+    
+    A metadata `filter` such as {"course": "derivatives", "module": "binomial-trees"}
+    restricts dense and lexical search to matching chunks (see src/filters.py).
+    
+    With a BM25 `lexical_index`, `fetch_k` dense and lexical candidates are
+    retrieved concurrently and fused down to `k` with reciprocal rank fusion.
+    With a `reranker`, `rerank_candidates` chunks (RERANK_CANDIDATES, default
+    20) are over-fetched and the cross-encoder keeps the best `k`.
+    """
+    final_k = k
+    if reranker is not None:
+        k = rerank_candidates or int(os.getenv("RERANK_CANDIDATES", "20"))
+        fetch_k = max(fetch_k, k)
+    
+    filter = filter if filter_key(filter) else None
+    dense_k = fetch_k if lexical_index is not None else k
+    if retrieval_cache is None:
+        search_kwargs = {"k": dense_k, "filter": filter} if filter else {"k": dense_k}
+        retriever = vector_store.as_retriever(search_type="similarity", search_kwargs=search_kwargs)
+    else:
+        from src.retrievers import CachedRetriever
+        retriever = CachedRetriever(
+            vector_store=vector_store,
+            cache=retrieval_cache,
+            index_name=INDEX_NAME,
+            search_kwargs={"k": dense_k},
+            filter=filter
+        )
+    
+    if lexical_index is not None:
+        from src.bm25 import HybridRetriever
+        retriever = HybridRetriever(
+            dense_retriever=retriever, lexical_index=lexical_index, vector_store=vector_store, k=k,
+            fetch_k=fetch_k, filter=filter
+        )
+    
+    if reranker is None:
+        return retriever
+    
+    from src.rerank import RerankingRetriever
+    return RerankingRetriever(base_retriever=retriever, reranker=reranker, k=final_k)
+
+def load_lexical_index():
+    """Load the BM25 index built at ingestion unless HYBRID_SEARCH=0"""
+    if os.getenv("HYBRID_SEARCH", "1") == "0":
+        return None
+    from src.bm25 import open_lexical_index
+    return open_lexical_index(INDEX_NAME, create=False)
+
+def load_reranker():
+    """Load the cross-encoder re-ranker unless RERANK=0 (RERANK_MODEL, RERANK_BUDGET_MS configure it)"""
+    if os.getenv("RERANK", "1") == "0":
+        return None
+    
+    try:
+        from src.rerank import RERANK_MODEL, CrossEncoderReranker
+        reranker = CrossEncoderReranker(
+            model_name=os.getenv("RERANK_MODEL", RERANK_MODEL),
+            budget=int(os.getenv("RERANK_BUDGET_MS", "300")) / 1000
+        )
+        print(f"Re-ranker loaded: {reranker.model_name}")
+        return reranker
+    except Exception as e:
+        print(f"Re-ranking disabled, failed to load cross-encoder: {e}")
+        return None
+
+def build_context_compressor(embeddings):
+    """Context compressor sized by CONTEXT_TOKEN_BUDGET (0 disables compression)"""
+    max_tokens = int(os.getenv("CONTEXT_TOKEN_BUDGET", "500"))
+    if max_tokens <= 0:
+        return None
+    from src.context import ContextCompressor
+    return ContextCompressor(embeddings, max_tokens=max_tokens)
+
+def build_answer_chain(llm):
+    """Answer a question from already retrieved documents: {"input", "context"} -> answer text"""
+    from langchain.chains.combine_documents import create_stuff_documents_chain
+    from langchain_core.prompts import ChatPromptTemplate
+    
+    prompt = ChatPromptTemplate.from_messages([
+        ("system", SYSTEM_PROMPT),
+        ("human", "{input}"),
+    ])
+    return create_stuff_documents_chain(llm, prompt)
+
+def build_rag_chain(retriever, llm, compressor=None):
+    """Stuff the retrieved context into the tutor prompt and answer with the LLM.
+    
+    With a `compressor` the retrieved chunks are deduplicated and trimmed to
+    the token budget first, and the chain output gains a "context_report"
+    with the tokens saved for the question.
+    """
+    from langchain.chains import create_retrieval_chain
+    from langchain_core.runnables import RunnableLambda, RunnablePassthrough
+    
+    question_answer_chain = build_answer_chain(llm)
+    if compressor is None:
+        return create_retrieval_chain(retriever, question_answer_chain)
+    
+    def retrieve_and_compress(inputs):
+        docs = retriever.invoke(inputs["input"])
+        context, report = compressor.compress(inputs["input"], docs)
+        return {**inputs, "context": context, "context_report": report}
+    
+    return (
+        RunnableLambda(retrieve_and_compress).with_config(run_name="retrieve_documents")
+        | RunnablePassthrough.assign(answer=question_answer_chain)
+    ).with_config(run_name="retrieval_chain")
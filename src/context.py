@@ -0,0 +1,141 @@
+import re
+import threading
+
+import numpy as np
+from langchain_core.documents import Document
+
+from src import telemetry
+from src.embedding_cache import CachedEmbeddings
+
+_SENTENCE_RE = re.compile(r"(?<=[.!?])\s+|\n\s*\n")
+_WORD_RE = re.compile(r"\w+")
+
+def estimate_tokens(text):
+    """Rough token count (about four characters per token for English text)"""
+    return max(1, len(text) // 4) if text else 0
+
+def split_sentences(text):
+    return [sentence.strip() for sentence in _SENTENCE_RE.split(text) if sentence.strip()]
+
+def shingles(text, size=3):
+    words = _WORD_RE.findall(text.lower())
+    return {tuple(words[i:i + size]) for i in range(max(1, len(words) - size + 1))}
+
+def merge_overlapping(first, second, max_overlap=200):
+    """Join two texts if the end of the first overlaps the start of the second, else None"""
+    for size in range(min(max_overlap, len(first), len(second)), 9, -1):
+        if first.endswith(second[:size]):
+            return first + second[size:]
+    return None
+
+class ContextCompressor:
+    """Shrink retrieved chunks before they are stuffed into the prompt.
+    
+    Near-duplicate chunks are dropped, overlapping chunks from the same PDF
+    page are merged, and each chunk is trimmed to the sentences most similar
+    to the question (scored with the embedder) until the token budget is
+    spent. Retrieval order is kept as a tie-breaker so the best-ranked chunk
+    keeps its place in the prompt.
+    """
+    
+    def __init__(self, embeddings=None, max_tokens=500, dedupe_threshold=0.8, min_similarity=0.2):
+        self.embeddings = embeddings
+        self.max_tokens = max_tokens
+        self.dedupe_threshold = dedupe_threshold
+        self.min_similarity = min_similarity
+        self.queries = 0
+        self.tokens_before = 0
+        self.tokens_after = 0
+        self._lock = threading.Lock()
+    
+    def deduplicate(self, docs):
+        kept, kept_shingles = [], []
+        for doc in docs:
+            current = shingles(doc.page_content)
+            duplicate = any(
+                len(current & other) / max(1, len(current | other)) >= self.dedupe_threshold
+                or doc.page_content in kept_doc.page_content
+                for kept_doc, other in zip(kept, kept_shingles)
+            )
+            if not duplicate:
+                kept.append(doc)
+                kept_shingles.append(current)
+        return kept
+    
+    def merge_adjacent(self, docs):
+        merged = []
+        for doc in docs:
+            key = (doc.metadata.get("source"), doc.metadata.get("page"))
+            for i, previous in enumerate(merged):
+                if (previous.metadata.get("source"), previous.metadata.get("page")) != key:
+                    continue
+                text = (merge_overlapping(previous.page_content, doc.page_content)
+                        or merge_overlapping(doc.page_content, previous.page_content))
+                if text is not None:
+                    merged[i] = Document(page_content=text, metadata=previous.metadata, id=previous.id)
+                    break
+            else:
+                merged.append(doc)
+        return merged
+    
+    def _similarities(self, query, sentences):
+        if self.embeddings is None or not sentences:
+            return np.zeros(len(sentences), dtype=np.float32)
+        if isinstance(self.embeddings, CachedEmbeddings):
+            # Sentences are scored once per answer; caching them would only evict chunk and query vectors
+            vectors = self.embeddings.encode([query] + sentences, cache=False)
+        elif hasattr(self.embeddings, "encode"):
+            vectors = self.embeddings.encode([query] + sentences)
+        else:
+            vectors = np.asarray(self.embeddings.embed_documents([query] + sentences), dtype=np.float32)
+        vectors = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        return vectors[1:] @ vectors[0]
+    
+    def trim_to_budget(self, query, docs):
+        """Keep the most query-relevant sentences of each chunk within the token budget"""
+        sentences = [(d, s) for d, doc in enumerate(docs) for s in split_sentences(doc.page_content)]
+        scores = self._similarities(query, [sentence for _, sentence in sentences])
+        
+        # Best sentences first; earlier-ranked chunks win ties
+        order = sorted(range(len(sentences)), key=lambda i: (-round(float(scores[i]), 2), sentences[i][0], i))
+        chosen, used = set(), 0
+        for i in order:
+            doc_index, sentence = sentences[i]
+            tokens = estimate_tokens(sentence)
+            has_any = any(sentences[j][0] == doc_index for j in chosen)
+            if has_any and scores[i] < self.min_similarity and self.embeddings is not None:
+                continue
+            if used + tokens > self.max_tokens:
+                continue
+            chosen.add(i)
+            used += tokens
+        
+        trimmed = []
+        for d, doc in enumerate(docs):
+            kept = [sentences[i][1] for i in sorted(chosen) if sentences[i][0] == d]
+            if kept:
+                trimmed.append(Document(page_content=" ".join(kept), metadata=doc.metadata, id=doc.id))
+        return trimmed
+    
+    def compress(self, query, docs):
+        """Return (compressed docs, report) for a question's retrieved chunks"""
+        before = sum(estimate_tokens(doc.page_content) for doc in docs)
+        with telemetry.span("compress_context", chunks=len(docs)):
+            compressed = self.trim_to_budget(query, self.merge_adjacent(self.deduplicate(docs)))
+        after = sum(estimate_tokens(doc.page_content) for doc in compressed)
+        telemetry.incr("fintutor_context_tokens_total", before, kind="retrieved")
+        telemetry.incr("fintutor_context_tokens_total", after, kind="prompt")
+        
+        with self._lock:
+            self.queries += 1
+            self.tokens_before += before
+            self.tokens_after += after
+        
+        report = {
+            "chunks_before": len(docs),
+            "chunks_after": len(compressed),
+            "tokens_before": before,
+            "tokens_after": after,
+            "tokens_saved": before - after,
+        }
+        return compressed, report
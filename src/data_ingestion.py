@@ -1,16 +1,395 @@
 import sys
 import os
+import argparse
+from itertools import groupby
 
 # Add src directory to path
 sys.path.append(os.path.join(os.path.dirname(__file__), 'src'))
 
+from src import telemetry
+from src.bm25 import BM25Index, lexical_index_path, open_lexical_index
+from src.embedding_cache import CachedEmbeddings
 from src.embeddings import get_embeddings
-from src.loaders import load_pdf_file
-from src.splitters import split_documents
-from src.vector_store import build_vector_store, get_vector_store_stats
-from src.utils import load_environment, ensure_data_folder
+from src.loaders import course_tags, iter_pdf_documents, list_pdf_files, load_pdf, load_pdf_file
+from src.manifest import (
+    assign_chunk_ids, load_manifest, new_manifest, plan_ingestion, save_index_version, save_manifest
+)
+from src.pipeline import Pipeline
+from src.splitters import split_documents, splitter_signature
+from src.vector_store import get_index, get_vector_store_stats, namespace_for
+from src.vector_writer import VectorWriter
+from src.utils import load_environment, ensure_data_folder, get_cache_path
 
-def ingest_data():
+# Bumped when the metadata stored with each chunk changes, so every file is re-written
+METADATA_VERSION = 1
+
+def tag_pages(pages, data_folder="Data"):
+    """Add course and module tags from the folder layout to each page's metadata"""
+    for page in pages:
+        page.metadata.update(course_tags(page.metadata["source"], data_folder))
+    return pages
+
+def iter_file_pages(pdf_files, parallel=False, workers=None, data_folder="Data"):
+    """Yield (file_path, pages) for each PDF that could be loaded, in order, with course tags"""
+    if not parallel:
+        for file_path in pdf_files:
+            with telemetry.span("load"):
+                pages = load_pdf(file_path)
+            yield file_path, tag_pages(pages, data_folder)
+        return
+    
+    # Pages stream in file order, so consecutive pages share a source
+    pages = iter_pdf_documents(pdf_files, workers=workers)
+    for file_path, file_pages in groupby(pages, key=lambda doc: doc.metadata["source"]):
+        yield file_path, tag_pages(list(file_pages), data_folder)
+
+def report_embedding_cache(embeddings):
+    """Print embedding cache statistics when the embedder is cached"""
+    if isinstance(embeddings, CachedEmbeddings):
+        stats = embeddings.stats()
+        print(f"Embedding cache: {stats['hits']} hits, {stats['misses']} misses "
+              f"({stats['hit_rate']:.0%} hit rate, {stats['entries']} entries)")
+
+def open_writer(index_name):
+    """Create a batched, retrying vector writer that checkpoints committed chunks"""
+    return VectorWriter(
+        get_index(index_name),
+        batch_size=int(os.getenv("UPSERT_BATCH_SIZE", "100")),
+        max_workers=int(os.getenv("UPSERT_WORKERS", "4")),
+        max_retries=int(os.getenv("UPSERT_RETRIES", "5")),
+        checkpoint_path=get_cache_path(f"{index_name}_checkpoint.txt"),
+        namespace_for=namespace_for
+    )
+
+def write_chunks(writer, embeddings, chunks, ids, batch_size=256):
+    """Embed and upsert chunks batch by batch, skipping those already checkpointed"""
+    pending = writer.pending(ids)
+    for start in range(0, len(pending), batch_size):
+        batch = [chunks[i] for i in pending[start:start + batch_size]]
+        with telemetry.span("embed", chunks=len(batch)):
+            vectors = embeddings.encode([chunk.page_content for chunk in batch])
+        with telemetry.span("upsert", chunks=len(batch)):
+            writer.write([ids[i] for i in pending[start:start + batch_size]], vectors, batch)
+    return len(pending)
+
+def finish_writer(writer, stale):
+    """Delete stale vectors ({namespace: ids}), persist pending writes and stop the writer's pool"""
+    if any(stale.values()):
+        print("🧹 Removing stale chunks...")
+        for namespace, ids in stale.items():
+            with telemetry.span("delete", chunks=len(ids)):
+                writer.delete(ids, namespace=namespace)
+    with telemetry.span("flush"):
+        writer.flush()
+    writer.close()
+
+def diff_chunks(previous, ids, namespace):
+    """Compare a file's new chunk IDs with its manifest entry.
+    
+    Returns the IDs already stored as they are, which need no upsert, and
+    the stale IDs to delete as {namespace: ids}. A file whose course moved
+    to another namespace, or whose chunks were stored under an older
+    metadata version, is written again in full.
+    """
+    chunks = previous.get("chunks", [])
+    old_namespace = previous.get("namespace", "")
+    if old_namespace != namespace:
+        return set(), {old_namespace: chunks}
+    stored = set(chunks) if previous.get("metadata") == METADATA_VERSION else set()
+    return stored, {namespace: sorted(set(chunks) - set(ids))}
+
+def add_stale(stale, more):
+    for namespace, ids in more.items():
+        if ids:
+            stale.setdefault(namespace, []).extend(ids)
+
+def record_file(entry, ids, tags):
+    """Record a file's chunks, course tags and namespace in its manifest entry"""
+    entry.update(tags, chunks=ids, namespace=namespace_for(tags), metadata=METADATA_VERSION)
+
+def check_splitter(manifest):
+    """Force every file to be re-split when the chunking settings changed since the last run"""
+    signature = splitter_signature()
+    # Manifests written before the settings were recorded used the recursive splitter
+    if manifest.get("splitter", splitter_signature("recursive")) != signature and manifest["files"]:
+        print("Chunking settings changed, re-splitting all PDF files")
+        for entry in manifest["files"].values():
+            # Clearing the size also defeats the stat shortcut, so files are re-hashed
+            entry["hash"] = entry["size"] = None
+    manifest["splitter"] = signature
+
+def check_metadata(manifest):
+    """Force every file to be re-written when the chunk metadata changed since the last run"""
+    if manifest.get("metadata") != METADATA_VERSION and manifest["files"]:
+        print("Chunk metadata changed, re-writing all PDF files")
+        for entry in manifest["files"].values():
+            entry["hash"] = entry["size"] = None
+    manifest["metadata"] = METADATA_VERSION
+
+def split_file(file_path, docs, chunk_size=500, chunk_overlap=20):
+    """Split the pages of a single PDF, returning its chunks and their stable IDs"""
+    # Scanned or empty PDFs have no extractable text and produce no chunks
+    if not any(doc.page_content.strip() for doc in docs):
+        print(f"No extractable text in '{file_path}', skipping")
+        return [], []
+    
+    with telemetry.span("split", pages=len(docs)):
+        chunks = split_documents(docs, chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+        return chunks, assign_chunk_ids(chunks)
+
+def ingest_incremental(data_folder="Data", index_name="fintutor", parallel=False):
+    """Embed and upsert only new or changed chunks, deleting vectors of removed or changed files"""
+    manifest_path = get_cache_path(f"{index_name}_manifest.json")
+    manifest = load_manifest(manifest_path, index_name)
+    check_splitter(manifest)
+    check_metadata(manifest)
+    
+    print("🔍 Checking for changed PDF documents...")
+    pdf_files = list_pdf_files(data_folder)
+    changed, removed = plan_ingestion(manifest, pdf_files)
+    print(f"{len(changed)} new or changed, {len(removed)} removed, "
+          f"{len(pdf_files) - len(changed)} unchanged PDF files")
+    
+    if not changed and not removed:
+        save_manifest(manifest, manifest_path)
+        print("Vector store is already up to date")
+        return
+    
+    new_chunks, new_ids, gone_ids = [], [], []
+    stale = {}
+    entries = {entry["path"]: entry for entry in changed}
+    lexical_index = open_lexical_index(index_name)
+    
+    print("📚 Loading and splitting changed PDF documents...")
+    loaded = []
+    for file_path, docs in iter_file_pages(list(entries), parallel=parallel, data_folder=data_folder):
+        entry = entries[file_path]
+        loaded.append(entry)
+        chunks, ids = split_file(file_path, docs)
+        tags = course_tags(file_path, data_folder)
+        
+        previous = manifest["files"].get(entry["path"], {})
+        stored, file_stale = diff_chunks(previous, ids, namespace_for(tags))
+        for chunk, chunk_id in zip(chunks, ids):
+            if chunk_id not in stored:
+                new_chunks.append(chunk)
+                new_ids.append(chunk_id)
+        add_stale(stale, file_stale)
+        gone_ids.extend(sorted(set(previous.get("chunks", [])) - set(ids)))
+        record_file(entry, ids, tags)
+    
+    for path in removed:
+        entry = manifest["files"][path]
+        add_stale(stale, {entry.get("namespace", ""): entry.get("chunks", [])})
+        gone_ids.extend(entry.get("chunks", []))
+    
+    with telemetry.span("lexical_index", chunks=len(new_chunks)):
+        lexical_index.delete(gone_ids)
+        lexical_index.add_documents(new_ids, new_chunks)
+    
+    writer = open_writer(index_name)
+    if new_chunks:
+        print("🔤 Initializing embeddings...")
+        embeddings = get_embeddings()
+        
+        print("🏗️ Upserting new chunks...")
+        write_chunks(writer, embeddings, new_chunks, new_ids)
+        report_embedding_cache(embeddings)
+    
+    finish_writer(writer, stale)
+    lexical_index.save()
+    
+    # Only record progress once the vector store reflects it; files that
+    # failed to load in parallel mode stay pending for the next run
+    for entry in loaded:
+        path = entry.pop("path")
+        manifest["files"][path] = entry
+    for path in removed:
+        del manifest["files"][path]
+    save_manifest(manifest, manifest_path)
+    save_index_version(index_name)
+    writer.clear_checkpoint()
+    
+    print(f"Upserted {len(new_ids)} chunks, deleted {sum(map(len, stale.values()))} chunks")
+
+def ingest_streaming(data_folder="Data", index_name="fintutor", parallel=False,
+                     batch_size=64, queue_size=8, upsert_workers=2):
+    """Incremental ingestion with loading, splitting, embedding and upserting overlapped.
+    
+    Stages run in threads connected by bounded queues, so only a few batches
+    of pages, chunks and vectors are held in memory at any time and network
+    upserts proceed while the next batch is being embedded.
+    """
+    manifest_path = get_cache_path(f"{index_name}_manifest.json")
+    manifest = load_manifest(manifest_path, index_name)
+    check_splitter(manifest)
+    check_metadata(manifest)
+    
+    print("🔍 Checking for changed PDF documents...")
+    pdf_files = list_pdf_files(data_folder)
+    changed, removed = plan_ingestion(manifest, pdf_files)
+    print(f"{len(changed)} new or changed, {len(removed)} removed, "
+          f"{len(pdf_files) - len(changed)} unchanged PDF files")
+    
+    if not changed and not removed:
+        save_manifest(manifest, manifest_path)
+        print("Vector store is already up to date")
+        return
+    
+    entries = {entry["path"]: entry for entry in changed}
+    loaded, removed_ids = [], []
+    stale = {}
+    lexical_index = open_lexical_index(index_name)
+    for path in removed:
+        entry = manifest["files"][path]
+        add_stale(stale, {entry.get("namespace", ""): entry.get("chunks", [])})
+        removed_ids.extend(entry.get("chunks", []))
+    
+    print("🔤 Initializing embeddings...")
+    embeddings = get_embeddings()
+    writer = open_writer(index_name)
+    
+    def load_stage(_):
+        yield from iter_file_pages(list(entries), parallel=parallel, data_folder=data_folder)
+    
+    def split_stage(files):
+        batch = []
+        for file_path, docs in files:
+            entry = entries[file_path]
+            chunks, ids = split_file(file_path, docs)
+            tags = course_tags(file_path, data_folder)
+            
+            previous = manifest["files"].get(file_path, {})
+            stored, file_stale = diff_chunks(previous, ids, namespace_for(tags))
+            add_stale(stale, file_stale)
+            record_file(entry, ids, tags)
+            loaded.append(entry)
+            
+            lexical_index.delete(sorted(set(previous.get("chunks", [])) - set(ids)))
+            lexical_index.add_documents(
+                [chunk_id for chunk_id in ids if chunk_id not in stored],
+                [chunk for chunk, chunk_id in zip(chunks, ids) if chunk_id not in stored]
+            )
+            
+            for chunk, chunk_id in zip(chunks, ids):
+                # Chunks committed before an interruption are neither re-embedded nor re-upserted
+                if chunk_id not in stored and chunk_id not in writer.committed:
+                    batch.append((chunk_id, chunk))
+                if len(batch) >= batch_size:
+                    yield batch
+                    batch = []
+        if batch:
+            yield batch
+    
+    def embed_stage(batches):
+        for batch in batches:
+            ids, chunks = zip(*batch)
+            with telemetry.span("embed", chunks=len(chunks)):
+                vectors = embeddings.encode([chunk.page_content for chunk in chunks])
+            yield ids, vectors, chunks
+    
+    def upsert_stage(batches):
+        for ids, vectors, chunks in batches:
+            with telemetry.span("upsert", chunks=len(chunks)):
+                written = writer.write(ids, vectors, chunks)
+            yield written
+    
+    print("🏗️ Streaming PDFs through split, embed and upsert...")
+    pipeline = (
+        Pipeline(queue_size=queue_size)
+        .add_stage("load (files)", load_stage)
+        .add_stage("split (batches)", split_stage)
+        .add_stage("embed (batches)", embed_stage)
+        .add_stage("upsert (batches)", upsert_stage, workers=upsert_workers)
+    )
+    stats = pipeline.run()
+    print("⏱️ Pipeline stage summary:")
+    pipeline.report()
+    report_embedding_cache(embeddings)
+    
+    finish_writer(writer, stale)
+    lexical_index.delete(removed_ids)
+    lexical_index.save()
+    
+    # Only record progress once the vector store reflects it
+    for entry in loaded:
+        path = entry.pop("path")
+        manifest["files"][path] = entry
+    for path in removed:
+        del manifest["files"][path]
+    save_manifest(manifest, manifest_path)
+    save_index_version(index_name)
+    writer.clear_checkpoint()
+    
+    print(f"Streamed {stats[1].items} chunk batches, deleted {sum(map(len, stale.values()))} chunks")
+
+def ingest_full(data_folder="Data", index_name="fintutor", parallel=False):
+    """Re-embed and upsert every chunk, rebuilding the manifest from scratch"""
+    manifest_path = get_cache_path(f"{index_name}_manifest.json")
+    previous = load_manifest(manifest_path, index_name)
+    manifest = new_manifest(index_name)
+    manifest["splitter"] = splitter_signature()
+    manifest["metadata"] = METADATA_VERSION
+    
+    # Load PDF documents
+    print("📚 Loading PDF documents...")
+    with telemetry.span("load"):
+        docs = tag_pages(load_pdf_file(data_folder, parallel=parallel), data_folder)
+    
+    # Split documents into chunks
+    print("✂️ Splitting documents...")
+    with telemetry.span("split", pages=len(docs)):
+        text_chunks = split_documents(docs, chunk_size=500, chunk_overlap=20)
+    
+    # Chunk IDs are derived from content so re-running never duplicates vectors
+    ids = []
+    by_source = {}
+    for chunk in text_chunks:
+        by_source.setdefault(os.path.normpath(chunk.metadata.get("source", "")), []).append(chunk)
+    for chunks in by_source.values():
+        ids.extend(assign_chunk_ids(chunks))
+    text_chunks = [chunk for chunks in by_source.values() for chunk in chunks]
+    
+    # Initialize embeddings
+    print("🔤 Initializing embeddings...")
+    embeddings = get_embeddings()
+    
+    # Build vector store
+    print("🏗️ Building vector store...")
+    writer = open_writer(index_name)
+    write_chunks(writer, embeddings, text_chunks, ids)
+    report_embedding_cache(embeddings)
+    
+    # Vectors recorded by an earlier run that no longer exist, or now live in
+    # another namespace, must be removed
+    current = set(ids)
+    namespaces = {path: namespace_for(course_tags(path, data_folder)) for path in by_source}
+    stale = {}
+    for path, entry in previous["files"].items():
+        chunks = entry.get("chunks", [])
+        namespace = entry.get("namespace", "")
+        if namespaces.get(path) != namespace:
+            add_stale(stale, {namespace: chunks})
+        else:
+            add_stale(stale, {namespace: [chunk_id for chunk_id in chunks if chunk_id not in current]})
+    finish_writer(writer, stale)
+    
+    # Rebuild the lexical index from scratch alongside the vectors
+    with telemetry.span("lexical_index", chunks=len(ids)):
+        lexical_index = BM25Index(lexical_index_path(index_name))
+        lexical_index.add_documents(ids, text_chunks)
+        lexical_index.save()
+    
+    changed, _ = plan_ingestion(manifest, list_pdf_files(data_folder))
+    for entry in changed:
+        path = entry.pop("path")
+        record_file(entry, assign_chunk_ids(by_source.get(path, [])), course_tags(path, data_folder))
+        manifest["files"][path] = entry
+    save_manifest(manifest, manifest_path)
+    save_index_version(index_name)
+    writer.clear_checkpoint()
+
+def ingest_data(incremental=True, data_folder="Data", index_name="fintutor", parallel=False, streaming=False):
     """Main function to ingest data into Pinecone"""
     try:
         print("🚀 Starting data ingestion process...")
@@ -21,26 +400,24 @@ def ingest_data():
         # Ensure data folder exists
         ensure_data_folder()
         
-        # Load PDF documents
-        print("📚 Loading PDF documents...")
-        docs = load_pdf_file("Data")
-        
-        # Split documents into chunks
-        print("✂️ Splitting documents...")
-        text_chunks = split_documents(docs, chunk_size=500, chunk_overlap=20)
-        
-        # Initialize embeddings
-        print("🔤 Initializing embeddings...")
-        embeddings = get_embeddings()
+        mode = "streaming" if streaming else "incremental" if incremental else "full"
+        with telemetry.trace("ingest", mode=mode, index=index_name):
+            if streaming:
+                ingest_streaming(data_folder, index_name, parallel=parallel)
+            elif incremental:
+                ingest_incremental(data_folder, index_name, parallel=parallel)
+            else:
+                ingest_full(data_folder, index_name, parallel=parallel)
         
-        # Build vector store
-        print("🏗️ Building vector store...")
-        vector_store = build_vector_store(text_chunks, "fintutor", embeddings)
+        if telemetry.ENABLED and telemetry.recent_traces:
+            print("⏱️ Time per stage:")
+            for name, (count, ms) in telemetry.stage_totals(telemetry.recent_traces[-1]).items():
+                print(f"  {name:15s} {count:6d} calls {ms / 1000:9.2f}s")
         
         # Get and display stats
         print("📊 Getting vector store statistics...")
-        stats = get_vector_store_stats("fintutor")
-        print(f"Vector store created with {stats.get('total_vector_count', 0)} vectors")
+        stats = get_vector_store_stats(index_name)
+        print(f"Vector store contains {stats.get('total_vector_count', 0)} vectors")
         
         print("✅ Data ingestion completed successfully!")
         return True
@@ -50,6 +427,13 @@ def ingest_data():
         return False
 
 if __name__ == "__main__":
-    success = ingest_data()
+    parser = argparse.ArgumentParser(description="Ingest PDF documents into the FinTutor vector store")
+    parser.add_argument("--full", action="store_true", help="re-embed and upsert every chunk")
+    parser.add_argument("--parallel", action="store_true", help="parse PDFs in a process pool")
+    parser.add_argument("--streaming", action="store_true",
+                        help="overlap loading, embedding and upserting with bounded memory")
+    args = parser.parse_args()
+    
+    success = ingest_data(incremental=not args.full, parallel=args.parallel, streaming=args.streaming)
     if not success:
         sys.exit(1)
@@ -0,0 +1,141 @@
+import hashlib
+import sqlite3
+import threading
+import time
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from src import telemetry
+
+class CachedEmbeddings(Embeddings):
+    """Persistent embedding cache keyed by model name plus a hash of the text.
+    
+    Vectors are stored as raw float32 blobs in SQLite and evicted least
+    recently used first once `max_entries` is exceeded, down to 99% of it so
+    the table is not counted again on every insert. Only cache misses
+    are sent to the wrapped embedder. `encode(texts, cache=False)` reads the
+    cache without writing to it, for one-off texts that would only evict
+    useful entries.
+    """
+    
+    def __init__(self, embedder, path, max_entries=500_000):
+        self.embedder = embedder
+        self.model_name = getattr(embedder, "model_id", getattr(embedder, "model_name", type(embedder).__name__))
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        
+        # Vectors from differently configured engines must never be mixed
+        self._namespace = f"{self.model_name}\x00{getattr(embedder, 'normalize', False)}\x00"
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "key BLOB PRIMARY KEY, vector BLOB NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings(last_used)")
+        self._conn.commit()
+        # Running row count, so the cap is checked without scanning the table
+        self._entries = self._count()
+    
+    def __getattr__(self, name):
+        # Expose the wrapped engine's attributes (dimension, close, ...)
+        if name == "embedder":
+            raise AttributeError(name)
+        return getattr(self.embedder, name)
+    
+    def _key(self, text):
+        return hashlib.sha1((self._namespace + text).encode("utf-8")).digest()
+    
+    def _lookup(self, keys, batch_size=500):
+        found = {}
+        for start in range(0, len(keys), batch_size):
+            batch = keys[start:start + batch_size]
+            rows = self._conn.execute(
+                f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(batch))})",
+                batch
+            ).fetchall()
+            found.update((key, np.frombuffer(vector, dtype=np.float32)) for key, vector in rows)
+        return found
+    
+    def _count(self):
+        return self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+    
+    def _evict(self):
+        if self._entries <= self.max_entries:
+            return
+        # Other processes may share the file, so count for real before deleting
+        self._entries = self._count()
+        excess = self._entries - self.max_entries * 99 // 100
+        if self._entries > self.max_entries and excess > 0:
+            self._entries -= self._conn.execute(
+                "DELETE FROM embeddings WHERE key IN "
+                "(SELECT key FROM embeddings ORDER BY last_used LIMIT ?)",
+                (excess,)
+            ).rowcount
+    
+    def _embed_misses(self, texts):
+        if hasattr(self.embedder, "encode"):
+            return np.asarray(self.embedder.encode(texts), dtype=np.float32)
+        return np.asarray(self.embedder.embed_documents(texts), dtype=np.float32)
+    
+    def encode(self, texts, cache=True):
+        """Embed texts into a float32 array, computing only uncached ones (stored unless `cache=False`)"""
+        texts = list(texts)
+        keys = [self._key(text) for text in texts]
+        now = time.time()
+        
+        with self._lock:
+            found = self._lookup(list(set(keys)))
+            if found and cache:
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE key = ?",
+                    [(now, key) for key in found]
+                )
+        
+        # Deduplicate misses so repeated boilerplate is embedded once
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in found and key not in missing:
+                missing[key] = text
+        
+        if missing:
+            vectors = self._embed_misses(list(missing.values()))
+            found.update(zip(missing, vectors))
+        
+        if missing and cache:
+            with self._lock:
+                # Ignoring rows another process just stored keeps the running count exact
+                self._entries += self._conn.executemany(
+                    "INSERT OR IGNORE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)",
+                    [(key, vector.tobytes(), now) for key, vector in zip(missing, vectors)]
+                ).rowcount
+                self._evict()
+        
+        with self._lock:
+            self._conn.commit()
+            self.hits += len(texts) - len(missing)
+            self.misses += len(missing)
+        telemetry.incr("fintutor_cache_hits_total", len(texts) - len(missing), cache="embedding")
+        telemetry.incr("fintutor_cache_misses_total", len(missing), cache="embedding")
+        
+        if not texts:
+            return np.empty((0, getattr(self.embedder, "dimension", 0)), dtype=np.float32)
+        return np.stack([found[key] for key in keys])
+    
+    def embed_documents(self, texts):
+        return self.encode(texts).tolist()
+    
+    def embed_query(self, text):
+        return self.encode([text])[0].tolist()
+    
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+    
+    def stats(self):
+        with self._lock:
+            entries = self._count()
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hit_rate(), "entries": entries}
@@ -1,12 +1,157 @@
-from langchain_huggingface import HuggingFaceEmbeddings
+import os
+import atexit
+import numpy as np
+from langchain_core.embeddings import Embeddings
 
-def get_embeddings():
-    """Use HuggingFace embeddings"""
+MODEL_NAME = 'sentence-transformers/all-MiniLM-L6-v2'
+
+class EmbeddingEngine(Embeddings):
+    """Batched sentence-transformers embedder that works in float32 NumPy arrays.
+    
+    Texts are sorted by length before batching so each batch pads to a
+    similar length, and large `embed_documents` calls can be spread over a
+    pool of worker processes. Lists are only built at the LangChain boundary.
+    """
+    
+    def __init__(self, model_name=MODEL_NAME, batch_size=64, device="cpu", normalize=False,
+                 num_threads=None, pool_workers=0, pool_threshold=2048, backend="torch", model_file=None):
+        from sentence_transformers import SentenceTransformer
+        
+        if num_threads:
+            import torch
+            torch.set_num_threads(num_threads)
+        
+        self.model_name = model_name
+        # Exported variants embed slightly differently, so caches keep them apart
+        self.model_id = model_name if backend == "torch" and not model_file else f"{model_name}[{backend}:{model_file or ''}]"
+        self.batch_size = batch_size
+        self.device = device
+        self.normalize = normalize
+        self.pool_workers = pool_workers
+        self.pool_threshold = pool_threshold
+        
+        # A local directory (e.g. an exported ONNX or quantized model) avoids Hub lookups
+        options = {}
+        if backend != "torch":
+            options["backend"] = backend
+        if model_file:
+            options["model_kwargs"] = {"file_name": model_file}
+        self.model = SentenceTransformer(model_name, device=device, **options)
+        self.dimension = self.model.get_sentence_embedding_dimension()
+        self._pool = None
+    
+    def _get_pool(self):
+        """Start the multi-process pool on first use"""
+        if self._pool is None:
+            # Split the cores between workers instead of letting each use all of them
+            threads = max(1, (os.cpu_count() or 1) // self.pool_workers)
+            previous = os.environ.get("OMP_NUM_THREADS")
+            os.environ["OMP_NUM_THREADS"] = str(threads)
+            try:
+                self._pool = self.model.start_multi_process_pool([self.device] * self.pool_workers)
+            finally:
+                if previous is None:
+                    os.environ.pop("OMP_NUM_THREADS", None)
+                else:
+                    os.environ["OMP_NUM_THREADS"] = previous
+            atexit.register(self.close)
+        return self._pool
+    
+    def encode(self, texts):
+        """Embed texts into an (n, dimension) float32 array"""
+        texts = list(texts)
+        if not texts:
+            return np.empty((0, self.dimension), dtype=np.float32)
+        
+        # Longest first, so batches pad to similar lengths and padding waste is small
+        order = np.argsort([-len(text) for text in texts], kind="stable")
+        sorted_texts = [texts[i] for i in order]
+        
+        if self.pool_workers and len(texts) >= self.pool_threshold:
+            vectors = self.model.encode_multi_process(
+                sorted_texts, self._get_pool(), batch_size=self.batch_size
+            )
+        else:
+            vectors = self.model.encode(
+                sorted_texts,
+                batch_size=self.batch_size,
+                convert_to_numpy=True,
+                show_progress_bar=False
+            )
+        vectors = np.asarray(vectors, dtype=np.float32)
+        
+        if self.normalize:
+            norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+            vectors /= np.maximum(norms, 1e-12)
+        
+        result = np.empty_like(vectors)
+        result[order] = vectors
+        return result
+    
+    def embed_documents(self, texts):
+        return self.encode(texts).tolist()
+    
+    def embed_query(self, text):
+        return self.encode([text])[0].tolist()
+    
+    def close(self):
+        """Stop the multi-process pool, if one was started"""
+        if self._pool is not None:
+            self.model.stop_multi_process_pool(self._pool)
+            self._pool = None
+
+def get_embeddings(batch_size=None, num_threads=None, pool_workers=None, device=None, normalize=False,
+                   cache=None):
+    """Use HuggingFace embeddings through the batched embedding engine.
+    
+    Unset options fall back to the EMBEDDING_BATCH_SIZE, EMBEDDING_THREADS,
+    EMBEDDING_WORKERS and EMBEDDING_DEVICE environment variables.
+    EMBEDDING_MODEL may name a local copy of the model, loaded with
+    EMBEDDING_BACKEND ("torch" or "openvino") from EMBEDDING_MODEL_FILE
+    when the directory holds several exported variants. EMBEDDING_BACKEND=onnx
+    instead runs a model exported by src/onnx_embeddings.py (int8 by default)
+    on ONNX Runtime without loading torch. Unless
+    disabled with `cache=False` or EMBEDDING_CACHE=0, vectors are cached on
+    disk (EMBEDDING_CACHE_SIZE entries at most) so repeated texts are
+    embedded once.
+    """
+    if cache is None:
+        cache = os.getenv("EMBEDDING_CACHE", "1") != "0"
+    
+    backend = os.getenv("EMBEDDING_BACKEND", "torch")
+    batch_size = batch_size or int(os.getenv("EMBEDDING_BATCH_SIZE", "64"))
+    num_threads = num_threads or int(os.getenv("EMBEDDING_THREADS", "0")) or None
+    
     try:
-        return HuggingFaceEmbeddings(
-            model_name='sentence-transformers/all-MiniLM-L6-v2'
+        if backend == "onnx":
+            from src.onnx_embeddings import DEFAULT_MODEL_DIR, OnnxEmbeddingEngine
+            engine = OnnxEmbeddingEngine(
+                model_dir=os.getenv("EMBEDDING_MODEL", DEFAULT_MODEL_DIR),
+                model_file=os.getenv("EMBEDDING_MODEL_FILE") or "model_int8.onnx",
+                batch_size=batch_size,
+                num_threads=num_threads,
+                normalize=normalize
+            )
+        else:
+            engine = EmbeddingEngine(
+                model_name=os.getenv("EMBEDDING_MODEL", MODEL_NAME),
+                backend=backend,
+                model_file=os.getenv("EMBEDDING_MODEL_FILE") or None,
+                batch_size=batch_size,
+                num_threads=num_threads,
+                pool_workers=pool_workers if pool_workers is not None else int(os.getenv("EMBEDDING_WORKERS", "0")),
+                device=device or os.getenv("EMBEDDING_DEVICE", "cpu"),
+                normalize=normalize
+            )
+        if not cache:
+            return engine
+        
+        from src.embedding_cache import CachedEmbeddings
+        from src.utils import get_cache_path
+        return CachedEmbeddings(
+            engine,
+            get_cache_path("embeddings.sqlite"),
+            max_entries=int(os.getenv("EMBEDDING_CACHE_SIZE", "500000"))
         )
     except Exception as e:
         raise Exception(f"Failed to load embeddings: {e}")
-
-
@@ -0,0 +1,45 @@
+import json
+
+# Metadata fields chunks can be filtered on; the local index keeps posting lists for each
+FILTER_FIELDS = ("course", "module", "source")
+
+def normalize_filter(filter):
+    """Turn a filter into {field: (values, ...)}, matching any of the values per field.
+    
+    Values may be given plainly ({"course": "derivatives"}), as lists, or
+    in Pinecone's {"$eq": ...} / {"$in": [...]} form. Empty values are
+    dropped, so an empty or None filter matches everything.
+    """
+    normalized = {}
+    for field, condition in (filter or {}).items():
+        if isinstance(condition, dict):
+            if set(condition) - {"$eq", "$in"}:
+                raise ValueError(f"Unsupported filter on '{field}': {condition}, expected $eq or $in")
+            values = [condition["$eq"]] if "$eq" in condition else list(condition.get("$in", []))
+        elif isinstance(condition, (list, tuple, set)):
+            values = list(condition)
+        else:
+            values = [condition]
+        values = tuple(sorted({str(value) for value in values if value not in (None, "")}))
+        if values:
+            normalized[field] = values
+    return normalized
+
+def matches_filter(metadata, filter):
+    """Whether a chunk's metadata satisfies a filter"""
+    return all(
+        str(metadata.get(field)) in values
+        for field, values in normalize_filter(filter).items()
+    )
+
+def to_pinecone_filter(filter):
+    """The Pinecone metadata filter equivalent to a filter, or None"""
+    return {
+        field: {"$eq": values[0]} if len(values) == 1 else {"$in": list(values)}
+        for field, values in normalize_filter(filter).items()
+    } or None
+
+def filter_key(filter):
+    """Stable string for a filter, used in cache keys ("" when unfiltered)"""
+    normalized = normalize_filter(filter)
+    return json.dumps(normalized, sort_keys=True) if normalized else ""
@@ -0,0 +1,75 @@
+import json
+import os
+import time
+import uuid
+from collections import deque
+
+class ChatHistory:
+    """Per-session chat history holding only the latest `window` messages in memory.
+    
+    Older messages are appended to a JSON-lines file under `folder` and read
+    back only when asked for, so a long-lived browser tab uses bounded
+    memory. Each message is rendered once, when it is added, and the
+    rendered window is emitted as a single block on reruns.
+    """
+    
+    def __init__(self, folder, window=50, render=None, session_id=None):
+        self.window = window
+        self.render = render or (lambda role, content: content)
+        self.path = os.path.join(folder, f"{session_id or uuid.uuid4().hex}.jsonl")
+        self.messages = deque()  # (role, content, rendered HTML)
+        self.spilled = 0
+    
+    def __len__(self):
+        return self.spilled + len(self.messages)
+    
+    def __iter__(self):
+        return ((role, content) for role, content, _ in self.messages)
+    
+    def append(self, role, content):
+        self.messages.append((role, content, self.render(role, content)))
+        if len(self.messages) > self.window:
+            self._spill(len(self.messages) - self.window)
+    
+    def _spill(self, count):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path, "a", encoding="utf-8") as f:
+            for _ in range(count):
+                role, content, _ = self.messages.popleft()
+                f.write(json.dumps({"role": role, "content": content}, ensure_ascii=False) + "\n")
+        self.spilled += count
+    
+    def last(self):
+        """The newest (role, content) pair, or None"""
+        return self.messages[-1][:2] if self.messages else None
+    
+    def html(self):
+        """Rendered HTML of the in-memory window"""
+        return "".join(rendered for _, _, rendered in self.messages)
+    
+    def older(self, limit):
+        """Rendered HTML of up to `limit` of the most recent spilled messages"""
+        if not self.spilled or limit <= 0:
+            return ""
+        with open(self.path, "r", encoding="utf-8") as f:
+            lines = deque(f, maxlen=limit)
+        return "".join(self.render(message["role"], message["content"]) for message in map(json.loads, lines))
+    
+    def clear(self):
+        self.messages.clear()
+        self.spilled = 0
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+def prune_sessions(folder, max_age=7 * 24 * 3600):
+    """Delete spilled histories of sessions untouched for `max_age` seconds"""
+    if not os.path.isdir(folder):
+        return 0
+    cutoff = time.time() - max_age
+    removed = 0
+    for name in os.listdir(folder):
+        path = os.path.join(folder, name)
+        if name.endswith(".jsonl") and os.path.getmtime(path) < cutoff:
+            os.remove(path)
+            removed += 1
+    return removed
@@ -0,0 +1,312 @@
+import asyncio
+import threading
+import time
+from typing import Any, List, Optional
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from pydantic import PrivateAttr
+
+from src import telemetry
+
+_loop = None
+_loop_lock = threading.Lock()
+
+def _background_loop():
+    """Event loop on a daemon thread that runs dispatches for synchronous callers"""
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="llm-router", daemon=True).start()
+    return _loop
+
+def _iterate(chunks):
+    """Iterate an async generator from synchronous code, closing it if the caller stops early"""
+    loop = _background_loop()
+    try:
+        while True:
+            try:
+                yield asyncio.run_coroutine_threadsafe(chunks.__anext__(), loop).result()
+            except StopAsyncIteration:
+                return
+    finally:
+        asyncio.run_coroutine_threadsafe(chunks.aclose(), loop).result()
+
+class LLMBudgetExceeded(TimeoutError):
+    """No model started answering within the request's latency budget"""
+
+class CircuitBreaker:
+    """Stop sending requests to a model after `threshold` consecutive failures.
+    
+    Once open, the breaker lets a single trial request through after
+    `cooldown` seconds (half-open). The trial's success closes the breaker
+    and its failure opens it again for another cooldown.
+    """
+    
+    def __init__(self, threshold=3, cooldown=30.0):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self.trial = False
+        self._lock = threading.Lock()
+    
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        return "half-open" if time.monotonic() - self.opened_at >= self.cooldown else "open"
+    
+    def allow(self):
+        """Whether a request may be sent now; claims the trial slot when half-open"""
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if self.trial or time.monotonic() - self.opened_at < self.cooldown:
+                return False
+            self.trial = True
+            return True
+    
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial = False
+    
+    def record_failure(self):
+        """Count a failure, returning True if it opened the breaker"""
+        with self._lock:
+            self.failures += 1
+            opened = self.trial or (self.opened_at is None and self.failures >= self.threshold)
+            if opened:
+                self.opened_at = time.monotonic()
+            self.trial = False
+            return opened
+    
+    def release(self):
+        """Give back a trial slot whose request was abandoned before it finished"""
+        with self._lock:
+            self.trial = False
+
+class ModelRoute:
+    """One chat model behind the router, with its breaker and latency estimate.
+    
+    `latency` is an exponentially weighted moving average of the seconds
+    to the first token (or the whole reply when not streaming).
+    """
+    
+    def __init__(self, name, llm, breaker=None, alpha=0.3):
+        self.name = name
+        self.llm = llm
+        self.breaker = breaker or CircuitBreaker()
+        self.alpha = alpha
+        self.latency = None
+        self.requests = 0
+        self.wins = 0
+        self.failures = 0
+    
+    def observe(self, seconds):
+        self.latency = seconds if self.latency is None else self.latency + self.alpha * (seconds - self.latency)
+    
+    def stats(self):
+        return {
+            "latency_ms": self.latency * 1000 if self.latency is not None else None,
+            "requests": self.requests,
+            "wins": self.wins,
+            "failures": self.failures,
+            "breaker": self.breaker.state,
+        }
+
+class LLMRouter(BaseChatModel):
+    """Chat model that dispatches each request across several models.
+    
+    Models are tried fastest first by their latency estimate, in configured
+    order until measured, skipping those whose circuit breaker is open. If
+    the first model has not produced a token after `hedge_delay` seconds, the
+    next one is started as well (up to `max_hedges` extra requests) and the
+    first to answer wins; the others are cancelled. A failed model falls
+    through to the next. A request with no token after `budget` seconds
+    raises LLMBudgetExceeded. Once a model is streaming, the rest of its
+    answer is bounded only by the client timeout, and a mid-stream failure
+    is raised rather than retried so that no text is repeated.
+    """
+    
+    routes: List[Any]
+    budget: Optional[float] = None
+    hedge_delay: Optional[float] = 2.0
+    max_hedges: int = 1
+    streaming: bool = True
+    
+    _lock: Any = PrivateAttr(default_factory=threading.Lock)
+    
+    @property
+    def _llm_type(self):
+        return "fintutor-router"
+    
+    def ranked(self):
+        """Routes whose breaker is not open, measured fastest first, then unmeasured in configured order"""
+        with self._lock:
+            order = sorted(
+                range(len(self.routes)),
+                key=lambda i: (self.routes[i].latency is None, self.routes[i].latency or 0.0, i)
+            )
+        return [self.routes[i] for i in order if self.routes[i].breaker.state != "open"]
+    
+    def stats(self):
+        with self._lock:
+            return {route.name: route.stats() for route in self.routes}
+    
+    def _claim(self, candidates):
+        """The next candidate whose breaker admits a request, or None"""
+        for route in candidates:
+            if route.breaker.allow():
+                with self._lock:
+                    route.requests += 1
+                return route
+        return None
+    
+    def _failed(self, route, error):
+        print(f"LLM '{route.name}' failed: {error}")
+        with self._lock:
+            route.failures += 1
+        telemetry.incr("fintutor_llm_failures_total", model=route.name)
+        if route.breaker.record_failure():
+            print(f"Circuit breaker opened for LLM '{route.name}'")
+            telemetry.incr("fintutor_llm_breaker_opened_total", model=route.name)
+    
+    def _won(self, route, seconds, losers):
+        with self._lock:
+            route.wins += 1
+            route.observe(seconds)
+            # A request cancelled after running longer than the winner is at least that slow
+            for loser, loser_seconds in losers:
+                if loser_seconds > seconds and (loser.latency is None or loser_seconds > loser.latency):
+                    loser.observe(loser_seconds)
+        for loser, _ in losers:
+            loser.breaker.release()
+        telemetry.observe("fintutor_llm_first_token_seconds", seconds, model=route.name)
+    
+    def _unavailable(self, errors):
+        if errors:
+            return errors[-1]
+        return RuntimeError("No LLM available: every model's circuit breaker is open")
+    
+    async def _dispatch(self, produce):
+        """Race `produce(route)` async iterators across routes, yielding the winner's chunks"""
+        started = time.monotonic()
+        deadline = started + self.budget if self.budget else None
+        next_hedge = started + self.hedge_delay if self.hedge_delay is not None and self.max_hedges else None
+        candidates = iter(self.ranked())
+        events = asyncio.Queue()
+        running = {}  # route -> (start time, task)
+        errors = []
+        hedges = 0
+        
+        async def pump(route):
+            try:
+                async for chunk in produce(route):
+                    events.put_nowait((route, chunk, None))
+                events.put_nowait((route, None, None))
+            except Exception as e:
+                events.put_nowait((route, None, e))
+        
+        def launch():
+            route = self._claim(candidates)
+            if route is not None:
+                running[route] = (time.monotonic(), asyncio.create_task(pump(route)))
+            return route is not None
+        
+        try:
+            if not launch():
+                raise self._unavailable(errors)
+            
+            # Wait for the first token, hedging and falling back until one arrives
+            winner, buffered = None, {}
+            while winner is None:
+                wake = min((t for t in (next_hedge, deadline) if t is not None), default=None)
+                try:
+                    route, chunk, error = await asyncio.wait_for(
+                        events.get(), None if wake is None else max(0.0, wake - time.monotonic())
+                    )
+                except asyncio.TimeoutError:
+                    if deadline is not None and time.monotonic() >= deadline:
+                        exceeded = LLMBudgetExceeded(f"No LLM answered within {self.budget:.1f}s")
+                        for route in list(running):
+                            running.pop(route)[1].cancel()
+                            self._failed(route, exceeded)
+                        telemetry.incr("fintutor_llm_budget_exceeded_total")
+                        raise exceeded
+                    hedged = launch()
+                    if hedged:
+                        hedges += 1
+                        telemetry.incr("fintutor_llm_hedges_total")
+                    next_hedge = time.monotonic() + self.hedge_delay if hedged and hedges < self.max_hedges else None
+                    continue
+                
+                if error is not None:
+                    del running[route]
+                    errors.append(error)
+                    self._failed(route, error)
+                    if not running:
+                        if not launch():
+                            raise self._unavailable(errors)
+                        telemetry.incr("fintutor_llm_fallbacks_total")
+                    continue
+                if chunk is not None:
+                    buffered.setdefault(route, []).append(chunk)
+                if chunk is None or chunk.content:
+                    winner = route
+            
+            done = chunk is None
+            now = time.monotonic()
+            losers = [(route, now - route_started) for route, (route_started, _) in running.items() if route is not winner]
+            for route, _ in losers:
+                running.pop(route)[1].cancel()
+            self._won(winner, now - running[winner][0], losers)
+            
+            for chunk in buffered.get(winner, []):
+                yield chunk
+            while not done:
+                route, chunk, error = await events.get()
+                if route is not winner:
+                    continue
+                if error is not None:
+                    del running[winner]
+                    self._failed(winner, error)
+                    raise error
+                done = chunk is None
+                if not done:
+                    yield chunk
+            del running[winner]
+            winner.breaker.record_success()
+        finally:
+            for route, (_, task) in running.items():
+                task.cancel()
+                route.breaker.release()
+    
+    def _child_config(self):
+        # Routed models run without the caller's callbacks, which see the router as the one chat model
+        return {"callbacks": []}
+    
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        def produce(route):
+            return route.llm.astream(messages, config=self._child_config(), stop=stop, **kwargs)
+        
+        async for chunk in self._dispatch(produce):
+            yield ChatGenerationChunk(message=chunk)
+    
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        return _iterate(self._astream(messages, stop=stop, **kwargs))
+    
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        async def produce(route):
+            yield await route.llm.ainvoke(messages, config=self._child_config(), stop=stop, **kwargs)
+        
+        replies = [reply async for reply in self._dispatch(produce)]
+        return ChatResult(generations=[ChatGeneration(message=replies[0])])
+    
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        return asyncio.run_coroutine_threadsafe(
+            self._agenerate(messages, stop=stop, **kwargs), _background_loop()
+        ).result()
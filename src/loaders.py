@@ -1,23 +1,205 @@
 import os
+import re
+import time
+import multiprocessing
+from collections import deque
 from langchain_community.document_loaders import DirectoryLoader, PyPDFLoader
+from langchain_core.documents import Document
 
-def load_pdf_file(data_folder):
-    """Load all PDF files in a folder using DirectoryLoader & PyPDFLoader."""
-    # Normalize the folder path
+DEFAULT_COURSE = "general"
+
+def list_pdf_files(data_folder):
+    """Return the sorted paths of all PDF files in a folder and its course subfolders"""
     data_folder = os.path.normpath(data_folder)
     
     if not os.path.exists(data_folder):
         raise FileNotFoundError(f"Directory not found: '{data_folder}'")
     
+    return sorted(
+        os.path.join(root, f)
+        for root, _, files in os.walk(data_folder)
+        for f in files
+        if f.lower().endswith('.pdf')
+    )
+
+def slugify(name):
+    return re.sub(r"[^a-z0-9]+", "-", name.lower()).strip("-") or "untitled"
+
+def course_tags(file_path, data_folder="Data"):
+    """Course and module of a PDF from its place under the data folder.
+    
+    Data/<course>/<module>/file.pdf gives both from the folders;
+    Data/<course>/file.pdf and Data/file.pdf use the file name as the
+    module, and the latter falls under the "general" course.
+    """
+    relative = os.path.relpath(os.path.normpath(file_path), os.path.normpath(data_folder))
+    folders = os.path.dirname(relative).split(os.sep) if os.path.dirname(relative) else []
+    stem = os.path.splitext(os.path.basename(relative))[0]
+    return {
+        "course": slugify(folders[0]) if folders else DEFAULT_COURSE,
+        "module": slugify(folders[1] if len(folders) > 1 else stem),
+    }
+
+def load_pdf(file_path):
+    """Load the pages of a single PDF file using PyPDFLoader."""
+    try:
+        return PyPDFLoader(file_path).load()
+    except Exception as e:
+        raise Exception(f"Failed to load PDF file '{file_path}': {e}")
+
+def _count_pages(file_path):
+    """Return the number of pages in a PDF"""
+    from pypdf import PdfReader
+    return len(PdfReader(file_path).pages)
+
+def _extract_page_range(file_path, start, stop):
+    """Worker task: pages [start, stop) of a PDF as Documents, as PyPDFLoader loads them.
+    
+    Text and metadata must match the serial path exactly, since chunk IDs
+    hash the text; this follows PyPDFParser's page mode with its defaults.
+    """
+    import pypdf
+    from langchain_community.document_loaders.parsers.pdf import PyPDFParser, _purge_metadata
+    
+    parser = PyPDFParser()
+    reader = pypdf.PdfReader(file_path)
+    metadata = _purge_metadata(
+        {"producer": "PyPDF", "creator": "PyPDF", "creationdate": ""}
+        | dict(reader.metadata or {})
+        | {"source": file_path, "total_pages": len(reader.pages)}
+    )
+    
+    def extract(page):
+        if pypdf.__version__.startswith("3"):
+            return page.extract_text()
+        return page.extract_text(extraction_mode=parser.extraction_mode, **parser.extraction_kwargs)
+    
+    return [
+        Document(
+            page_content=extract(reader.pages[i]).strip(),
+            metadata={**metadata, "page": i, "page_label": reader.page_labels[i]}
+        )
+        for i in range(start, stop)
+    ]
+
+def _submit_file(pool, entry):
+    """Queue a file's page count, or one task per page range once it is counted"""
+    if "num_pages" not in entry:
+        entry["count"] = pool.apply_async(_count_pages, (entry["path"],))
+        return
+    entry["results"] = [
+        pool.apply_async(_extract_page_range, (entry["path"], start, stop))
+        for start, stop in entry["ranges"]
+    ]
+
+def _submit_ranges(pool, entry, num_pages, pages_per_task):
+    entry["num_pages"] = num_pages
+    entry["ranges"] = [
+        (start, min(start + pages_per_task, num_pages))
+        for start in range(0, num_pages, pages_per_task)
+    ]
+    _submit_file(pool, entry)
+
+def iter_pdf_documents(pdf_files, workers=None, timeout=300, pages_per_task=25):
+    """Yield PDF pages as Documents parsed in a process pool, in file and page order.
+    
+    Large files are split into ranges of `pages_per_task` pages spread across
+    workers. Only about two files per worker are in flight at once, so memory
+    stays bounded. Pages are counted in the workers too, so a file that
+    takes longer than `timeout` seconds to count and parse, or fails to,
+    is skipped without stalling the rest of the batch.
+    """
+    workers = workers or os.cpu_count() or 1
+    window = workers * 2
+    todo = deque(os.path.normpath(f) for f in pdf_files)
+    in_flight = deque()
+    if not todo:
+        return
+    
+    # Spawned workers never inherit the parent's threads or model state
+    context = multiprocessing.get_context("spawn")
+    pool = context.Pool(workers)
+    
+    def advance():
+        """Queue the page ranges of files whose count has come back"""
+        for entry in in_flight:
+            if "num_pages" not in entry and entry["count"].ready() and entry["count"].successful():
+                _submit_ranges(pool, entry, entry["count"].get(), pages_per_task)
+    
+    def fill():
+        while todo and len(in_flight) < window:
+            entry = {"path": todo.popleft()}
+            _submit_file(pool, entry)
+            in_flight.append(entry)
+        advance()
+    
+    def wait(result, deadline):
+        # Poll, so that files counted meanwhile get their ranges queued
+        while True:
+            try:
+                return result.get(timeout=max(0, min(0.05, deadline - time.monotonic())))
+            except multiprocessing.TimeoutError:
+                if time.monotonic() >= deadline:
+                    raise
+                advance()
+    
+    try:
+        fill()
+        while in_flight:
+            entry = in_flight.popleft()
+            deadline = time.monotonic() + timeout
+            pages = []
+            try:
+                if "num_pages" not in entry:
+                    _submit_ranges(pool, entry, wait(entry["count"], deadline), pages_per_task)
+                for result in entry["results"]:
+                    pages.extend(wait(result, deadline))
+            except multiprocessing.TimeoutError:
+                print(f"Skipping PDF '{entry['path']}': timed out after {timeout}s")
+                # A hung worker cannot be cancelled, so replace the pool and requeue
+                pool.terminate()
+                pool = context.Pool(workers)
+                for pending in in_flight:
+                    _submit_file(pool, pending)
+                fill()
+                continue
+            except Exception as e:
+                print(f"Skipping PDF '{entry['path']}': {e}")
+                fill()
+                continue
+            
+            fill()
+            yield from pages
+    finally:
+        pool.terminate()
+
+def load_pdf_file(data_folder, parallel=False, workers=None, timeout=300):
+    """Load all PDF files in a folder using DirectoryLoader & PyPDFLoader.
+    
+    With `parallel=True` the files are parsed in a process pool instead;
+    see `iter_pdf_documents` to stream the pages without building a list.
+    """
+    # Normalize the folder path
+    data_folder = os.path.normpath(data_folder)
+    
     # Check if there are any PDF files in the directory
-    pdf_files = [f for f in os.listdir(data_folder) if f.lower().endswith('.pdf')]
+    pdf_files = list_pdf_files(data_folder)
     if not pdf_files:
         raise ValueError(f"No PDF files found in directory: '{data_folder}'")
     
+    if parallel:
+        docs = list(iter_pdf_documents(pdf_files, workers=workers, timeout=timeout))
+        if not docs:
+            raise ValueError("No documents loaded from the PDF files")
+        
+        print(f"Successfully loaded {len(docs)} documents from {len(pdf_files)} PDF files")
+        return docs
+    
     try:
         loader = DirectoryLoader(
             data_folder, 
             glob="*.pdf", 
+            recursive=True,
             loader_cls=PyPDFLoader,
             show_progress=True
         )
@@ -31,4 +213,3 @@ def load_pdf_file(data_folder):
         
     except Exception as e:
         raise Exception(f"Failed to load PDF files: {e}")
-
@@ -0,0 +1,816 @@
+import json
+import os
+import re
+import shutil
+import threading
+import zlib
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.vectorstores import VectorStore
+
+from src.filters import FILTER_FIELDS, normalize_filter
+
+QUANTIZATIONS = ("none", "int8", "pq")
+
+# (rescore, minimum shortlist) per quantization; PQ codes rank far more coarsely than int8,
+# so they need a much longer exactly re-scored shortlist to keep recall near exact search
+_RESCORE = {"none": (8, 32), "int8": (8, 32), "pq": (32, 384)}
+
+# Data files of indexes saved before generations, which kept them beside index.json
+_UNVERSIONED_FILES = (
+    "vectors.npy", "codes.npy", "scale.npy", "codebooks.npy", "centroids.npy", "list_rows.npy",
+    "list_offsets.npy", "docs.bin", "doc_dict.bin", "doc_offsets.npy", "filters.json", "filter_rows.npy",
+)
+
+def _share(source, target):
+    """Hard-link a file into another directory, copying where links are unsupported"""
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copyfile(source, target)
+
+class DocStore:
+    """Read-only store of zlib-compressed JSON records, memory-mapped from disk.
+    
+    Records are compressed one by one against a shared dictionary sampled
+    from the data, so short chunks still compress well, and reading a
+    record only touches its own bytes.
+    """
+    
+    def __init__(self, path):
+        self.path = path
+        self.offsets = np.load(os.path.join(path, "doc_offsets.npy"), mmap_mode="r")
+        with open(os.path.join(path, "doc_dict.bin"), "rb") as f:
+            self.zdict = f.read()
+        size = int(self.offsets[-1])
+        self.data = np.memmap(os.path.join(path, "docs.bin"), dtype=np.uint8, mode="r") if size else b""
+    
+    def __len__(self):
+        return len(self.offsets) - 1
+    
+    def __getitem__(self, row):
+        raw = bytes(self.data[int(self.offsets[row]):int(self.offsets[row + 1])])
+        decompressor = zlib.decompressobj(zdict=self.zdict)
+        return json.loads(decompressor.decompress(raw) + decompressor.flush())
+    
+    @staticmethod
+    def exists(path):
+        return os.path.exists(os.path.join(path, "doc_offsets.npy"))
+    
+    @classmethod
+    def write(cls, path, records, append_to=None):
+        """Write records (or append them to `append_to`) and return the reopened store.
+        
+        Appending into another directory shares the existing docs.bin with a
+        hard link and appends past its last record, so the older store still
+        reads exactly the bytes it was written with.
+        """
+        encoded = [json.dumps(record, ensure_ascii=False).encode("utf-8") for record in records]
+        if append_to is not None:
+            zdict, offsets = append_to.zdict, [int(offset) for offset in append_to.offsets]
+        else:
+            # zlib uses at most 32 KB of dictionary, filled from an even sample
+            step = max(1, len(encoded) // 256)
+            zdict, offsets = b"".join(encoded[::step])[-32768:], [0]
+        
+        blobs = []
+        for record in encoded:
+            compressor = zlib.compressobj(level=6, zdict=zdict)
+            blobs.append(compressor.compress(record) + compressor.flush())
+            offsets.append(offsets[-1] + len(blobs[-1]))
+        
+        docs_path = os.path.join(path, "docs.bin")
+        if append_to is not None:
+            if os.path.abspath(append_to.path) != os.path.abspath(path):
+                for name in ("docs.bin", "doc_dict.bin"):
+                    _share(os.path.join(append_to.path, name), os.path.join(path, name))
+            end = int(append_to.offsets[-1])
+            with open(docs_path, "r+b" if os.path.exists(docs_path) else "wb") as f:
+                # Bytes past the last record are left over from a save that never committed
+                f.truncate(end)
+                f.seek(end)
+                f.write(b"".join(blobs))
+        else:
+            with open(docs_path + ".tmp", "wb") as f:
+                f.write(b"".join(blobs))
+            with open(os.path.join(path, "doc_dict.bin"), "wb") as f:
+                f.write(zdict)
+            os.replace(docs_path + ".tmp", docs_path)
+        
+        tmp_path = os.path.join(path, "doc_offsets.tmp.npy")
+        np.save(tmp_path, np.asarray(offsets, dtype=np.int64))
+        os.replace(tmp_path, os.path.join(path, "doc_offsets.npy"))
+        return cls(path)
+
+class MetadataList:
+    """Per-row metadata: rows saved in a DocStore followed by rows added since"""
+    
+    def __init__(self, store=None, records=None):
+        self.store = store
+        self.records = list(records or [])
+    
+    def __len__(self):
+        return (len(self.store) if self.store is not None else 0) + len(self.records)
+    
+    def __getitem__(self, row):
+        stored = len(self.store) if self.store is not None else 0
+        return self.store[row] if row < stored else self.records[row - stored]
+    
+    def __iter__(self):
+        return (self[row] for row in range(len(self)))
+    
+    def extend(self, records):
+        self.records.extend(records)
+
+class FilterIndex:
+    """Sorted posting lists of rows per value of each filterable metadata field.
+    
+    Rows added since the last lookup are buffered per value and merged on
+    the next lookup or save, so batched adds stay cheap. A filter is
+    answered by a union of postings per field and an intersection across
+    fields, without reading any chunk metadata.
+    """
+    
+    def __init__(self, fields=FILTER_FIELDS):
+        self.fields = fields
+        self.postings = {}  # (field, value) -> sorted int64 rows
+        self.pending = {}
+        self.rows = 0
+    
+    @staticmethod
+    def exists(path):
+        return os.path.exists(os.path.join(path, "filters.json"))
+    
+    @classmethod
+    def load(cls, path):
+        with open(os.path.join(path, "filters.json"), "r", encoding="utf-8") as f:
+            header = json.load(f)
+        rows = np.load(os.path.join(path, "filter_rows.npy"))
+        index = cls(tuple(header["fields"]))
+        index.postings = {(field, value): rows[start:end] for field, value, start, end in header["keys"]}
+        index.rows = header["rows"]
+        return index
+    
+    def add(self, start, records):
+        """Index metadata records stored at rows start, start + 1, ..."""
+        for row, record in enumerate(records, start):
+            for field in self.fields:
+                value = record.get(field)
+                if value is not None:
+                    self.pending.setdefault((field, str(value)), []).append(row)
+        self.rows = max(self.rows, start + len(records))
+    
+    def _merge(self):
+        for key, rows in self.pending.items():
+            merged = np.asarray(rows, dtype=np.int64)
+            if key in self.postings:
+                merged = np.concatenate([self.postings[key], merged])
+            self.postings[key] = merged
+        self.pending = {}
+    
+    def values(self, field):
+        """The distinct values of a field"""
+        self._merge()
+        return sorted(value for key_field, value in self.postings if key_field == field)
+    
+    def match(self, filter):
+        """Sorted rows matching a filter (deleted rows included)"""
+        self._merge()
+        result = None
+        for field, values in normalize_filter(filter).items():
+            if field not in self.fields:
+                raise ValueError(f"Cannot filter on '{field}', expected one of {self.fields}")
+            parts = [self.postings[(field, value)] for value in values if (field, value) in self.postings]
+            # A row has one value per field, so postings of different values never overlap
+            rows = np.sort(np.concatenate(parts)) if parts else np.empty(0, dtype=np.int64)
+            result = rows if result is None else np.intersect1d(result, rows, assume_unique=True)
+        return np.arange(self.rows) if result is None else result
+    
+    def compact(self, keep):
+        """Renumber rows after the rows in `keep` (sorted) were kept and the rest dropped"""
+        self._merge()
+        remap = np.full(self.rows, -1, dtype=np.int64)
+        remap[keep] = np.arange(len(keep))
+        for key, rows in list(self.postings.items()):
+            rows = remap[rows]
+            rows = rows[rows >= 0]
+            if len(rows):
+                self.postings[key] = rows
+            else:
+                del self.postings[key]
+        self.rows = len(keep)
+    
+    def save(self, path):
+        self._merge()
+        keys, parts, offset = [], [], 0
+        for (field, value), rows in sorted(self.postings.items()):
+            keys.append([field, value, offset, offset + len(rows)])
+            parts.append(rows)
+            offset += len(rows)
+        
+        tmp_path = os.path.join(path, "filter_rows.tmp.npy")
+        np.save(tmp_path, np.concatenate(parts) if parts else np.empty(0, np.int64))
+        os.replace(tmp_path, os.path.join(path, "filter_rows.npy"))
+        tmp_path = os.path.join(path, "filters.json.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"fields": list(self.fields), "rows": self.rows, "keys": keys}, f)
+        os.replace(tmp_path, os.path.join(path, "filters.json"))
+
+def train_int8(vectors, block=65536):
+    """Per-dimension symmetric scales for int8 codes"""
+    scale = np.zeros(vectors.shape[1], dtype=np.float32)
+    for start in range(0, len(vectors), block):
+        scale = np.maximum(scale, np.abs(vectors[start:start + block]).max(axis=0))
+    return np.maximum(scale, 1e-12) / 127
+
+def encode_int8(vectors, scale):
+    return np.clip(np.rint(vectors / scale), -127, 127).astype(np.int8)
+
+def train_pq(vectors, subspaces, iterations=10, seed=0):
+    """Train 256-centroid codebooks per subspace with k-means on a sample"""
+    n, dimension = vectors.shape
+    rng = np.random.default_rng(seed)
+    sample = np.asarray(vectors[np.sort(rng.choice(n, min(n, 256 * 64), replace=False))], dtype=np.float32)
+    sample = sample.reshape(len(sample), subspaces, dimension // subspaces)
+    
+    codebooks = np.empty((subspaces, 256, dimension // subspaces), dtype=np.float32)
+    for j in range(subspaces):
+        points = sample[:, j]
+        # Small samples repeat points, leaving duplicate centroids that are never preferred
+        book = points[rng.choice(len(points), 256, replace=len(points) < 256)].copy()
+        for _ in range(iterations):
+            assignment = np.argmax(points @ book.T - 0.5 * np.sum(book ** 2, axis=1), axis=1)
+            for c in range(256):
+                members = points[assignment == c]
+                if len(members):
+                    book[c] = members.mean(axis=0)
+        codebooks[j] = book
+    return codebooks
+
+def encode_pq(vectors, codebooks, block=65536):
+    """Nearest codebook centroid per subspace, as uint8 codes"""
+    subspaces, _, width = codebooks.shape
+    half_norms = 0.5 * np.sum(codebooks ** 2, axis=2)
+    codes = np.empty((len(vectors), subspaces), dtype=np.uint8)
+    for start in range(0, len(vectors), block):
+        chunk = np.asarray(vectors[start:start + block], dtype=np.float32).reshape(-1, subspaces, width)
+        for j in range(subspaces):
+            codes[start:start + len(chunk), j] = np.argmax(chunk[:, j] @ codebooks[j].T - half_norms[j], axis=1)
+    return codes
+
+class LocalIndex:
+    """In-process cosine index persisted as memory-mapped NumPy files.
+    
+    Small indexes are searched by brute force over the normalized vector
+    matrix. Once an index holds `ivf_threshold` vectors, saving trains an
+    inverted-file (IVF) index: vectors are grouped under k-means centroids
+    and a query only scores the `nprobe` closest lists. Vectors added after
+    training are kept in an unindexed tail that is searched exhaustively
+    until the next retrain.
+    
+    With `quantization="int8"` (4x smaller) or `"pq"` (product quantization,
+    `pq_subspaces` bytes per vector) compact codes are kept in RAM and
+    scanned first; the best `rescore * k` candidates (at least 32, or 384
+    for PQ; `rescore` defaults to 8, or 32 for PQ) are then re-scored
+    exactly against the float32 vectors, which stay memory-mapped on disk.
+    Chunk metadata, including the text, lives in a compressed DocStore that
+    is only read for the final hits.
+    
+    Searches can be restricted with a metadata filter on course, module or
+    source; a FilterIndex of posting lists gives the matching rows up
+    front, so only those rows are scanned.
+    
+    Each save writes a new generation directory and then switches to it by
+    replacing index.json, so a crash mid-save leaves the previous
+    generation intact.
+    
+    The data-plane methods (`upsert`, `delete`, `describe_index_stats`)
+    mirror the Pinecone Index API so both backends can be written to alike.
+    A single index serves every course, so namespaces are ignored.
+    """
+    
+    def __init__(self, path, dimension=384, ivf_threshold=50_000, nprobe=8, quantization="none",
+                 pq_subspaces=48, rescore=None):
+        if quantization not in QUANTIZATIONS:
+            raise ValueError(f"Unknown quantization '{quantization}', expected one of {QUANTIZATIONS}")
+        if quantization == "pq" and dimension % pq_subspaces:
+            raise ValueError(f"pq_subspaces must divide the dimension ({dimension})")
+        
+        self.path = path
+        self.dimension = dimension
+        self.ivf_threshold = ivf_threshold
+        self.nprobe = nprobe
+        self.quantization = quantization
+        self.pq_subspaces = pq_subspaces
+        self.rescore = rescore or _RESCORE[quantization][0]
+        
+        self.vectors = np.empty((0, dimension), dtype=np.float32)
+        self.ids = []
+        self.metadata = MetadataList()
+        self.alive = np.empty(0, dtype=bool)
+        # `vectors` and `alive` are views of the first rows of buffers with spare capacity
+        self.capacity = 0
+        self._vector_buffer = None
+        self._alive_buffer = None
+        self.rows = {}
+        self.filters = FilterIndex()
+        self.generation = 0
+        self._lock = threading.RLock()
+        
+        # Quantized codes cover rows [0, coded_rows); later rows are scored exactly
+        self.codes = None
+        self.coded_rows = 0
+        self.trained_rows = 0
+        self.scale = None
+        self.codebooks = None
+        
+        # IVF state: list `i` holds rows list_rows[list_offsets[i]:list_offsets[i + 1]]
+        self.centroids = None
+        self.list_rows = None
+        self.list_offsets = None
+        self.indexed_rows = 0
+    
+    @classmethod
+    def exists(cls, path):
+        return os.path.exists(os.path.join(path, "index.json"))
+    
+    def _directory(self, generation):
+        """Directory holding a generation's data files (generation 0 predates them)"""
+        return os.path.join(self.path, f"g{generation}") if generation else self.path
+    
+    @classmethod
+    def load(cls, path, **kwargs):
+        """Open a saved index, memory-mapping its arrays"""
+        with open(os.path.join(path, "index.json"), "r", encoding="utf-8") as f:
+            header = json.load(f)
+        
+        kwargs.setdefault("quantization", header.get("quantization", "none"))
+        index = cls(path, dimension=header["dimension"], **kwargs)
+        index.generation = header.get("generation", 0)
+        directory = index._directory(index.generation)
+        index.vectors = np.load(os.path.join(directory, "vectors.npy"), mmap_mode="r")
+        index.ids = header["ids"]
+        if "metadata" in header:
+            # Indexes saved before the DocStore keep metadata in the header
+            index.metadata = MetadataList(records=header["metadata"])
+        else:
+            index.metadata = MetadataList(DocStore(directory))
+        index.alive = np.ones(len(index.ids), dtype=bool)
+        index.rows = {chunk_id: row for row, chunk_id in enumerate(index.ids)}
+        if FilterIndex.exists(directory):
+            index.filters = FilterIndex.load(directory)
+        else:
+            # Indexes saved before filtering was added are indexed once, on load
+            index.filters.add(0, list(index.metadata))
+        
+        # Codes are read into RAM; if the quantization changed they are rebuilt on the next save
+        if header.get("quantization", "none") == index.quantization != "none":
+            index.codes = np.load(os.path.join(directory, "codes.npy"))
+            index.coded_rows = header["coded_rows"]
+            index.trained_rows = header["trained_rows"]
+            if index.quantization == "int8":
+                index.scale = np.load(os.path.join(directory, "scale.npy"))
+            else:
+                index.codebooks = np.load(os.path.join(directory, "codebooks.npy"))
+        
+        if header.get("ivf"):
+            index.centroids = np.load(os.path.join(directory, "centroids.npy"))
+            index.list_rows = np.load(os.path.join(directory, "list_rows.npy"), mmap_mode="r")
+            index.list_offsets = np.load(os.path.join(directory, "list_offsets.npy"))
+            index.indexed_rows = header["indexed_rows"]
+        return index
+    
+    def __len__(self):
+        return int(self.alive.sum())
+    
+    @staticmethod
+    def _normalize(vectors):
+        vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
+    
+    def add(self, ids, vectors, metadata):
+        """Add or replace vectors by ID; of repeated IDs in one call, the last wins"""
+        if len(ids) == 0:
+            return
+        vectors = self._normalize(vectors)
+        if vectors.shape[1] != self.dimension:
+            raise ValueError(f"Expected {self.dimension}-dim vectors, got {vectors.shape[1]}")
+        latest = {chunk_id: i for i, chunk_id in enumerate(ids)}
+        if len(latest) < len(ids):
+            keep = sorted(latest.values())
+            ids, vectors, metadata = [ids[i] for i in keep], vectors[keep], [metadata[i] for i in keep]
+        
+        with self._lock:
+            self.delete(ids)
+            start = len(self.ids)
+            end = start + len(ids)
+            self._reserve(end)
+            self._vector_buffer[start:end] = vectors
+            self._alive_buffer[start:end] = True
+            self.vectors = self._vector_buffer[:end]
+            self.alive = self._alive_buffer[:end]
+            self.ids.extend(ids)
+            self.metadata.extend(metadata)
+            self.filters.add(start, metadata)
+            for offset, chunk_id in enumerate(ids):
+                self.rows[chunk_id] = start + offset
+    
+    def _reserve(self, rows):
+        """Grow the buffers geometrically, so each row is copied O(1) times over many adds"""
+        if rows <= self.capacity:
+            return
+        n = len(self.ids)
+        self.capacity = max(rows, 2 * self.capacity, 1024)
+        self._vector_buffer = np.empty((self.capacity, self.dimension), dtype=np.float32)
+        self._vector_buffer[:n] = self.vectors
+        self._alive_buffer = np.zeros(self.capacity, dtype=bool)
+        self._alive_buffer[:n] = self.alive
+    
+    def delete(self, ids=None, **kwargs):
+        """Delete vectors by ID; rows are tombstoned until the next save"""
+        with self._lock:
+            for chunk_id in ids or []:
+                row = self.rows.pop(chunk_id, None)
+                if row is not None:
+                    self.alive[row] = False
+    
+    def upsert(self, vectors, **kwargs):
+        """Pinecone-style upsert of {"id", "values", "metadata"} records"""
+        self.add(
+            [record["id"] for record in vectors],
+            np.array([record["values"] for record in vectors], dtype=np.float32),
+            [record.get("metadata", {}) for record in vectors]
+        )
+        return {"upserted_count": len(vectors)}
+    
+    def describe_index_stats(self):
+        """Vector counts, overall and per course (reported as namespaces, as Pinecone does)"""
+        with self._lock:
+            namespaces = {
+                course: {"vector_count": int(self.alive[self.filters.match({"course": course})].sum())}
+                for course in self.filters.values("course")
+            }
+        return {
+            "dimension": self.dimension,
+            "total_vector_count": len(self),
+            "namespaces": namespaces,
+            "quantization": self.quantization,
+        }
+    
+    def filter_rows(self, filter):
+        """Sorted live rows whose metadata matches a filter"""
+        with self._lock:
+            rows = self.filters.match(filter)
+            return rows[self.alive[rows]]
+    
+    def memory_usage(self):
+        """Bytes scanned in RAM per search versus bytes left on disk and read on demand"""
+        in_memory = self.codes.nbytes if self.codes is not None else 0
+        # Rows past the codes, or all of them without quantization, are scanned as float32
+        in_memory += (len(self.ids) - self.coded_rows) * self.dimension * 4
+        on_disk = len(self.ids) * self.dimension * 4 if self.codes is not None else 0
+        if self.metadata.store is not None:
+            on_disk += int(self.metadata.store.offsets[-1])
+        return {"in_memory": in_memory, "on_disk": on_disk}
+    
+    def _candidate_rows(self, query):
+        """Rows to score exactly: probed IVF lists plus the unindexed tail"""
+        if self.centroids is None:
+            return None
+        
+        probe = np.argsort(-(self.centroids @ query))[:self.nprobe]
+        parts = [self.list_rows[self.list_offsets[i]:self.list_offsets[i + 1]] for i in probe]
+        parts.append(np.arange(self.indexed_rows, len(self.ids)))
+        return np.concatenate(parts)
+    
+    def _approximate_scores(self, query, rows):
+        """Scores from the quantized codes for coded rows, exact for the unencoded tail"""
+        scores = np.empty(len(rows), dtype=np.float32)
+        coded = rows < self.coded_rows
+        codes = self.codes[rows[coded]]
+        if self.quantization == "int8":
+            scores[coded] = codes.astype(np.float32) @ (query * self.scale)
+        else:
+            # Asymmetric distance: a per-query table of subspace dot products, summed per code
+            table = np.einsum("jcw,jw->jc", self.codebooks, query.reshape(self.pq_subspaces, -1))
+            scores[coded] = table[np.arange(self.pq_subspaces), codes].sum(axis=1)
+        scores[~coded] = self.vectors[rows[~coded]] @ query
+        return scores
+    
+    def _shortlist(self, query, rows, size, block=32768):
+        """The `size` rows with the best approximate scores, scanned block by block"""
+        best_rows, best_scores = [], []
+        for start in range(0, len(rows), block):
+            part = rows[start:start + block]
+            scores = self._approximate_scores(query, part)
+            if len(part) > size:
+                top = np.argpartition(-scores, size - 1)[:size]
+                part, scores = part[top], scores[top]
+            best_rows.append(part)
+            best_scores.append(scores)
+        
+        rows, scores = np.concatenate(best_rows), np.concatenate(best_scores)
+        if len(rows) > size:
+            rows = rows[np.argpartition(-scores, size - 1)[:size]]
+        return rows
+    
+    def search(self, vector, k=4, filter=None):
+        """Return the top-k (row, cosine score) pairs for a query vector, optionally filtered"""
+        if not self.ids:
+            return []
+        query = self._normalize(vector)[0]
+        
+        rows = self._candidate_rows(query)
+        if normalize_filter(filter):
+            allowed = self.filter_rows(filter)
+            if rows is not None:
+                # Probed lists may hold too few matches for a narrow filter; then scan all of them
+                probed = np.intersect1d(rows, allowed, assume_unique=True)
+                rows = probed if len(probed) >= k else allowed
+            else:
+                rows = allowed
+        
+        if self.codes is not None:
+            rows = np.flatnonzero(self.alive) if rows is None else rows[self.alive[rows]]
+            # Exact re-scoring of a shortlist keeps quantization error out of the final ranking
+            size = max(k * self.rescore, _RESCORE[self.quantization][1])
+            rows = np.sort(self._shortlist(query, rows, size)) if len(rows) else rows
+            scores = self.vectors[rows] @ query
+        elif rows is None:
+            scores = self.vectors @ query
+            scores[~self.alive] = -np.inf
+            rows = np.arange(len(scores))
+        else:
+            # Sorted rows keep memory-mapped reads sequential
+            rows = np.sort(rows[self.alive[rows]])
+            scores = self.vectors[rows] @ query
+        
+        if len(rows) == 0:
+            return []
+        k = min(k, len(rows))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(rows[i]), float(scores[i])) for i in top if np.isfinite(scores[i])]
+    
+    def exact_search(self, vector, k=4):
+        """Brute-force float32 search, ignoring IVF and quantization (for evaluation)"""
+        query = self._normalize(vector)[0]
+        scores = np.empty(len(self.ids), dtype=np.float32)
+        for start in range(0, len(scores), 65536):
+            scores[start:start + 65536] = self.vectors[start:start + 65536] @ query
+        scores[~self.alive] = -np.inf
+        top = np.argsort(-scores)[:k]
+        return [(int(row), float(scores[row])) for row in top if np.isfinite(scores[row])]
+    
+    def _train_ivf(self, iterations=10, seed=0):
+        """Cluster the vectors with spherical k-means and build the inverted lists"""
+        n = len(self.ids)
+        nlist = max(1, int(np.sqrt(n)))
+        rng = np.random.default_rng(seed)
+        sample = self.vectors[np.sort(rng.choice(n, min(n, nlist * 64), replace=False))]
+        centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+        
+        for _ in range(iterations):
+            assignment = np.argmax(sample @ centroids.T, axis=1)
+            for i in range(nlist):
+                members = sample[assignment == i]
+                if len(members):
+                    centroid = members.mean(axis=0)
+                    centroids[i] = centroid / max(np.linalg.norm(centroid), 1e-12)
+        
+        assignment = np.empty(n, dtype=np.int32)
+        for start in range(0, n, 65536):
+            block = self.vectors[start:start + 65536]
+            assignment[start:start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+        
+        self.centroids = centroids.astype(np.float32)
+        self.list_rows = np.argsort(assignment, kind="stable").astype(np.int64)
+        self.list_offsets = np.searchsorted(assignment[self.list_rows], np.arange(nlist + 1)).astype(np.int64)
+        self.indexed_rows = n
+    
+    def _compact(self):
+        """Drop tombstoned rows"""
+        if self.alive.all():
+            return False
+        keep = np.flatnonzero(self.alive)
+        self.vectors = np.ascontiguousarray(self.vectors[keep])
+        self.ids = [self.ids[row] for row in keep]
+        self.metadata = MetadataList(records=[self.metadata[row] for row in keep])
+        self.filters.compact(keep)
+        if self.codes is not None:
+            coded = keep[keep < self.coded_rows]
+            self.codes = self.codes[coded]
+            self.coded_rows = len(coded)
+        self.alive = np.ones(len(keep), dtype=bool)
+        self.capacity = 0
+        self.rows = {chunk_id: row for row, chunk_id in enumerate(self.ids)}
+        return True
+    
+    def _encode(self):
+        """Train the quantizer when the index has doubled since training, and encode new rows"""
+        n = len(self.ids)
+        if n == 0:
+            self.codes, self.coded_rows = None, 0
+            return
+        
+        if self.codes is None or n > 2 * self.trained_rows:
+            if self.quantization == "int8":
+                self.scale = train_int8(self.vectors)
+            else:
+                self.codebooks = train_pq(self.vectors, self.pq_subspaces)
+            self.codes, self.coded_rows, self.trained_rows = None, 0, n
+        
+        tail = self.vectors[self.coded_rows:]
+        if self.quantization == "int8":
+            new_codes = encode_int8(tail, self.scale)
+        else:
+            new_codes = encode_pq(tail, self.codebooks)
+        self.codes = new_codes if self.codes is None else np.concatenate([self.codes, new_codes])
+        self.coded_rows = n
+    
+    def _save_metadata(self, directory, compacted):
+        """Write metadata to the DocStore, appending only new rows when nothing was removed"""
+        store = self.metadata.store
+        if store is not None and not compacted:
+            store = DocStore.write(directory, self.metadata.records, append_to=store)
+        else:
+            store = DocStore.write(directory, list(self.metadata))
+        self.metadata = MetadataList(store)
+    
+    def _remove_generations(self, oldest):
+        """Delete the data of generations before `oldest`; readers may still map the one before"""
+        for name in os.listdir(self.path):
+            match = re.fullmatch(r"g(\d+)", name)
+            if match and int(match.group(1)) < oldest:
+                shutil.rmtree(os.path.join(self.path, name), ignore_errors=True)
+        if oldest > 0:
+            for name in _UNVERSIONED_FILES:
+                if os.path.exists(os.path.join(self.path, name)):
+                    os.remove(os.path.join(self.path, name))
+    
+    def save(self):
+        """Compact, retrain the IVF lists if they are stale, and write to disk"""
+        with self._lock:
+            self._save()
+    
+    def _save(self):
+        generation = self.generation + 1
+        directory = self._directory(generation)
+        # Leftovers of a save that crashed before committing this generation
+        shutil.rmtree(directory, ignore_errors=True)
+        os.makedirs(directory)
+        compacted = self._compact()
+        n = len(self.ids)
+        
+        if n < self.ivf_threshold:
+            self.centroids = None
+            self.indexed_rows = 0
+        elif compacted or self.centroids is None or n - self.indexed_rows > 0.1 * n:
+            self._train_ivf()
+        
+        def save_array(name, array):
+            np.save(os.path.join(directory, f"{name}.npy"), array)
+        
+        save_array("vectors", np.asarray(self.vectors, dtype=np.float32))
+        if self.centroids is not None:
+            save_array("centroids", self.centroids)
+            save_array("list_rows", np.asarray(self.list_rows))
+            save_array("list_offsets", self.list_offsets)
+        if self.quantization != "none":
+            self._encode()
+            if self.codes is not None:
+                save_array("codes", self.codes)
+                if self.quantization == "int8":
+                    save_array("scale", self.scale)
+                else:
+                    save_array("codebooks", self.codebooks)
+        self._save_metadata(directory, compacted)
+        self.filters.save(directory)
+        
+        header = {
+            "dimension": self.dimension,
+            "generation": generation,
+            "ids": self.ids,
+            "ivf": self.centroids is not None,
+            "indexed_rows": self.indexed_rows,
+            "quantization": self.quantization if self.codes is not None else "none",
+            "coded_rows": self.coded_rows,
+            "trained_rows": self.trained_rows,
+        }
+        # Replacing index.json is the single step that commits the new generation
+        tmp_path = os.path.join(self.path, "index.json.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(header, f)
+        os.replace(tmp_path, os.path.join(self.path, "index.json"))
+        self.generation = generation
+        self._remove_generations(generation - 1)
+
+def evaluate_recall(index, queries, k=3):
+    """Mean recall@k of `index.search` against exact float32 search"""
+    hits = 0
+    for query in queries:
+        expected = {row for row, _ in index.exact_search(query, k)}
+        hits += len(expected & {row for row, _ in index.search(query, k)}) / max(len(expected), 1)
+    return hits / max(len(queries), 1)
+
+class LocalVectorStore(VectorStore):
+    """LangChain vector store over a LocalIndex, storing chunk text under metadata["text"]"""
+    
+    def __init__(self, index, embedding, text_key="text"):
+        self.index = index
+        self._embedding = embedding
+        self.text_key = text_key
+    
+    @property
+    def embeddings(self):
+        return self._embedding
+    
+    def _embed(self, texts):
+        if hasattr(self._embedding, "encode"):
+            return self._embedding.encode(texts)
+        return np.asarray(self._embedding.embed_documents(texts), dtype=np.float32)
+    
+    def add_texts(self, texts, metadatas=None, ids=None, **kwargs):
+        texts = list(texts)
+        metadatas = metadatas or [{} for _ in texts]
+        if ids is None:
+            from src.manifest import chunk_id
+            ids = [chunk_id(m.get("source", ""), m.get("page", ""), t) for t, m in zip(texts, metadatas)]
+        
+        self.index.add(
+            list(ids),
+            self._embed(texts),
+            [{**metadata, self.text_key: text} for text, metadata in zip(texts, metadatas)]
+        )
+        return list(ids)
+    
+    def delete(self, ids=None, **kwargs):
+        self.index.delete(ids=ids)
+        return True
+    
+    def _to_document(self, row):
+        metadata = dict(self.index.metadata[row])
+        text = metadata.pop(self.text_key, "")
+        return Document(page_content=text, metadata=metadata, id=self.index.ids[row])
+    
+    def get_by_ids(self, ids, /):
+        rows = [self.index.rows.get(chunk_id) for chunk_id in ids]
+        return [self._to_document(row) for row in rows if row is not None]
+    
+    def similarity_search_with_score_by_vector(self, embedding, k=4, filter=None, **kwargs):
+        return [(self._to_document(row), score) for row, score in self.index.search(embedding, k, filter=filter)]
+    
+    def similarity_search_by_vector(self, embedding, k=4, **kwargs):
+        return [doc for doc, _ in self.similarity_search_with_score_by_vector(embedding, k, **kwargs)]
+    
+    def similarity_search_with_score(self, query, k=4, **kwargs):
+        return self.similarity_search_with_score_by_vector(self._embedding.embed_query(query), k, **kwargs)
+    
+    def similarity_search(self, query, k=4, **kwargs):
+        return [doc for doc, _ in self.similarity_search_with_score(query, k, **kwargs)]
+    
+    def _select_relevance_score_fn(self):
+        # Map cosine similarity in [-1, 1] to a relevance score in [0, 1]
+        return lambda score: (score + 1) / 2
+    
+    @classmethod
+    def from_texts(cls, texts, embedding, metadatas=None, ids=None, index=None, **kwargs):
+        store = cls(index, embedding)
+        store.add_texts(texts, metadatas=metadatas, ids=ids)
+        return store
+
+if __name__ == "__main__":
+    import argparse
+    import tempfile
+    
+    from src.utils import get_cache_path
+    
+    parser = argparse.ArgumentParser(description="Compare recall@k and memory of the local index quantizations")
+    parser.add_argument("--index", default="fintutor", help="saved local index to evaluate")
+    parser.add_argument("--queries", type=int, default=200, help="stored vectors (plus noise) used as queries")
+    parser.add_argument("--k", type=int, default=3)
+    parser.add_argument("--pq-subspaces", type=int, default=48)
+    parser.add_argument("--min-recall", type=float, default=0.95, help="warn when a quantization's recall is lower")
+    args = parser.parse_args()
+    
+    source = LocalIndex.load(get_cache_path("indexes", args.index))
+    rng = np.random.default_rng(0)
+    rows = rng.choice(len(source.ids), min(args.queries, len(source.ids)), replace=False)
+    queries = source.vectors[rows] + rng.normal(0, 0.05, (len(rows), source.dimension)).astype(np.float32)
+    
+    for quantization in QUANTIZATIONS:
+        workdir = tempfile.mkdtemp()
+        try:
+            index = LocalIndex(workdir, source.dimension, quantization=quantization, pq_subspaces=args.pq_subspaces)
+            index.add(list(source.ids), np.asarray(source.vectors), list(source.metadata))
+            index.save()
+            usage = index.memory_usage()
+            recall = evaluate_recall(index, queries, args.k)
+            print(f"{quantization:>5}: recall@{args.k}={recall:.3f} "
+                  f"in_memory={usage['in_memory'] / 2**20:.1f} MiB on_disk={usage['on_disk'] / 2**20:.1f} MiB")
+            if recall < args.min_recall:
+                print(f"⚠️ {quantization} recall@{args.k} is below {args.min_recall}; raise rescore, nprobe "
+                      f"or pq_subspaces before serving it")
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
@@ -0,0 +1,115 @@
+import hashlib
+import json
+import os
+import time
+
+from src.utils import get_cache_path
+
+MANIFEST_VERSION = 1
+
+def hash_file(file_path, block_size=1 << 20):
+    """Return the SHA-256 hex digest of a file's contents"""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def chunk_id(source, page, text):
+    """Stable vector ID derived from a chunk's source, page and content"""
+    key = f"{os.path.normpath(source)}\x00{page}\x00{text}"
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+def assign_chunk_ids(chunks):
+    """Compute stable IDs for chunks, disambiguating identical chunks within a file"""
+    ids = []
+    seen = {}
+    for chunk in chunks:
+        base = chunk_id(
+            chunk.metadata.get("source", ""),
+            chunk.metadata.get("page", ""),
+            chunk.page_content
+        )
+        count = seen.get(base, 0)
+        seen[base] = count + 1
+        ids.append(base if count == 0 else f"{base}-{count}")
+    return ids
+
+def new_manifest(index_name):
+    """Return an empty manifest for an index"""
+    return {"version": MANIFEST_VERSION, "index_name": index_name, "files": {}}
+
+def load_manifest(manifest_path, index_name):
+    """Load the ingestion manifest, starting fresh if it is missing or for another index"""
+    if not os.path.exists(manifest_path):
+        return new_manifest(index_name)
+
+    try:
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"Ignoring unreadable manifest '{manifest_path}': {e}")
+        return new_manifest(index_name)
+
+    if manifest.get("version") != MANIFEST_VERSION or manifest.get("index_name") != index_name:
+        return new_manifest(index_name)
+    return manifest
+
+def save_manifest(manifest, manifest_path):
+    """Atomically write the ingestion manifest"""
+    tmp_path = f"{manifest_path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, manifest_path)
+
+def file_fingerprint(file_path, previous=None):
+    """Return (size, mtime_ns, sha256) for a file, reusing the old hash if size and mtime match"""
+    stat = os.stat(file_path)
+    if previous and previous.get("size") == stat.st_size and previous.get("mtime_ns") == stat.st_mtime_ns:
+        return stat.st_size, stat.st_mtime_ns, previous["hash"]
+    return stat.st_size, stat.st_mtime_ns, hash_file(file_path)
+
+def plan_ingestion(manifest, pdf_files):
+    """Split PDF files into changed (new or modified) and removed relative to the manifest"""
+    files = manifest["files"]
+    changed = []
+    current = set()
+
+    for file_path in pdf_files:
+        key = os.path.normpath(file_path)
+        current.add(key)
+        previous = files.get(key)
+        size, mtime_ns, digest = file_fingerprint(file_path, previous)
+        if previous and previous.get("hash") == digest:
+            # Content unchanged; only refresh the stat fingerprint
+            previous["size"], previous["mtime_ns"] = size, mtime_ns
+            continue
+        changed.append({"path": key, "hash": digest, "size": size, "mtime_ns": mtime_ns})
+
+    removed = sorted(set(files) - current)
+    return changed, removed
+
+def save_index_version(index_name):
+    """Record that an index changed, invalidating caches keyed on its version"""
+    version = hashlib.sha1(f"{index_name}\x00{time.time_ns()}".encode("utf-8")).hexdigest()[:16]
+    version_path = get_cache_path(f"{index_name}_version")
+    with open(f"{version_path}.tmp", "w", encoding="utf-8") as f:
+        f.write(version)
+    os.replace(f"{version_path}.tmp", version_path)
+    return version
+
+def load_index_version(index_name):
+    """Return the current version of an index, or "0" if it was never ingested here"""
+    try:
+        with open(get_cache_path(f"{index_name}_version"), "r", encoding="utf-8") as f:
+            return f.read().strip()
+    except OSError:
+        return "0"
+
+def list_courses(manifest):
+    """Map each ingested course to the sorted modules it contains"""
+    courses = {}
+    for entry in manifest["files"].values():
+        if entry.get("course"):
+            courses.setdefault(entry["course"], set()).add(entry.get("module"))
+    return {course: sorted(filter(None, modules)) for course, modules in sorted(courses.items())}
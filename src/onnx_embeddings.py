@@ -0,0 +1,215 @@
+import argparse
+import inspect
+import json
+import os
+import time
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from src.embeddings import MODEL_NAME
+
+DEFAULT_MODEL_DIR = os.path.join("model", "minilm-onnx")
+CONFIG_FILE = "fintutor_onnx.json"
+
+class OnnxEmbeddingEngine(Embeddings):
+    """all-MiniLM-L6-v2 run through ONNX Runtime instead of PyTorch.
+    
+    Loads a model exported by `export_onnx` (optionally int8-quantized) and
+    reproduces the sentence-transformers pipeline: tokenize, run the
+    transformer, mean-pool over the attention mask and L2-normalize. The
+    vectors live in the same 384-dim cosine space as the torch engine, so
+    an existing index keeps working. Neither torch nor sentence-transformers
+    is imported.
+    """
+    
+    def __init__(self, model_dir=DEFAULT_MODEL_DIR, model_file="model_int8.onnx", batch_size=64,
+                 num_threads=None, normalize=False):
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+        
+        with open(os.path.join(model_dir, CONFIG_FILE), encoding="utf-8") as f:
+            config = json.load(f)
+        
+        self.model_name = config["model_name"]
+        self.model_id = f"{self.model_name}[onnx:{model_file}]"
+        self.batch_size = batch_size
+        self.normalize = normalize
+        self.dimension = config["dimension"]
+        
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_dir, "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length=config["max_seq_length"])
+        self.tokenizer.enable_padding(pad_id=config.get("pad_token_id", 0))
+        
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        self.session = ort.InferenceSession(
+            os.path.join(model_dir, model_file), options, providers=["CPUExecutionProvider"]
+        )
+        self.input_names = {item.name for item in self.session.get_inputs()}
+    
+    def _encode_batch(self, texts):
+        encodings = self.tokenizer.encode_batch(texts)
+        mask = np.array([e.attention_mask for e in encodings], dtype=np.int64)
+        feeds = {"input_ids": np.array([e.ids for e in encodings], dtype=np.int64), "attention_mask": mask}
+        if "token_type_ids" in self.input_names:
+            feeds["token_type_ids"] = np.array([e.type_ids for e in encodings], dtype=np.int64)
+        
+        hidden = self.session.run(None, feeds)[0]
+        weights = mask[:, :, None].astype(np.float32)
+        pooled = (hidden * weights).sum(axis=1) / np.maximum(weights.sum(axis=1), 1e-9)
+        return pooled / np.maximum(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12)
+    
+    def encode(self, texts):
+        """Embed texts into an (n, dimension) float32 array"""
+        texts = list(texts)
+        if not texts:
+            return np.empty((0, self.dimension), dtype=np.float32)
+        
+        # Longest first, so batches pad to similar lengths, as in EmbeddingEngine
+        order = np.argsort([-len(text) for text in texts], kind="stable")
+        result = np.empty((len(texts), self.dimension), dtype=np.float32)
+        for start in range(0, len(texts), self.batch_size):
+            batch = order[start:start + self.batch_size]
+            result[batch] = self._encode_batch([texts[i] for i in batch])
+        return result
+    
+    def embed_documents(self, texts):
+        return self.encode(texts).tolist()
+    
+    def embed_query(self, text):
+        return self.encode([text])[0].tolist()
+    
+    def close(self):
+        pass
+
+def export_onnx(output_dir=DEFAULT_MODEL_DIR, model_name=MODEL_NAME, quantize=True, max_seq_length=256, opset=17):
+    """Export the transformer to ONNX, plus a dynamically int8-quantized copy.
+    
+    Needs torch and transformers at export time only; the quantized model
+    uses int8 weights with float activations, which suits CPUs with VNNI or
+    AVX2 and keeps embeddings close to the float model.
+    """
+    import torch
+    from transformers import AutoModel, AutoTokenizer
+    
+    os.makedirs(output_dir, exist_ok=True)
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    model = AutoModel.from_pretrained(model_name).eval()
+    tokenizer.save_pretrained(output_dir)
+    
+    class Encoder(torch.nn.Module):
+        # Inputs go by keyword, since forward()'s positional order varies across transformers versions
+        def __init__(self):
+            super().__init__()
+            self.model = model
+        
+        def forward(self, input_ids, attention_mask, token_type_ids):
+            return self.model(input_ids=input_ids, attention_mask=attention_mask,
+                              token_type_ids=token_type_ids).last_hidden_state
+    
+    names = ["input_ids", "attention_mask", "token_type_ids"]
+    sample = tokenizer(["A bond pays periodic coupons."], return_tensors="pt")
+    path = os.path.join(output_dir, "model.onnx")
+    # torch 2.9+ defaults to the dynamo exporter, which needs onnxscript and ignores dynamic_axes
+    options = {"dynamo": False} if "dynamo" in inspect.signature(torch.onnx.export).parameters else {}
+    with torch.no_grad():
+        torch.onnx.export(
+            Encoder(),
+            tuple(sample[name] for name in names),
+            path,
+            input_names=names,
+            output_names=["last_hidden_state"],
+            dynamic_axes={name: {0: "batch", 1: "sequence"} for name in names + ["last_hidden_state"]},
+            opset_version=opset,
+            **options
+        )
+    print(f"Exported {model_name} to {path}")
+    
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        quantized = os.path.join(output_dir, "model_int8.onnx")
+        quantize_dynamic(path, quantized, weight_type=QuantType.QInt8)
+        print(f"Quantized model written to {quantized}")
+    
+    with open(os.path.join(output_dir, CONFIG_FILE), "w", encoding="utf-8") as f:
+        json.dump({
+            "model_name": model_name,
+            "dimension": model.config.hidden_size,
+            "max_seq_length": max_seq_length,
+            "pad_token_id": tokenizer.pad_token_id or 0,
+        }, f, indent=2)
+    return output_dir
+
+def recall_at_k(reference, candidate, k):
+    """Mean overlap of the top-k results of two (queries, docs) score matrices"""
+    top_reference = np.argsort(-reference, axis=1)[:, :k]
+    top_candidate = np.argsort(-candidate, axis=1)[:, :k]
+    return float(np.mean([len(set(a) & set(b)) / k for a, b in zip(top_reference, top_candidate)]))
+
+def compare_backends(reference, candidate, texts, queries, k=5):
+    """Accuracy and throughput of a candidate embedder against the torch reference.
+    
+    `recall@k` compares rankings when both queries and documents use the
+    candidate; `cross_recall@k` searches reference document vectors with
+    candidate queries, the case of querying an index built with torch.
+    """
+    results = {"texts": len(texts), "queries": len(queries), "k": k}
+    vectors = {}
+    for name, engine in (("reference", reference), ("candidate", candidate)):
+        engine.encode(texts[:16])  # warm up
+        started = time.perf_counter()
+        docs = engine.encode(texts)
+        results[f"{name}_texts_per_sec"] = len(texts) / (time.perf_counter() - started)
+        
+        started = time.perf_counter()
+        for query in queries:
+            engine.encode([query])
+        results[f"{name}_query_ms"] = (time.perf_counter() - started) / len(queries) * 1000
+        vectors[name] = (docs, engine.encode(queries))
+    
+    (ref_docs, ref_queries), (cand_docs, cand_queries) = vectors["reference"], vectors["candidate"]
+    ref_docs, cand_docs = _unit(ref_docs), _unit(cand_docs)
+    ref_queries, cand_queries = _unit(ref_queries), _unit(cand_queries)
+    
+    results["speedup"] = results["candidate_texts_per_sec"] / results["reference_texts_per_sec"]
+    results["mean_cosine"] = float(np.mean(np.sum(ref_docs * cand_docs, axis=1)))
+    results[f"recall@{k}"] = recall_at_k(ref_queries @ ref_docs.T, cand_queries @ cand_docs.T, k)
+    results[f"cross_recall@{k}"] = recall_at_k(ref_queries @ ref_docs.T, cand_queries @ ref_docs.T, k)
+    return results
+
+def _unit(vectors):
+    return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export and evaluate the ONNX embedding backend")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    
+    export_parser = subparsers.add_parser("export", help="export all-MiniLM-L6-v2 to ONNX")
+    export_parser.add_argument("--output", default=DEFAULT_MODEL_DIR)
+    export_parser.add_argument("--model", default=MODEL_NAME, help="model name or local sentence-transformers directory")
+    export_parser.add_argument("--no-quantize", action="store_true", help="skip the int8 model")
+    
+    compare_parser = subparsers.add_parser("compare", help="compare recall@k and throughput with torch")
+    compare_parser.add_argument("--model-dir", default=DEFAULT_MODEL_DIR)
+    compare_parser.add_argument("--model-file", default="model_int8.onnx")
+    compare_parser.add_argument("--data", default="Data", help="PDF folder providing the documents")
+    compare_parser.add_argument("--k", type=int, default=5)
+    compare_parser.add_argument("--threads", type=int, default=None)
+    args = parser.parse_args()
+    
+    if args.command == "export":
+        export_onnx(args.output, model_name=args.model, quantize=not args.no_quantize)
+    else:
+        from src.benchmark import QUERIES
+        from src.embeddings import EmbeddingEngine
+        from src.loaders import load_pdf_file
+        from src.splitters import split_documents
+        
+        texts = [chunk.page_content for chunk in split_documents(load_pdf_file(args.data))]
+        candidate = OnnxEmbeddingEngine(args.model_dir, args.model_file, num_threads=args.threads)
+        # Built directly rather than through get_embeddings, which follows EMBEDDING_BACKEND
+        reference = EmbeddingEngine(candidate.model_name, num_threads=args.threads)
+        print(json.dumps(compare_backends(reference, candidate, texts, QUERIES, k=args.k), indent=2))
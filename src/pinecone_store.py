@@ -0,0 +1,93 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from langchain_core.documents import Document
+from langchain_pinecone import PineconeVectorStore
+
+from src.filters import normalize_filter, to_pinecone_filter
+
+class CourseVectorStore(PineconeVectorStore):
+    """Pinecone vector store with one namespace per course.
+    
+    Chunks are written to the namespace named by their "course" metadata.
+    A search filtered to one course queries only that namespace, with the
+    rest of the filter (module, source) sent as a Pinecone metadata filter.
+    Unfiltered and multi-course searches query each namespace concurrently
+    and merge the matches by score. With `namespaced=False` everything
+    stays in the default namespace and the whole filter goes to Pinecone.
+    """
+    
+    def __init__(self, *args, namespaced=True, namespace_ttl=60, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.namespaced = namespaced
+        self.namespace_ttl = namespace_ttl
+        self._namespaces = ([], 0.0)
+    
+    def namespaces(self):
+        """Namespaces in the index, refreshed every `namespace_ttl` seconds"""
+        names, fetched = self._namespaces
+        if time.monotonic() - fetched > self.namespace_ttl:
+            stats = self.index.describe_index_stats()
+            names = sorted((stats.get("namespaces") or {}).keys())
+            self._namespaces = (names, time.monotonic())
+        return names
+    
+    def add_texts(self, texts, metadatas=None, ids=None, namespace=None, **kwargs):
+        if namespace is not None or not self.namespaced:
+            return super().add_texts(texts, metadatas, ids, namespace=namespace, **kwargs)
+        
+        texts = list(texts)
+        metadatas = metadatas or [{} for _ in texts]
+        ids = ids or [None] * len(texts)
+        groups = {}
+        for text, metadata, chunk_id in zip(texts, metadatas, ids):
+            groups.setdefault(metadata.get("course", ""), []).append((text, metadata, chunk_id))
+        
+        added = []
+        for course, group in groups.items():
+            group_texts, group_metadatas, group_ids = zip(*group)
+            group_ids = list(group_ids) if all(group_ids) else None
+            added.extend(super().add_texts(
+                list(group_texts), list(group_metadatas), group_ids, namespace=course, **kwargs
+            ))
+        return added
+    
+    def get_by_ids(self, ids, /):
+        """Chunks by ID, fetched from every course namespace concurrently"""
+        ids = list(ids)
+        namespaces = self.namespaces() if self.namespaced else [self._namespace or ""]
+        if not ids or not namespaces:
+            return []
+        
+        def fetch(namespace):
+            return list(self.index.fetch(ids=ids, namespace=namespace).vectors.values())
+        
+        with ThreadPoolExecutor(max_workers=min(8, len(namespaces))) as pool:
+            vectors = [vector for part in pool.map(fetch, namespaces) for vector in part]
+        docs = []
+        for vector in vectors:
+            metadata = dict(vector.metadata or {})
+            text = metadata.pop(self._text_key, "")
+            docs.append(Document(page_content=text, metadata=metadata, id=vector.id))
+        return docs
+    
+    def similarity_search_by_vector_with_score(self, embedding, *, k=4, filter=None, namespace=None, **kwargs):
+        if namespace is not None or not self.namespaced:
+            return super().similarity_search_by_vector_with_score(
+                embedding, k=k, filter=to_pinecone_filter(filter), namespace=namespace, **kwargs
+            )
+        
+        filter = normalize_filter(filter)
+        courses = list(filter.pop("course", ())) or self.namespaces()
+        pinecone_filter = to_pinecone_filter(filter)
+        
+        def search(course):
+            return super(CourseVectorStore, self).similarity_search_by_vector_with_score(
+                embedding, k=k, filter=pinecone_filter, namespace=course, **kwargs
+            )
+        
+        if len(courses) <= 1:
+            return search(courses[0]) if courses else []
+        with ThreadPoolExecutor(max_workers=min(8, len(courses))) as pool:
+            matches = [match for part in pool.map(search, courses) for match in part]
+        return sorted(matches, key=lambda match: -match[1])[:k]
@@ -0,0 +1,172 @@
+import contextvars
+import queue
+import threading
+import time
+
+_DONE = object()
+
+class StageStats:
+    """Counters for one pipeline stage"""
+    
+    def __init__(self, name, workers):
+        self.name = name
+        self.workers = workers
+        self.items = 0
+        self.wait_seconds = 0.0
+        self.started = None
+        self.finished = None
+        self.max_queue_depth = 0
+        self.queue_depth_total = 0
+        self.queue_depth_samples = 0
+        self.lock = threading.Lock()
+    
+    def elapsed(self):
+        if self.started is None:
+            return 0.0
+        return (self.finished or time.monotonic()) - self.started
+    
+    def throughput(self):
+        """Items emitted per second of wall time"""
+        elapsed = self.elapsed()
+        return self.items / elapsed if elapsed else 0.0
+    
+    def utilization(self):
+        """Fraction of worker time not spent blocked on neighbouring queues"""
+        total = self.elapsed() * self.workers
+        return max(0.0, 1 - self.wait_seconds / total) if total else 0.0
+    
+    def summary(self):
+        mean_depth = self.queue_depth_total / self.queue_depth_samples if self.queue_depth_samples else 0.0
+        return (f"{self.name}: {self.items} items, {self.throughput():.1f} items/s, "
+                f"busy {self.utilization():.0%}, output queue mean {mean_depth:.1f} / max {self.max_queue_depth}")
+
+class Pipeline:
+    """Run generator stages in threads connected by bounded queues.
+    
+    Each stage is a function that takes an iterable of inputs (None for the
+    first stage) and yields outputs, so stages can batch, flatten or filter
+    freely. Bounded queues give backpressure: a fast stage blocks once the
+    next one falls `queue_size` items behind, keeping memory flat.
+    """
+    
+    def __init__(self, queue_size=8, report_interval=10.0):
+        self.queue_size = queue_size
+        self.report_interval = report_interval
+        self.stages = []
+        self.stats = []
+        self.stop = threading.Event()
+        self.error = None
+    
+    def add_stage(self, name, func, workers=1):
+        self.stages.append((func, workers))
+        self.stats.append(StageStats(name, workers))
+        return self
+    
+    def _get(self, in_queue, stats):
+        """Iterate over a queue until the upstream stage signals completion"""
+        while not self.stop.is_set():
+            start = time.monotonic()
+            try:
+                item = in_queue.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            finally:
+                with stats.lock:
+                    stats.wait_seconds += time.monotonic() - start
+            if item is _DONE:
+                # Let sibling workers of this stage see the sentinel too
+                self._put(in_queue, _DONE, stats)
+                return
+            yield item
+    
+    def _put(self, out_queue, item, stats):
+        """Put an item on a bounded queue, giving up once the pipeline has stopped"""
+        start = time.monotonic()
+        while not self.stop.is_set():
+            try:
+                out_queue.put(item, timeout=0.1)
+                break
+            except queue.Full:
+                continue
+        with stats.lock:
+            stats.wait_seconds += time.monotonic() - start
+    
+    def _run_worker(self, index, in_queue, out_queue, remaining):
+        func, _ = self.stages[index]
+        stats = self.stats[index]
+        try:
+            inputs = None if in_queue is None else self._get(in_queue, stats)
+            outputs = func(inputs)
+            try:
+                for item in outputs:
+                    if self.stop.is_set():
+                        return
+                    with stats.lock:
+                        stats.items += 1
+                    if out_queue is not None:
+                        self._put(out_queue, item, stats)
+            finally:
+                # Release generator resources (e.g. worker pools) promptly on stop
+                if hasattr(outputs, "close"):
+                    outputs.close()
+        except BaseException as e:
+            if self.error is None:
+                self.error = e
+            self.stop.set()
+        finally:
+            with stats.lock:
+                remaining[index] -= 1
+                last = remaining[index] == 0
+            if last:
+                stats.finished = time.monotonic()
+                if out_queue is not None:
+                    # A stopped downstream stage may never drain a full queue
+                    self._put(out_queue, _DONE, stats)
+    
+    def _sample(self, queues):
+        for stats, out_queue in zip(self.stats, queues[1:]):
+            if out_queue is None:
+                continue
+            depth = out_queue.qsize()
+            stats.max_queue_depth = max(stats.max_queue_depth, depth)
+            stats.queue_depth_total += depth
+            stats.queue_depth_samples += 1
+    
+    def report(self):
+        for stats in self.stats:
+            print(f"  {stats.summary()}")
+    
+    def run(self):
+        """Run all stages to completion, re-raising the first stage error"""
+        if not self.stages:
+            return self.stats
+        
+        # queues[i] feeds stage i; the last stage's output is discarded
+        queues = [None] + [queue.Queue(self.queue_size) for _ in self.stages[1:]] + [None]
+        remaining = [workers for _, workers in self.stages]
+        threads = []
+        
+        for index, (_, workers) in enumerate(self.stages):
+            self.stats[index].started = time.monotonic()
+            for _ in range(workers):
+                # Workers inherit the caller's context, e.g. the current telemetry trace
+                thread = threading.Thread(
+                    target=contextvars.copy_context().run,
+                    args=(self._run_worker, index, queues[index], queues[index + 1], remaining),
+                    daemon=True
+                )
+                thread.start()
+                threads.append(thread)
+        
+        last_report = time.monotonic()
+        while any(thread.is_alive() for thread in threads):
+            threads[-1].join(timeout=0.1)
+            self._sample(queues)
+            if self.report_interval and time.monotonic() - last_report >= self.report_interval:
+                last_report = time.monotonic()
+                print("⏱️ Pipeline progress:")
+                self.report()
+        
+        if self.error is not None:
+            raise self.error
+        return self.stats
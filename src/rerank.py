@@ -0,0 +1,107 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import Any
+
+from langchain_core.retrievers import BaseRetriever
+
+from src import telemetry
+
+RERANK_MODEL = "cross-encoder/ms-marco-MiniLM-L-6-v2"
+
+class CrossEncoderReranker:
+    """Re-rank retrieved chunks with a small local cross-encoder on CPU.
+    
+    All (query, chunk) pairs are scored in a single predict call. Scoring
+    runs on a worker thread so that a call exceeding `budget` seconds can be
+    abandoned: the caller then gets the candidates in their original order.
+    An abandoned call still holds its worker until it finishes, so while
+    every worker is busy, requests fall back at once instead of queueing.
+    """
+    
+    def __init__(self, model_name=RERANK_MODEL, budget=0.3, max_length=256, device="cpu", workers=2):
+        from sentence_transformers import CrossEncoder
+        
+        self.model_name = model_name
+        self.budget = budget
+        self.model = CrossEncoder(model_name, device=device, max_length=max_length)
+        # The first predict is much slower (lazy init), so it is paid here rather than by a request
+        self.model.predict([("warm up", "warm up")], show_progress_bar=False)
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="rerank")
+        self.workers = workers
+        self.busy = 0
+        self.reranked = 0
+        self.fallbacks = 0
+        self.last_seconds = 0.0
+        self._lock = threading.Lock()
+    
+    def score(self, query, docs):
+        pairs = [(query, doc.page_content) for doc in docs]
+        return self.model.predict(pairs, batch_size=len(pairs), show_progress_bar=False)
+    
+    def rerank(self, query, docs, k=3):
+        """Return the top `k` docs by cross-encoder score, or the first `k` if over budget"""
+        if len(docs) <= 1:
+            return docs[:k]
+        
+        with telemetry.span("rerank", candidates=len(docs)):
+            return self._rerank(query, docs, k)
+    
+    def _score(self, query, docs):
+        try:
+            return self.score(query, docs)
+        finally:
+            with self._lock:
+                self.busy -= 1
+    
+    def _fall_back(self, docs, k, started):
+        telemetry.incr("fintutor_rerank_fallbacks_total")
+        with self._lock:
+            self.fallbacks += 1
+            self.last_seconds = time.perf_counter() - started
+        return docs[:k]
+    
+    def _rerank(self, query, docs, k):
+        started = time.perf_counter()
+        with self._lock:
+            saturated = self.busy >= self.workers
+            if not saturated:
+                self.busy += 1
+        if saturated:
+            return self._fall_back(docs, k, started)
+        
+        future = self.executor.submit(self._score, query, docs)
+        try:
+            scores = future.result(timeout=self.budget)
+        except FutureTimeoutError:
+            return self._fall_back(docs, k, started)
+        
+        order = sorted(range(len(docs)), key=lambda i: -float(scores[i]))
+        with self._lock:
+            self.reranked += 1
+            self.last_seconds = time.perf_counter() - started
+        return [docs[i] for i in order[:k]]
+    
+    def stats(self):
+        with self._lock:
+            total = self.reranked + self.fallbacks
+            return {
+                "reranked": self.reranked,
+                "fallbacks": self.fallbacks,
+                "fallback_rate": self.fallbacks / total if total else 0.0,
+                "busy_workers": self.busy,
+                "last_seconds": self.last_seconds,
+            }
+    
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+class RerankingRetriever(BaseRetriever):
+    """Over-fetch candidates from a retriever and keep the `k` best after re-ranking"""
+    
+    base_retriever: Any
+    reranker: Any
+    k: int = 3
+    
+    def _get_relevant_documents(self, query, *, run_manager=None):
+        return self.reranker.rerank(query, self.base_retriever.invoke(query), self.k)
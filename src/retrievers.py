@@ -0,0 +1,53 @@
+import hashlib
+from typing import Any, Optional
+
+import numpy as np
+from langchain_core.retrievers import BaseRetriever
+
+from src import telemetry
+from src.filters import filter_key
+
+class CachedRetriever(BaseRetriever):
+    """Vector store retriever that caches results keyed by the query embedding.
+    
+    Questions that embed identically share one vector search. Keys include
+    the index version, so results are invalidated when the index is re-ingested,
+    and the metadata `filter` the search is restricted to.
+    """
+    
+    vector_store: Any
+    cache: Any
+    index_name: str = "fintutor"
+    search_kwargs: dict = {"k": 3}
+    filter: Optional[dict] = None
+    
+    def embed_query(self, query):
+        """Embed a query as a float32 vector using the vector store's embedder"""
+        embeddings = self.vector_store.embeddings
+        with telemetry.span("embed_query"):
+            if hasattr(embeddings, "encode"):
+                return embeddings.encode([query])[0]
+            return np.asarray(embeddings.embed_query(query), dtype=np.float32)
+    
+    def retrieve_by_vector(self, vector):
+        from src.manifest import load_index_version
+        
+        k = self.search_kwargs.get("k", 3)
+        key = hashlib.sha1(
+            f"{load_index_version(self.index_name)}\x00{k}\x00{filter_key(self.filter)}\x00".encode("utf-8")
+            + np.asarray(vector, dtype=np.float16).tobytes()
+        ).hexdigest()
+        
+        docs = self.cache.get(key)
+        if docs is None:
+            telemetry.incr("fintutor_cache_misses_total", cache="retrieval")
+            with telemetry.span("vector_search", k=k):
+                kwargs = {"filter": self.filter} if filter_key(self.filter) else {}
+                docs = self.vector_store.similarity_search_by_vector([float(x) for x in vector], k=k, **kwargs)
+            self.cache.set(key, docs)
+        else:
+            telemetry.incr("fintutor_cache_hits_total", cache="retrieval")
+        return docs
+    
+    def _get_relevant_documents(self, query, *, run_manager=None):
+        return self.retrieve_by_vector(self.embed_query(query))
@@ -0,0 +1,139 @@
+import os
+import re
+import time
+
+from src.cache import TTLCache, normalize_question
+
+REWRITE_MODES = ("off", "heuristic", "llm")
+
+CONDENSE_PROMPT = (
+    "Rewrite the student's follow-up question as one standalone search query "
+    "for a finance textbook, using the conversation to resolve what it refers to. "
+    "Reply with the query only."
+    "\n\n"
+    "Conversation:\n{conversation}\n\n"
+    "Follow-up question: {question}"
+)
+
+_WORD_RE = re.compile(r"[a-z0-9']+")
+_FOLLOW_UP_START_RE = re.compile(r"^(and|also|what about|how about|same|why not)\b")
+# Openers that also start standalone questions ("why do bonds pay coupons?"), so they only
+# mark a follow-up with no verb of its own ("but for puts?", "or calls?")
+_WEAK_START_RE = re.compile(r"^(but|so|then|or|why)\b")
+_VERBS = {"is", "are", "was", "were", "do", "does", "did", "can", "could", "would", "should", "will"}
+_FOLLOW_UP_END_RE = re.compile(r"\b(too|instead|as well|then|in that case)\W*$")
+
+# Words that point back to an earlier turn
+_REFERENCES = {
+    "it", "its", "that", "this", "these", "those", "they", "them", "their",
+    "one", "ones", "former", "latter", "same", "above", "there", "such",
+}
+
+# Question scaffolding; a question with no other words has no topic of its own
+_FILLER = {
+    "a", "an", "the", "is", "are", "was", "were", "be", "do", "does", "did", "can", "could",
+    "would", "should", "will", "what", "why", "how", "when", "where", "which", "who", "of",
+    "to", "in", "on", "for", "with", "about", "and", "or", "but", "so", "me", "i", "you",
+    "we", "us", "my", "your", "please", "explain", "tell", "give", "show", "more", "example",
+    "examples", "mean", "means", "detail", "details", "elaborate", "again", "other", "else",
+    "also", "then", "too", "instead", "not", "there", "any", "some", "like",
+}
+
+def get_rewrite_mode(mode=None):
+    """Return the configured query rewrite mode ("off", "heuristic" or "llm")"""
+    mode = (mode or os.getenv("QUERY_REWRITE", "heuristic")).lower()
+    if mode not in REWRITE_MODES:
+        raise ValueError(f"Unknown query rewrite mode '{mode}', expected one of {REWRITE_MODES}")
+    return mode
+
+def is_follow_up(question):
+    """Whether a question leans on earlier turns ("and for puts?", "why is that?", "an example?")"""
+    text = question.strip().lower()
+    words = _WORD_RE.findall(text)
+    topic = [word for word in words if word not in _FILLER and word not in _REFERENCES]
+    if not topic or _FOLLOW_UP_END_RE.search(text):
+        return True
+    # A long question naming its own topic is standalone even if it opens with "and" or says "it"
+    if len(topic) >= 3:
+        return False
+    if _FOLLOW_UP_START_RE.match(text) or any(word in _REFERENCES for word in words):
+        return True
+    return bool(_WEAK_START_RE.match(text)) and not any(word in _VERBS for word in words)
+
+class QueryRewriter:
+    """Turn a follow-up question into a standalone query for retrieval and the answer prompt.
+    
+    Standalone questions pass through unchanged, at the cost of a regex. A
+    follow-up is joined with up to `depth` questions it builds on; in
+    "llm" mode it is instead condensed by one short LLM call, falling back
+    to the join if the call fails or times out. Rewrites are memoized, so
+    one rewriter should be kept per conversation.
+    """
+    
+    def __init__(self, llm=None, mode=None, cache_size=256, answer_chars=300, depth=2):
+        self.mode = get_rewrite_mode(mode)
+        self.llm = llm if self.mode == "llm" else None
+        self.answer_chars = answer_chars
+        self.depth = depth
+        self.cache = TTLCache(max_entries=cache_size, ttl=24 * 3600)
+        self.last = None  # (question, questions it builds on) of the latest turn
+        self.llm_calls = 0
+        self.last_ms = 0.0
+    
+    def previous_turn(self, turns):
+        """The questions the last turn builds on and its answer, or None"""
+        question = answer = None
+        for role, content in reversed(list(turns)):
+            if role == "assistant" and question is None and answer is None:
+                answer = content
+            elif role == "user":
+                question = content
+                break
+        if question is None:
+            return None
+        if self.last is not None and self.last[0] == question:
+            return self.last[1], answer or ""
+        return [question], answer or ""
+    
+    def condense(self, question, previous, answer):
+        """One LLM call rewriting the follow-up, or None on failure"""
+        conversation = f"Student: {' '.join(previous)}\nTutor: {answer[:self.answer_chars]}"
+        try:
+            self.llm_calls += 1
+            reply = self.llm.invoke(CONDENSE_PROMPT.format(conversation=conversation, question=question))
+            lines = reply.content.strip().splitlines()
+            query = lines[0].strip().strip('"') if lines else ""
+            return query or None
+        except Exception as e:
+            print(f"Query rewrite failed, falling back to the heuristic: {e}")
+            return None
+    
+    def rewrite(self, question, turns=()):
+        """Standalone form of `question` given the earlier (role, content) turns"""
+        started = time.perf_counter()
+        query, context = question, [question]
+        previous = self.previous_turn(turns) if self.mode != "off" else None
+        
+        if previous is not None and is_follow_up(question):
+            key = (normalize_question(" ".join(previous[0])), normalize_question(question))
+            cached = self.cache.get(key)
+            if cached is None:
+                query = self.condense(question, *previous) if self.llm is not None else None
+                if query is not None:
+                    context = [query]
+                else:
+                    # The first question holds the topic and is always kept
+                    query = f"{question} (following up on: {' '.join(previous[0])})"
+                    recent = (previous[0][1:] + [question])[-(self.depth - 1):] if self.depth > 1 else []
+                    context = previous[0][:1] + recent
+                cached = (query, context)
+                self.cache.set(key, cached)
+            query, context = cached
+        
+        self.last = (question, context)
+        self.last_ms = (time.perf_counter() - started) * 1000
+        return query
+    
+    def clear(self):
+        self.last = None
+        self.cache.clear()
@@ -1,19 +1,296 @@
-from langchain.text_splitter import RecursiveCharacterTextSplitter
+import multiprocessing
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
 
-def split_documents(docs, chunk_size=500, chunk_overlap=20):
-    """Split documents into smaller chunks for better retrieval"""
+from langchain_core.documents import Document
+
+from src.context import estimate_tokens
+from src.embeddings import MODEL_NAME
+
+SPLITTER_MODES = ("recursive", "structured")
+
+# Sentence ends are only taken before something that can start a sentence,
+# so "e.g. the" and "3.5 years" do not split
+_SENTENCE_END_RE = re.compile(r"(?<=[.!?])[\"')\]]*\s+(?=[\"'(\[]?[A-Z0-9])")
+_NUMBERED_HEADING_RE = re.compile(r"^(\d+(\.\d+)*\.?|[IVX]+\.|[A-Z]\.)\s+[A-Z]")
+_KEYWORD_HEADING_RE = re.compile(r"^(chapter|section|part|module|unit|lesson|appendix)\s+\w+", re.IGNORECASE)
+_COLUMN_GAP_RE = re.compile(r"\S( {2,}|\t)\S")
+_MATH_CHARS = set("0123456789=+-*/^%()[]<>≤≥±×÷√∑∏∫Δσμπλ")
+
+def get_splitter_mode(mode=None):
+    """Return the configured splitter mode ("recursive" or "structured")"""
+    mode = (mode or os.getenv("SPLITTER_MODE", "recursive")).lower()
+    if mode not in SPLITTER_MODES:
+        raise ValueError(f"Unknown splitter mode '{mode}', expected one of {SPLITTER_MODES}")
+    return mode
+
+def get_chunk_tokens():
+    """Chunk size and overlap in tokens for the structured splitter"""
+    return int(os.getenv("CHUNK_TOKENS", "200")), int(os.getenv("CHUNK_OVERLAP_TOKENS", "20"))
+
+def splitter_signature(mode=None, chunk_size=500, chunk_overlap=20):
+    """Identify the chunking settings, so a change can be detected between ingestion runs"""
+    if get_splitter_mode(mode) == "recursive":
+        return f"recursive:{chunk_size}:{chunk_overlap}"
+    chunk_tokens, overlap_tokens = get_chunk_tokens()
+    return f"structured:{chunk_tokens}:{overlap_tokens}:{os.getenv('EMBEDDING_MODEL', MODEL_NAME)}"
+
+@lru_cache(maxsize=None)
+def load_tokenizer(model_name=MODEL_NAME):
+    """The embedding model's fast tokenizer, or None to fall back to estimated lengths"""
+    try:
+        from tokenizers import Tokenizer
+        return Tokenizer.from_pretrained(model_name)
+    except Exception as e:
+        print(f"Tokenizer for '{model_name}' unavailable, estimating token counts: {e}")
+        return None
+
+class TokenCounter:
+    """Token lengths from the embedding model's tokenizer, batched and cached.
+    
+    Page headers, footers and unchanged text recur across pages and runs,
+    so counts are cached by text; misses are tokenized in one batch call.
+    """
+    
+    def __init__(self, model_name=MODEL_NAME, cache_size=200_000):
+        self.tokenizer = load_tokenizer(model_name)
+        self.cache_size = cache_size
+        self.cache = {}
+    
+    def count(self, texts):
+        """Token counts for a list of texts, excluding special tokens"""
+        missing = [text for text in dict.fromkeys(texts) if text not in self.cache]
+        if missing:
+            if self.tokenizer is not None:
+                encodings = self.tokenizer.encode_batch(missing, add_special_tokens=False)
+                counts = [len(encoding.ids) for encoding in encodings]
+            else:
+                counts = [estimate_tokens(text) for text in missing]
+            if len(self.cache) + len(missing) > self.cache_size:
+                self.cache.clear()
+            self.cache.update(zip(missing, counts))
+        return [self.cache[text] for text in texts]
+    
+    def windows(self, text, size):
+        """(start, end) character spans of consecutive pieces of at most `size` tokens"""
+        if self.tokenizer is not None:
+            offsets = self.tokenizer.encode(text, add_special_tokens=False).offsets
+            return [
+                (offsets[i][0], offsets[min(i + size, len(offsets)) - 1][1])
+                for i in range(0, len(offsets), size)
+            ]
+        
+        # Without a tokenizer, cut about four characters per token, at a space if there is one
+        spans, start, width = [], 0, size * 4
+        while start < len(text):
+            end = min(start + width, len(text))
+            if end < len(text):
+                end = text.rfind(" ", start + 1, end) + 1 or end
+            spans.append((start, end))
+            start = end
+        return spans
+
+def is_heading(line):
+    """Short title-like lines: numbered, "Chapter 3", ALL CAPS or Title Case"""
+    words = line.split()
+    if not words or len(line) > 80 or len(words) > 12 or line[-1] in ".,;:":
+        return False
+    if _NUMBERED_HEADING_RE.match(line) or _KEYWORD_HEADING_RE.match(line):
+        return True
+    letters = [c for c in line if c.isalpha()]
+    if len(letters) >= 4 and all(c.isupper() for c in letters):
+        return True
+    significant = [word for word in words if len(word) > 3]
+    return len(words) <= 8 and len(significant) >= 2 and all(word[0].isupper() for word in significant)
+
+def is_tabular(line):
+    """Table rows (column gaps) and formula lines (mostly digits and operators)"""
+    if len(_COLUMN_GAP_RE.findall(line)) >= 2:
+        return True
+    chars = [c for c in line if not c.isspace()]
+    return len(chars) >= 3 and sum(c in _MATH_CHARS for c in chars) / len(chars) >= 0.4
+
+def segment_text(text):
+    """Split page text into (kind, start, end) spans of headings, tables and sentences.
+    
+    Consecutive table and formula lines form one "table" span, which is
+    never cut at sentence boundaries. Prose paragraphs end at blank lines,
+    headings and tables, and are split into "sentence" spans.
+    """
+    segments = []
+    paragraph = None
+    
+    def flush_paragraph():
+        start, end = paragraph
+        position = start
+        for match in _SENTENCE_END_RE.finditer(text, start, end):
+            segments.append(("sentence", position, match.start()))
+            position = match.end()
+        segments.append(("sentence", position, end))
+    
+    for match in re.finditer(r"[^\n]+", text):
+        line = match.group()
+        stripped = line.strip()
+        start = match.start() + len(line) - len(line.lstrip())
+        end = match.start() + len(line.rstrip())
+        
+        if not stripped:
+            continue
+        if is_tabular(stripped):
+            kind = "table"
+        elif is_heading(stripped):
+            kind = "heading"
+        else:
+            kind = "prose"
+        
+        if paragraph is not None and (kind != "prose" or text.count("\n", paragraph[1], start) > 1):
+            flush_paragraph()
+            paragraph = None
+        
+        # A blank line before a table row starts a new table
+        continues_table = segments and segments[-1][0] == "table" and text.count("\n", segments[-1][2], start) < 2
+        if kind == "prose":
+            paragraph = (paragraph[0], end) if paragraph is not None else (start, end)
+        elif kind == "table" and continues_table:
+            segments[-1] = ("table", segments[-1][1], end)
+        else:
+            segments.append((kind, start, end))
+    
+    if paragraph is not None:
+        flush_paragraph()
+    return [segment for segment in segments if segment[2] > segment[1]]
+
+def split_page(text, metadata, counter, chunk_tokens=200, overlap_tokens=20):
+    """Pack the segments of one page into chunks of at most `chunk_tokens` tokens.
+    
+    A heading starts a new chunk and is kept with the text below it; the
+    last sentences of a chunk (up to `overlap_tokens`) are repeated at the
+    start of the next. Segments longer than a chunk are cut at token
+    boundaries. Returns (text, metadata) pairs, with the character offsets
+    of each chunk in the page and the heading it falls under.
+    """
+    segments = segment_text(text)
+    counts = counter.count([text[start:end] for _, start, end in segments])
+    chunks = []
+    current, size = [], 0
+    heading = None
+    
+    def emit(parts):
+        start, end = parts[0][1], parts[-1][2]
+        chunk_metadata = {
+            **metadata,
+            "start_index": start,
+            "end_index": end,
+            "tokens": sum(part[3] for part in parts),
+        }
+        if heading:
+            chunk_metadata["heading"] = heading
+        chunks.append((text[start:end], chunk_metadata))
+    
+    for (kind, start, end), tokens in zip(segments, counts):
+        # Consecutive headings ("Chapter 3", "3.1 Bonds") stay together
+        has_content = any(part[0] != "heading" for part in current)
+        if has_content and (kind == "heading" or size + tokens > chunk_tokens):
+            emit(current)
+            # Overlap with trailing sentences; headings and tables are not repeated
+            overlap, overlap_size = [], 0
+            if kind != "heading":
+                for part in reversed(current):
+                    if part[0] != "sentence" or overlap_size + part[3] > min(overlap_tokens, chunk_tokens - tokens):
+                        break
+                    overlap.insert(0, part)
+                    overlap_size += part[3]
+            current, size = overlap, overlap_size
+        if kind == "heading":
+            heading = text[start:end]
+        
+        if tokens > chunk_tokens:
+            if any(part[0] != "heading" for part in current):
+                emit(current)
+                current = []
+            for piece_start, piece_end in counter.windows(text[start:end], chunk_tokens):
+                # Pending headings are kept with the first piece
+                first = current[0][1] if current else start + piece_start
+                emit([(kind, first, start + piece_end, min(tokens, chunk_tokens))])
+                current = []
+            size = 0
+            continue
+        
+        current.append((kind, start, end, tokens))
+        size += tokens
+    
+    if current:
+        emit(current)
+    return chunks
+
+@lru_cache(maxsize=None)
+def _get_counter(model_name):
+    return TokenCounter(model_name)
+
+def _split_pages(pages, chunk_tokens, overlap_tokens, model_name):
+    """Worker task: split a batch of (text, metadata) pages"""
+    counter = _get_counter(model_name)
+    return [
+        chunk
+        for text, metadata in pages
+        for chunk in split_page(text, metadata, counter, chunk_tokens, overlap_tokens)
+    ]
+
+def split_documents_structured(docs, chunk_tokens=None, overlap_tokens=None, workers=None, min_parallel_pages=1000):
+    """Token-aware, structure-aware split of PDF pages.
+    
+    Pages are split independently, so large corpora are spread over a
+    process pool (`workers`, default SPLIT_WORKERS or the CPU count); small
+    batches such as a single changed file are split in-process, where
+    starting workers would cost more than it saves.
+    """
+    default_tokens, default_overlap = get_chunk_tokens()
+    chunk_tokens = chunk_tokens or default_tokens
+    overlap_tokens = default_overlap if overlap_tokens is None else overlap_tokens
+    model_name = os.getenv("EMBEDDING_MODEL", MODEL_NAME)
+    workers = workers or int(os.getenv("SPLIT_WORKERS", "0")) or os.cpu_count() or 1
+    pages = [(doc.page_content, doc.metadata) for doc in docs]
+    
+    if workers == 1 or len(pages) < min_parallel_pages:
+        chunks = _split_pages(pages, chunk_tokens, overlap_tokens, model_name)
+    else:
+        # A few batches per worker balance uneven pages without much pickling overhead
+        batch_size = max(1, len(pages) // (workers * 4))
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(workers, mp_context=context) as pool:
+            futures = [
+                pool.submit(_split_pages, pages[start:start + batch_size], chunk_tokens, overlap_tokens, model_name)
+                for start in range(0, len(pages), batch_size)
+            ]
+            chunks = [chunk for future in futures for chunk in future.result()]
+    
+    return [Document(page_content=text, metadata=metadata) for text, metadata in chunks]
+
+def split_documents(docs, chunk_size=500, chunk_overlap=20, mode=None):
+    """Split documents into smaller chunks for better retrieval.
+    
+    `chunk_size` and `chunk_overlap` are characters for the default
+    "recursive" mode; SPLITTER_MODE=structured uses token sizes instead
+    (see `split_documents_structured`).
+    """
     if not docs:
         raise ValueError("No documents provided for splitting")
     
     try:
-        splitter = RecursiveCharacterTextSplitter(
-            chunk_size=chunk_size,
-            chunk_overlap=chunk_overlap,
-            length_function=len,
-            separators=["\n\n", "\n", " ", ""]
-        )
-        
-        text_chunks = splitter.split_documents(docs)
+        if get_splitter_mode(mode) == "structured":
+            text_chunks = split_documents_structured(docs)
+        else:
+            from langchain.text_splitter import RecursiveCharacterTextSplitter
+            
+            splitter = RecursiveCharacterTextSplitter(
+                chunk_size=chunk_size,
+                chunk_overlap=chunk_overlap,
+                length_function=len,
+                separators=["\n\n", "\n", " ", ""]
+            )
+            text_chunks = splitter.split_documents(docs)
         
         if not text_chunks:
             raise ValueError("No text chunks were created from documents")
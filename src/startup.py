@@ -0,0 +1,64 @@
+import threading
+import time
+
+# Import and initialization timings for this process, first measurement wins
+timings = {}
+_lock = threading.Lock()
+
+def record(name, seconds):
+    with _lock:
+        timings.setdefault(name, seconds)
+
+class timed:
+    """Context manager recording how long a startup step took"""
+    
+    def __init__(self, name):
+        self.name = name
+        self.started = None
+    
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+    
+    def __exit__(self, exc_type, exc, tb):
+        record(self.name, time.perf_counter() - self.started)
+        return False
+
+class Preloader:
+    """Run a loader on a background thread so the caller can render meanwhile.
+    
+    `result()` blocks until the loader finishes and re-raises its error, so
+    callers handle failures exactly as if they had called it directly.
+    """
+    
+    def __init__(self, name, func, *args):
+        self.name = name
+        self._value = None
+        self._error = None
+        self._done = threading.Event()
+        self._thread = threading.Thread(target=self._run, args=(func, *args), name=f"preload-{name}", daemon=True)
+        self._thread.start()
+    
+    def _run(self, func, *args):
+        try:
+            with timed(self.name):
+                self._value = func(*args)
+        except BaseException as e:
+            self._error = e
+        finally:
+            self._done.set()
+    
+    def done(self):
+        return self._done.is_set()
+    
+    def result(self, timeout=None):
+        if not self._done.wait(timeout):
+            raise TimeoutError(f"Timed out waiting for {self.name} to load")
+        if self._error is not None:
+            raise self._error
+        return self._value
+
+def report():
+    """One-line summary of the recorded startup timings"""
+    with _lock:
+        return ", ".join(f"{name} {seconds:.2f}s" for name, seconds in timings.items())
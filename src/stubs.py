@@ -0,0 +1,230 @@
+import argparse
+import asyncio
+import json
+import random
+import time
+import uuid
+
+from aiohttp import web
+
+DEFAULT_ANSWER = (
+    "A bond is a debt security: the issuer borrows money from investors and "
+    "pays them periodic interest before repaying the principal at maturity."
+)
+
+def create_llm_stub(answer=DEFAULT_ANSWER, delay=0.0, token_delay=0.0, error_rate=0.0,
+                    error_status=500, model="stub-model"):
+    """Create an OpenAI-compatible chat completions server for offline testing.
+    
+    `delay` is applied before the first token and `token_delay` between
+    streamed tokens; a fraction `error_rate` of requests fail with
+    `error_status`. POST /_config updates these settings while running,
+    so tests can inject slowness or failures mid-run.
+    """
+    app = web.Application()
+    app["config"] = {
+        "answer": answer,
+        "delay": delay,
+        "token_delay": token_delay,
+        "error_rate": error_rate,
+        "error_status": error_status,
+        "model": model,
+    }
+    app["stats"] = {"requests": 0, "errors": 0, "disconnects": 0}
+    
+    def completion_id():
+        return f"chatcmpl-{uuid.uuid4().hex[:12]}"
+    
+    async def chat_completions(request):
+        config = request.app["config"]
+        stats = request.app["stats"]
+        body = await request.json()
+        stats["requests"] += 1
+        
+        await asyncio.sleep(config["delay"])
+        if random.random() < config["error_rate"]:
+            stats["errors"] += 1
+            return web.json_response(
+                {"error": {"message": "injected failure", "type": "server_error"}},
+                status=config["error_status"]
+            )
+        
+        model = body.get("model", config["model"])
+        created = int(time.time())
+        
+        if not body.get("stream"):
+            return web.json_response({
+                "id": completion_id(),
+                "object": "chat.completion",
+                "created": created,
+                "model": model,
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": config["answer"]},
+                    "finish_reason": "stop",
+                }],
+                "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+            })
+        
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        chunk_id = completion_id()
+        
+        def chunk(delta, finish_reason=None):
+            payload = {
+                "id": chunk_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+            }
+            return f"data: {json.dumps(payload)}\n\n".encode("utf-8")
+        
+        try:
+            await response.prepare(request)
+            await response.write(chunk({"role": "assistant", "content": ""}))
+            for i, word in enumerate(config["answer"].split(" ")):
+                if i:
+                    await asyncio.sleep(config["token_delay"])
+                await response.write(chunk({"content": word if i == 0 else f" {word}"}))
+            await response.write(chunk({}, finish_reason="stop"))
+            await response.write(b"data: [DONE]\n\n")
+            await response.write_eof()
+        except ConnectionResetError:
+            # The client gave up, e.g. a hedged request that lost the race
+            stats["disconnects"] += 1
+        return response
+    
+    async def models(request):
+        return web.json_response({"object": "list", "data": [{"id": request.app["config"]["model"], "object": "model"}]})
+    
+    async def update_config(request):
+        request.app["config"].update(await request.json())
+        return web.json_response(request.app["config"])
+    
+    async def get_stats(request):
+        return web.json_response(request.app["stats"])
+    
+    app.router.add_post("/v1/chat/completions", chat_completions)
+    app.router.add_get("/v1/models", models)
+    app.router.add_post("/_config", update_config)
+    app.router.add_get("/_stats", get_stats)
+    return app
+
+def create_index_stub(dimension=384, delay=0.0, error_rate=0.0, error_status=503):
+    """Create a fake Pinecone data-plane server backed by in-memory LocalIndexes.
+    
+    It implements the REST endpoints the Pinecone client uses for upsert,
+    query, fetch, delete and index stats, per namespace. Point the app at
+    it with PINECONE_HOST. Like the LLM stub, `delay` and `error_rate` can be
+    changed at runtime through POST /_config to exercise retries.
+    """
+    from src.local_index import LocalIndex
+    
+    app = web.Application(client_max_size=64 * 1024 * 1024)
+    app["config"] = {"delay": delay, "error_rate": error_rate, "error_status": error_status}
+    app["stats"] = {"requests": 0, "errors": 0, "upserted": 0}
+    namespaces = {}
+    
+    def namespace(name):
+        if name not in namespaces:
+            namespaces[name] = LocalIndex(path=None, dimension=dimension)
+        return namespaces[name]
+    
+    @web.middleware
+    async def inject_faults(request, handler):
+        if request.path.startswith("/_"):
+            return await handler(request)
+        config = request.app["config"]
+        request.app["stats"]["requests"] += 1
+        await asyncio.sleep(config["delay"])
+        if random.random() < config["error_rate"]:
+            request.app["stats"]["errors"] += 1
+            return web.json_response({"code": 14, "message": "injected failure"}, status=config["error_status"])
+        return await handler(request)
+    
+    async def upsert(request):
+        body = await request.json()
+        records = body.get("vectors", [])
+        namespace(body.get("namespace", "")).upsert(vectors=records)
+        request.app["stats"]["upserted"] += len(records)
+        return web.json_response({"upsertedCount": len(records)})
+    
+    async def query(request):
+        body = await request.json()
+        index = namespace(body.get("namespace", ""))
+        matches = []
+        for row, score in index.search(body["vector"], body.get("topK", 10), filter=body.get("filter")):
+            match = {"id": index.ids[row], "score": score}
+            if body.get("includeMetadata"):
+                match["metadata"] = index.metadata[row]
+            if body.get("includeValues"):
+                match["values"] = [float(x) for x in index.vectors[row]]
+            matches.append(match)
+        return web.json_response({"matches": matches, "namespace": body.get("namespace", "")})
+    
+    async def fetch(request):
+        index = namespace(request.query.get("namespace", ""))
+        vectors = {}
+        for chunk_id in request.query.getall("ids", []):
+            row = index.rows.get(chunk_id)
+            if row is not None:
+                vectors[chunk_id] = {
+                    "id": chunk_id,
+                    "values": [float(x) for x in index.vectors[row]],
+                    "metadata": index.metadata[row],
+                }
+        return web.json_response({"vectors": vectors, "namespace": request.query.get("namespace", "")})
+    
+    async def delete(request):
+        body = await request.json()
+        if body.get("deleteAll"):
+            namespaces.pop(body.get("namespace", ""), None)
+        else:
+            namespace(body.get("namespace", "")).delete(ids=body.get("ids", []))
+        return web.json_response({})
+    
+    async def describe_index_stats(request):
+        counts = {name: len(index) for name, index in namespaces.items()}
+        return web.json_response({
+            "namespaces": {name: {"vectorCount": count} for name, count in counts.items()},
+            "dimension": dimension,
+            "indexFullness": 0.0,
+            "totalVectorCount": sum(counts.values()),
+        })
+    
+    async def update_config(request):
+        request.app["config"].update(await request.json())
+        return web.json_response(request.app["config"])
+    
+    async def get_stats(request):
+        return web.json_response(request.app["stats"])
+    
+    app.middlewares.append(inject_faults)
+    app.router.add_post("/vectors/upsert", upsert)
+    app.router.add_post("/query", query)
+    app.router.add_get("/vectors/fetch", fetch)
+    app.router.add_post("/vectors/delete", delete)
+    app.router.add_post("/describe_index_stats", describe_index_stats)
+    app.router.add_get("/describe_index_stats", describe_index_stats)
+    app.router.add_post("/_config", update_config)
+    app.router.add_get("/_stats", get_stats)
+    return app
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run local stub servers for offline testing")
+    parser.add_argument("server", choices=["llm", "index"])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--delay", type=float, default=0.0, help="seconds before responding")
+    parser.add_argument("--token-delay", type=float, default=0.0, help="seconds between streamed tokens")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests that fail")
+    parser.add_argument("--answer", default=DEFAULT_ANSWER, help="reply of the LLM stub")
+    args = parser.parse_args()
+    
+    if args.server == "llm":
+        app = create_llm_stub(
+            answer=args.answer, delay=args.delay, token_delay=args.token_delay, error_rate=args.error_rate
+        )
+    else:
+        app = create_index_stub(delay=args.delay, error_rate=args.error_rate)
+    web.run_app(app, host=args.host, port=args.port)
@@ -0,0 +1,288 @@
+import bisect
+import contextvars
+import json
+import os
+import threading
+import time
+import uuid
+from collections import deque
+
+# Off unless TELEMETRY=1; every entry point checks this flag first so the
+# disabled cost is a global lookup and a shared no-op context manager.
+ENABLED = os.getenv("TELEMETRY", "0") == "1"
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_current_trace = contextvars.ContextVar("fintutor_trace", default=None)
+
+def enable(enabled=True):
+    """Turn instrumentation on or off at runtime (e.g. from the developer panel)"""
+    global ENABLED
+    ENABLED = enabled
+
+class Histogram:
+    """Cumulative-bucket histogram in the Prometheus style"""
+    
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+    
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+class Registry:
+    """Thread-safe counters and histograms keyed by name and labels"""
+    
+    def __init__(self):
+        self.counters = {}
+        self.histograms = {}
+        self._lock = threading.Lock()
+    
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+    
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            if key not in self.histograms:
+                self.histograms[key] = Histogram()
+            self.histograms[key].observe(value)
+    
+    def clear(self):
+        with self._lock:
+            self.counters.clear()
+            self.histograms.clear()
+    
+    def snapshot(self):
+        """Metrics as JSON-serializable dicts"""
+        with self._lock:
+            return {
+                "counters": [
+                    {"name": name, "labels": dict(labels), "value": value}
+                    for (name, labels), value in sorted(self.counters.items())
+                ],
+                "histograms": [
+                    {"name": name, "labels": dict(labels), "count": h.count, "sum": h.sum,
+                     "buckets": dict(zip([*map(str, h.buckets), "+Inf"], h.counts))}
+                    for (name, labels), h in sorted(self.histograms.items())
+                ],
+            }
+    
+    def render_prometheus(self):
+        """Metrics in the Prometheus text exposition format"""
+        def format_labels(labels, extra=()):
+            pairs = [*labels, *extra]
+            if not pairs:
+                return ""
+            return "{" + ",".join(f'{key}="{value}"' for key, value in pairs) + "}"
+        
+        lines = []
+        with self._lock:
+            for name in sorted({name for name, _ in self.counters}):
+                lines.append(f"# TYPE {name} counter")
+                for (metric, labels), value in sorted(self.counters.items()):
+                    if metric == name:
+                        lines.append(f"{name}{format_labels(labels)} {value}")
+            for name in sorted({name for name, _ in self.histograms}):
+                lines.append(f"# TYPE {name} histogram")
+                for (metric, labels), h in sorted(self.histograms.items()):
+                    if metric != name:
+                        continue
+                    cumulative = 0
+                    for bound, count in zip([*map(str, h.buckets), "+Inf"], h.counts):
+                        cumulative += count
+                        lines.append(f"{name}_bucket{format_labels(labels, [('le', bound)])} {cumulative}")
+                    lines.append(f"{name}_sum{format_labels(labels)} {h.sum}")
+                    lines.append(f"{name}_count{format_labels(labels)} {h.count}")
+        return "\n".join(lines) + "\n"
+
+registry = Registry()
+recent_traces = deque(maxlen=50)
+
+class _NoopSpan:
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc):
+        return False
+    
+    def set(self, **attrs):
+        pass
+
+_NOOP = _NoopSpan()
+
+class Span:
+    """Times a block, recording it in the stage histogram and the current trace"""
+    
+    def __init__(self, name, attrs):
+        self.name = name
+        self.attrs = attrs
+        self.started = None
+    
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+    
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+    
+    def __exit__(self, exc_type, exc, tb):
+        record_span(self.name, self.started, time.perf_counter(), error=exc_type is not None, **self.attrs)
+        return False
+
+def record_span(name, started, finished, trace=None, error=False, **attrs):
+    """Record a finished stage timed with time.perf_counter()"""
+    seconds = finished - started
+    registry.observe("fintutor_stage_seconds", seconds, stage=name)
+    trace = trace or _current_trace.get()
+    if trace is not None:
+        record = {"name": name, "offset_ms": (started - trace["started"]) * 1000, "ms": seconds * 1000, **attrs}
+        if error:
+            record["error"] = True
+        with trace["lock"]:
+            trace["spans"].append(record)
+
+def span(name, **attrs):
+    """Context manager timing one stage; a shared no-op when telemetry is disabled"""
+    if not ENABLED:
+        return _NOOP
+    return Span(name, attrs)
+
+class Trace:
+    """Groups the spans of one chat query or ingestion run"""
+    
+    def __init__(self, name, attrs):
+        self.record = {"id": uuid.uuid4().hex[:12], "name": name, "spans": [], "attrs": attrs,
+                       "lock": threading.Lock()}
+        self.token = None
+    
+    def set(self, **attrs):
+        self.record["attrs"].update(attrs)
+    
+    def __enter__(self):
+        self.record["timestamp"] = time.time()
+        self.record["started"] = time.perf_counter()
+        self.token = _current_trace.set(self.record)
+        return self
+    
+    def __exit__(self, exc_type, exc, tb):
+        _current_trace.reset(self.token)
+        seconds = time.perf_counter() - self.record["started"]
+        registry.observe("fintutor_request_seconds", seconds, operation=self.record["name"])
+        finished = {key: value for key, value in self.record.items() if key not in ("lock", "started")}
+        finished["ms"] = seconds * 1000
+        if exc_type is not None:
+            finished["error"] = repr(exc)
+        recent_traces.append(finished)
+        write_log(finished)
+        return False
+
+def trace(name, **attrs):
+    """Context manager that starts a trace; spans inside it are attached to it"""
+    if not ENABLED:
+        return _NOOP
+    return Trace(name, attrs)
+
+def stage_totals(record):
+    """Sum span durations of a finished trace by stage name: {name: (count, ms)}"""
+    totals = {}
+    for item in record["spans"]:
+        count, ms = totals.get(item["name"], (0, 0.0))
+        totals[item["name"]] = (count + 1, ms + item["ms"])
+    return totals
+
+def incr(name, value=1, **labels):
+    """Increment a counter (no-op when telemetry is disabled)"""
+    if ENABLED:
+        registry.inc(name, value, **labels)
+
+def observe(name, value, **labels):
+    """Record a histogram observation (no-op when telemetry is disabled)"""
+    if ENABLED:
+        registry.observe(name, value, **labels)
+
+def write_log(record):
+    """Append a finished trace to the JSON-lines log named by TELEMETRY_LOG"""
+    path = os.getenv("TELEMETRY_LOG")
+    if path:
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record, default=str) + "\n")
+
+_handler_class = None
+
+def callbacks():
+    """LangChain callbacks for the current trace, or none when telemetry is disabled"""
+    global _handler_class
+    if not ENABLED:
+        return []
+    if _handler_class is None:
+        # LangChain's callback module is slow to import, so it is only loaded once needed
+        from langchain_core.callbacks import BaseCallbackHandler
+        _handler_class = type("TelemetryCallbackHandler", (TelemetryCallbacks, BaseCallbackHandler), {})
+    return [_handler_class(_current_trace.get())]
+
+class TelemetryCallbacks:
+    """Turns LangChain run events into spans, LLM token counts and time to first token"""
+    
+    run_inline = True
+    
+    # Runs worth a span; other runnables (lambdas, parsers) are folded into these
+    STAGES = {
+        "retrieve_documents": "retrieve",
+        "ChatPromptTemplate": "prompt",
+        "stuff_documents_chain": "stuff_documents",
+    }
+    
+    def __init__(self, trace=None):
+        self.trace = trace
+        self.started = {}
+        self.first_token = {}
+    
+    def _start(self, run_id, name):
+        self.started[run_id] = (name, time.perf_counter())
+    
+    def _end(self, run_id, **attrs):
+        name, started = self.started.pop(run_id, (None, None))
+        if name is not None:
+            record_span(name, started, time.perf_counter(), trace=self.trace, **attrs)
+    
+    def on_chain_start(self, serialized, inputs, *, run_id, **kwargs):
+        stage = self.STAGES.get(kwargs.get("name"))
+        if stage:
+            self._start(run_id, stage)
+    
+    def on_chain_end(self, outputs, *, run_id, **kwargs):
+        self._end(run_id)
+    
+    def on_chain_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, error=True)
+    
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self._start(run_id, "llm")
+    
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        self._start(run_id, "llm")
+    
+    def on_llm_new_token(self, token, *, run_id, **kwargs):
+        if run_id not in self.first_token and run_id in self.started:
+            self.first_token[run_id] = time.perf_counter()
+            registry.observe("fintutor_llm_first_token_seconds", self.first_token[run_id] - self.started[run_id][1])
+        registry.inc("fintutor_llm_tokens_total", kind="streamed")
+    
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        usage = (response.llm_output or {}).get("token_usage") or {}
+        for kind in ("prompt_tokens", "completion_tokens"):
+            if usage.get(kind):
+                registry.inc("fintutor_llm_tokens_total", usage[kind], kind=kind.split("_")[0])
+        self.first_token.pop(run_id, None)
+        self._end(run_id)
+    
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self.first_token.pop(run_id, None)
+        self._end(run_id, error=True)
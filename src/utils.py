@@ -1,17 +1,27 @@
 import os
 from dotenv import load_dotenv
 
+CACHE_FOLDER = ".fintutor_cache"
+
 def ensure_data_folder():
     """Ensure data folder exists"""
     os.makedirs("Data", exist_ok=True)
     print("Data folder ensured to exist")
 
-def load_environment():
-    """Load environment variables from .env file"""
+def get_cache_path(*parts):
+    """Return a path inside the local cache folder, creating the folder if needed"""
+    cache_folder = os.getenv("FINTUTOR_CACHE_DIR", CACHE_FOLDER)
+    os.makedirs(cache_folder, exist_ok=True)
+    return os.path.join(cache_folder, *parts)
+
+def load_environment(require_llm=True):
+    """Load environment variables from .env file (without the LLM key when `require_llm=False`)"""
     load_dotenv()
     
-    # Check for required environment variables
-    required_vars = ["PINECONE_API_KEY", "OPEN_ROUTER_API_KEY"]
+    # Check for required environment variables; the local vector backend needs no Pinecone key
+    required_vars = ["OPEN_ROUTER_API_KEY"] if require_llm else []
+    if os.getenv("VECTOR_BACKEND", "pinecone").lower() != "local":
+        required_vars.insert(0, "PINECONE_API_KEY")
     missing_vars = []
     
     for var in required_vars:
@@ -1,29 +1,106 @@
-from langchain_pinecone import PineconeVectorStore
-from pinecone import Pinecone, ServerlessSpec
 import os
+import threading
 import time
 
+# Pinecone modules are imported inside the functions that use them so the
+# local backend works without them installed.
+
+BACKENDS = ("pinecone", "local")
+
+_local_indexes = {}
+
+# One Pinecone client and one handle per index are shared by the whole process
+_pinecone_client = None
+_pinecone_indexes = {}
+_known_indexes = set()
+_client_lock = threading.Lock()
+
+def get_backend(backend=None):
+    """Return the configured vector store backend ("pinecone" or "local")"""
+    backend = (backend or os.getenv("VECTOR_BACKEND", "pinecone")).lower()
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown vector store backend '{backend}', expected one of {BACKENDS}")
+    return backend
+
+def use_namespaces(backend=None):
+    """Whether chunks are written to one Pinecone namespace per course (PINECONE_NAMESPACES=course).
+    
+    The local index keeps every course in one index and filters with posting lists instead.
+    """
+    return get_backend(backend) == "pinecone" and os.getenv("PINECONE_NAMESPACES", "course").lower() != "none"
+
+def namespace_for(metadata, backend=None):
+    """Namespace a chunk is written to: its course when namespacing is on, else the default ("")"""
+    return metadata.get("course", "") if use_namespaces(backend) else ""
+
+def pinecone_vector_store(index, embeddings):
+    """LangChain store over a Pinecone index, routing courses to namespaces when enabled"""
+    from src.pinecone_store import CourseVectorStore
+    return CourseVectorStore(index=index, embedding=embeddings, namespaced=use_namespaces("pinecone"))
+
+def open_local_index(index_name, dimension=384, create=True):
+    """Open the process-wide LocalIndex for an index name"""
+    from src.local_index import LocalIndex
+    from src.utils import get_cache_path
+    
+    if index_name not in _local_indexes:
+        path = get_cache_path("indexes", index_name)
+        # "int8" or "pq" keeps compact codes in RAM; changing it re-encodes on the next save
+        quantization = os.getenv("LOCAL_INDEX_QUANTIZATION", "none").lower()
+        if LocalIndex.exists(path):
+            _local_indexes[index_name] = LocalIndex.load(path, quantization=quantization)
+        elif create:
+            _local_indexes[index_name] = LocalIndex(path, dimension=dimension, quantization=quantization)
+        else:
+            raise Exception(f"Index '{index_name}' does not exist. Please run data ingestion first.")
+    return _local_indexes[index_name]
+
 def initialize_pinecone():
-    """Initialize Pinecone client using v3 API"""
-    api_key = os.getenv("PINECONE_API_KEY")
-    if not api_key:
-        raise ValueError("PINECONE_API_KEY not found in environment variables")
+    """Return the process-wide Pinecone client (v3 API), creating it on first use"""
+    global _pinecone_client
     
-    try:
-        pc = Pinecone(api_key=api_key)
-        print("Pinecone client initialized successfully")
-        return pc
-    except Exception as e:
-        raise Exception(f"Failed to initialize Pinecone: {e}")
+    with _client_lock:
+        if _pinecone_client is not None:
+            return _pinecone_client
+        
+        from pinecone import Pinecone
+        
+        api_key = os.getenv("PINECONE_API_KEY")
+        if not api_key:
+            raise ValueError("PINECONE_API_KEY not found in environment variables")
+        
+        try:
+            _pinecone_client = Pinecone(api_key=api_key)
+            print("Pinecone client initialized successfully")
+            return _pinecone_client
+        except Exception as e:
+            raise Exception(f"Failed to initialize Pinecone: {e}")
+
+def pinecone_index(pc, index_name):
+    """Return a Pinecone data-plane handle, honouring a PINECONE_HOST override.
+    
+    Setting PINECONE_HOST (e.g. to the fake index server in src/stubs.py)
+    points all reads and writes at that host and skips control-plane calls.
+    """
+    host = os.getenv("PINECONE_HOST")
+    key = host or index_name
+    with _client_lock:
+        if key not in _pinecone_indexes:
+            _pinecone_indexes[key] = pc.Index(host=host) if host else pc.Index(index_name)
+        return _pinecone_indexes[key]
+
+def pinecone_index_exists(pc, index_name):
+    """Check that an index exists, listing indexes only until it has been seen once"""
+    if index_name not in _known_indexes:
+        _known_indexes.update(index.name for index in pc.list_indexes())
+    return index_name in _known_indexes
 
 def ensure_index_exists(pc, index_name, dimension=384):
     """Create Pinecone index if it doesn't exist"""
+    from pinecone import ServerlessSpec
+    
     try:
-        # Get list of existing indexes
-        existing_indexes = pc.list_indexes()
-        index_names = [index.name for index in existing_indexes]
-        
-        if index_name not in index_names:
+        if not pinecone_index_exists(pc, index_name):
             print(f"Creating new index: {index_name}")
             pc.create_index(
                 name=index_name,
@@ -38,29 +115,32 @@ def ensure_index_exists(pc, index_name, dimension=384):
                 time.sleep(1)
             
             print(f"Index {index_name} created successfully")
+            _known_indexes.add(index_name)
         else:
             print(f"Index {index_name} already exists")
         
-        return pc.Index(index_name)
+        return pinecone_index(pc, index_name)
         
     except Exception as e:
         raise Exception(f"Failed to ensure index exists: {e}")
 
-def build_vector_store(docs, index_name, embeddings):
+def build_vector_store(docs, index_name, embeddings, ids=None, backend=None):
     """Build vector store from documents"""
     if not docs:
         raise ValueError("No documents provided for vector store creation")
     
     try:
-        pc = initialize_pinecone()
-        ensure_index_exists(pc, index_name)
-        
         print(f"Building vector store with {len(docs)} documents...")
-        vector_store = PineconeVectorStore.from_documents(
-            documents=docs,
-            embedding=embeddings,
-            index_name=index_name
-        )
+        
+        if get_backend(backend) == "local":
+            from src.local_index import LocalVectorStore
+            index = open_local_index(index_name)
+            vector_store = LocalVectorStore.from_documents(docs, embeddings, ids=ids, index=index)
+            index.save()
+        else:
+            pc = initialize_pinecone()
+            vector_store = pinecone_vector_store(ensure_index_exists(pc, index_name), embeddings)
+            vector_store.add_documents(docs, ids=ids)
         
         print("Vector store built successfully")
         return vector_store
@@ -68,23 +148,82 @@ def build_vector_store(docs, index_name, embeddings):
     except Exception as e:
         raise Exception(f"Failed to build vector store: {e}")
 
-def load_vector_store(index_name, embeddings):
+def get_index(index_name, backend=None):
+    """Return a data-plane handle to an index, creating it if needed"""
+    if get_backend(backend) == "local":
+        return open_local_index(index_name)
+    
+    pc = initialize_pinecone()
+    if os.getenv("PINECONE_HOST"):
+        return pinecone_index(pc, index_name)
+    return ensure_index_exists(pc, index_name)
+
+def flush_index(index):
+    """Persist pending writes (a no-op for Pinecone, which writes through)"""
+    if hasattr(index, "save"):
+        index.save()
+
+def add_chunks(docs, ids, index_name, embeddings, backend=None):
+    """Embed and upsert chunks under the given stable IDs"""
+    if not docs:
+        return []
+    
+    try:
+        print(f"Upserting {len(docs)} chunks...")
+        
+        if get_backend(backend) == "local":
+            from src.local_index import LocalVectorStore
+            index = open_local_index(index_name)
+            added = LocalVectorStore(index, embeddings).add_documents(docs, ids=ids)
+            index.save()
+            return added
+        
+        pc = initialize_pinecone()
+        vector_store = pinecone_vector_store(ensure_index_exists(pc, index_name), embeddings)
+        return vector_store.add_documents(docs, ids=ids)
+        
+    except Exception as e:
+        raise Exception(f"Failed to add chunks: {e}")
+
+def delete_chunks(ids, index_name, batch_size=1000, backend=None, namespace=""):
+    """Delete vectors by ID from a namespace (Pinecone accepts at most 1000 IDs per call)"""
+    if not ids:
+        return
+    
+    try:
+        if get_backend(backend) == "local":
+            index = open_local_index(index_name)
+        else:
+            index = pinecone_index(initialize_pinecone(), index_name)
+        
+        print(f"Deleting {len(ids)} stale chunks...")
+        for start in range(0, len(ids), batch_size):
+            index.delete(ids=ids[start:start + batch_size], namespace=namespace)
+        flush_index(index)
+        
+    except Exception as e:
+        raise Exception(f"Failed to delete chunks: {e}")
+
+def load_vector_store(index_name, embeddings, backend=None):
     """Load existing vector store"""
     try:
+        if get_backend(backend) == "local":
+            from src.local_index import LocalVectorStore
+            vector_store = LocalVectorStore(open_local_index(index_name, create=False), embeddings)
+            print(f"Vector store loaded successfully from local index: {index_name}")
+            return vector_store
+        
         pc = initialize_pinecone()
         
-        # Check if index exists
-        existing_indexes = pc.list_indexes()
-        index_names = [index.name for index in existing_indexes]
+        if os.getenv("PINECONE_HOST"):
+            return pinecone_vector_store(pinecone_index(pc, index_name), embeddings)
         
-        if index_name not in index_names:
+        # Check if index exists
+        if not pinecone_index_exists(pc, index_name):
             raise Exception(f"Index '{index_name}' does not exist. Please run data ingestion first.")
         
-        # Load existing vector store
-        vector_store = PineconeVectorStore(
-            index_name=index_name,
-            embedding=embeddings
-        )
+        # Load existing vector store through the shared client
+        vector_store = pinecone_vector_store(pinecone_index(pc, index_name), embeddings)
         
         print(f"Vector store loaded successfully from index: {index_name}")
         return vector_store
@@ -92,11 +231,14 @@ def load_vector_store(index_name, embeddings):
     except Exception as e:
         raise Exception(f"Failed to load vector store: {e}")
 
-def get_vector_store_stats(index_name):
+def get_vector_store_stats(index_name, backend=None):
     """Get statistics about the vector store"""
     try:
+        if get_backend(backend) == "local":
+            return open_local_index(index_name, create=False).describe_index_stats()
+        
         pc = initialize_pinecone()
-        index = pc.Index(index_name)
+        index = pinecone_index(pc, index_name)
         stats = index.describe_index_stats()
         return stats
     except Exception as e:
@@ -0,0 +1,145 @@
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from src import telemetry
+
+def make_records(ids, vectors, docs):
+    """Build upsert records with the metadata layout PineconeVectorStore reads"""
+    return [
+        {
+            "id": chunk_id,
+            "values": [float(x) for x in vector],
+            "metadata": {**doc.metadata, "text": doc.page_content},
+        }
+        for chunk_id, vector, doc in zip(ids, vectors, docs)
+    ]
+
+def with_retries(func, max_retries=5, backoff=0.5, max_backoff=30.0, description="request"):
+    """Call func, retrying failures with jittered exponential backoff"""
+    for attempt in range(max_retries + 1):
+        try:
+            return func()
+        except Exception as e:
+            if attempt == max_retries:
+                raise
+            delay = min(max_backoff, backoff * 2 ** attempt) * random.uniform(0.5, 1.5)
+            telemetry.incr("fintutor_retries_total", operation=description.split()[0])
+            print(f"Retrying {description} in {delay:.1f}s after error: {e}")
+            time.sleep(delay)
+
+class VectorWriter:
+    """Upsert vectors in batches across a thread pool, with retries and a checkpoint.
+    
+    Each batch is retried with exponential backoff on failure. IDs are
+    appended to the checkpoint file once their batch is durable, so an
+    interrupted ingest can skip them (and their embedding) when it is
+    re-run. Pinecone writes through, so that is as soon as the upsert
+    returns; an index with `save()` (the local index) only reaches disk
+    when saved, so its IDs are checkpointed by `flush()`. Call
+    `clear_checkpoint()` once the whole ingest has succeeded.
+    
+    With a `namespace_for` function, records are grouped into batches per
+    namespace, as returned for each chunk's metadata.
+    """
+    
+    def __init__(self, index, batch_size=100, max_workers=4, max_retries=5, backoff=0.5,
+                 checkpoint_path=None, namespace_for=None):
+        self.index = index
+        self.namespace_for = namespace_for
+        self.batch_size = batch_size
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.checkpoint_path = checkpoint_path
+        self.committed = set()
+        self.deferred = hasattr(index, "save")
+        self.unflushed = []
+        self.upserted = 0
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=max_workers)
+        
+        if checkpoint_path and os.path.exists(checkpoint_path):
+            with open(checkpoint_path, "r", encoding="utf-8") as f:
+                self.committed = {line.strip() for line in f if line.strip()}
+            if self.committed:
+                print(f"Resuming from checkpoint with {len(self.committed)} committed chunks")
+    
+    def pending(self, ids):
+        """Return the positions of IDs not yet committed"""
+        return [i for i, chunk_id in enumerate(ids) if chunk_id not in self.committed]
+    
+    def _record_committed(self, ids):
+        with self._lock:
+            self.committed.update(ids)
+            self.upserted += len(ids)
+            if self.deferred:
+                self.unflushed.extend(ids)
+            else:
+                self._checkpoint(ids)
+    
+    def _checkpoint(self, ids):
+        if self.checkpoint_path and ids:
+            with open(self.checkpoint_path, "a", encoding="utf-8") as f:
+                f.write("".join(f"{chunk_id}\n" for chunk_id in ids))
+    
+    def _upsert_batch(self, batch, namespace=""):
+        with_retries(
+            lambda: self.index.upsert(vectors=batch, namespace=namespace),
+            max_retries=self.max_retries,
+            backoff=self.backoff,
+            description=f"upsert of {len(batch)} vectors"
+        )
+        self._record_committed([record["id"] for record in batch])
+        return len(batch)
+    
+    def write(self, ids, vectors, docs):
+        """Upsert uncommitted chunks in parallel batches, returning how many were written"""
+        groups = {}
+        for record in make_records(ids, vectors, docs):
+            if record["id"] not in self.committed:
+                namespace = self.namespace_for(record["metadata"]) if self.namespace_for else ""
+                groups.setdefault(namespace, []).append(record)
+        futures = [
+            self._pool.submit(self._upsert_batch, records[start:start + self.batch_size], namespace)
+            for namespace, records in groups.items()
+            for start in range(0, len(records), self.batch_size)
+        ]
+        try:
+            return sum(future.result() for future in as_completed(futures))
+        except Exception:
+            # Stop queued batches; durable ones are already checkpointed
+            for future in futures:
+                future.cancel()
+            raise
+    
+    def delete(self, ids, batch_size=1000, namespace=""):
+        """Delete vectors by ID from a namespace in retried batches"""
+        for start in range(0, len(ids), batch_size):
+            batch = ids[start:start + batch_size]
+            with_retries(
+                lambda: self.index.delete(ids=batch, namespace=namespace),
+                max_retries=self.max_retries,
+                backoff=self.backoff,
+                description=f"delete of {len(batch)} vectors"
+            )
+    
+    def flush(self):
+        """Save an index that does not write through, then checkpoint what it made durable"""
+        if not self.deferred:
+            return
+        with self._lock:
+            self.index.save()
+            self._checkpoint(self.unflushed)
+            self.unflushed = []
+    
+    def clear_checkpoint(self):
+        if self.checkpoint_path and os.path.exists(self.checkpoint_path):
+            os.remove(self.checkpoint_path)
+        self.committed = set()
+        self.unflushed = []
+    
+    def close(self):
+        self._pool.shutdown(wait=True)